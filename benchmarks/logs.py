@@ -0,0 +1,45 @@
+"""Benchmark of rendering logs in the roro logs command.
+
+Reports the number of lines rendered per second with the different output
+options of roro logs.
+
+Usage:
+
+    $ python benchmarks/logs.py [number-of-lines]
+"""
+import os
+import sys
+import time
+from tabulate import tabulate
+from roro.logs import LogFormatter, write_logs
+
+OPTIONS = [
+    ("plain", {}),
+    ("--show-timestamp", {"show_timestamp": True}),
+    ("multiple jobs", {"show_jobid": True, "show_timestamp": True}),
+    ("--raw", {"raw": True}),
+]
+
+def make_logs(n):
+    t0 = 1500000000000
+    # about 50 logs every second, as written by a busy training job
+    return [{"timestamp": t0 + i * 20, "jobid": "c19f745b", "message": "iteration {} - accuracy 0.69".format(i)}
+            for i in range(n)]
+
+def bench(logs, options, stream):
+    t0 = time.time()
+    write_logs(iter(logs), stream, LogFormatter(**options))
+    return time.time() - t0
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    logs = make_logs(n)
+    rows = []
+    with open(os.devnull, "w") as stream:
+        for name, options in OPTIONS:
+            elapsed = bench(logs, options, stream)
+            rows.append([name, "{:.3f}".format(elapsed), "{:,.0f}".format(n / elapsed)])
+    print(tabulate(rows, headers=["OUTPUT", "TIME (s)", "LINES/SEC"]))
+
+if __name__ == "__main__":
+    main()
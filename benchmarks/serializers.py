@@ -0,0 +1,59 @@
+"""Benchmark of the compression codecs for saving models.
+
+Compares the size of the serialized model against the time taken to save
+and load it, for a typical scikit-learn model and a numpy-heavy model.
+
+Usage:
+
+    $ python benchmarks/serializers.py [codec ...]
+"""
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+from sklearn.datasets import make_classification
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import LinearRegression
+from tabulate import tabulate
+from roro.serializers import JoblibSerializer
+
+CODECS = [None, "zlib:1", "zlib:3", "lz4:1", "lz4:3", "zstd:1", "zstd:3", "zstd:9"]
+
+def make_models():
+    X, y = make_classification(n_samples=20000, n_features=40, random_state=0)
+    forest = RandomForestClassifier(n_estimators=50, random_state=0).fit(X, y)
+
+    # a linear model carrying a large array of coefficients
+    regression = LinearRegression()
+    regression.coef_ = np.random.RandomState(0).normal(size=(1000, 5000))
+    regression.intercept_ = np.zeros(1000)
+    return [("random-forest", forest), ("numpy-heavy", regression)]
+
+def bench(serializer, model, codec, filename):
+    t0 = time.time()
+    try:
+        serializer.dump(model, filename, compression=codec)
+    except (ImportError, ValueError) as e:
+        return [codec, "-", "-", "-", "unavailable ({})".format(e)]
+    t1 = time.time()
+    serializer.load(filename)
+    t2 = time.time()
+    size = os.path.getsize(filename)
+    return [codec or "none", "{:.1f}".format(size/1024.0/1024.0), "{:.3f}".format(t1-t0), "{:.3f}".format(t2-t1), ""]
+
+def main():
+    codecs = sys.argv[1:] or CODECS
+    serializer = JoblibSerializer()
+    tmpdir = tempfile.mkdtemp()
+    filename = os.path.join(tmpdir, "model.model")
+    for name, model in make_models():
+        rows = [bench(serializer, model, codec, filename) for codec in codecs]
+        print(name)
+        print(tabulate(rows, headers=["CODEC", "SIZE (MB)", "SAVE (s)", "LOAD (s)", ""]))
+        print()
+    os.remove(filename)
+    os.rmdir(tmpdir)
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,25 @@
 """roro - commandline tool for accessing all the sevices in RorodataPlatform.
 """
-
-from .projects import get_current_project, Task
-from firefly import Client
+import sys
+from .helpers import LazyModule
 
 __version__ = '0.1.16'
+
+# the public API, imported from its module on first use so that importing
+# roro, and starting the roro command, doesn't load all the dependencies
+_API = {
+    "get_current_project": "roro.projects",
+    "Task": "roro.projects",
+    "TaskTimeoutError": "roro.projects",
+    "wait_all": "roro.projects",
+    "as_completed": "roro.projects",
+    "Client": "firefly",
+}
+
+__all__ = sorted(_API)
+
+# the package is replaced by a LazyModule with the same contents, which
+# works on python 2 as well
+_package = LazyModule(__name__, attributes=_API)
+_package.__dict__.update(sys.modules[__name__].__dict__)
+sys.modules[__name__] = _package
@@ -0,0 +1,572 @@
+"""
+    roro.aio
+    ~~~~~~~~
+
+    The asyncio client to the roro-server, for automation talking to many
+    projects at once. This module needs Python 3.6 or later.
+
+        from roro.aio import AsyncProject
+
+        async def restart_all(names):
+            projects = [AsyncProject(name) for name in names]
+            await bounded_gather([p.restart_service("default") for p in projects], limit=20)
+
+    AsyncRoroClient discovers the methods of the server and sends the same
+    Authorization header as RoroClient, and shares the disk cache of the
+    method listing with it. The requests are sent using aiohttp, when it is
+    installed. Otherwise, they are sent using requests on a pool of
+    threads, as large as the connection pool.
+
+    The calls are retried and the circuit breaker is applied as in
+    RoroClient, see roro.client. The streamed calls are not retried.
+
+    Uploading files, and so deploys, the volumes and the model
+    repositories, are only supported by the synchronous client.
+"""
+import asyncio
+import functools
+import json
+import logging
+import random
+import time
+import uuid
+import requests
+from requests.adapters import HTTPAdapter
+from firefly.client import FireflyError
+from firefly.validator import ValidationError
+from . import auth, config
+from .client import (RoroClient, CircuitBreaker, TransientError,
+    IDEMPOTENT_METHODS, TRANSIENT_STATUS_CODES)
+from .logs import FINISHED_STATUSES, POLL_INTERVAL, LogCursor
+from .projects import Task, TaskTimeoutError, _Backoff
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+logger = logging.getLogger(__name__)
+
+# shared clients, keyed by the server url and the event loop
+_clients = {}
+
+def get_async_client(server_url=None, loop=None):
+    """Returns the shared AsyncRoroClient for the given server URL and the
+    event loop.
+
+    :param server_url: url of the roro-server, defaults to config.SERVER_URL
+    :param loop: the event loop, defaults to the current event loop
+    """
+    server_url = (server_url or config.SERVER_URL).rstrip("/")
+    loop = loop or asyncio.get_event_loop()
+    key = (server_url, loop)
+    client = _clients.get(key)
+    if client is None or client.closed:
+        client = _clients[key] = AsyncRoroClient(server_url, loop=loop)
+    return client
+
+class AsyncRoroClient:
+    """asyncio client to roro-server.
+
+    The remote methods are called as coroutines, with named arguments:
+
+        jobs = await client.ps(project="credit-risk")
+
+    All the requests share a single pool of config.POOL_SIZE connections.
+    """
+    AUTH_PROVIDER = auth.RorodataAuthProvider
+
+    # the headers and the cache of the method listing are the same as
+    # those of RoroClient
+    prepare_headers = RoroClient.prepare_headers
+    _get_metadata_cache_path = RoroClient._get_metadata_cache_path
+    _read_metadata_cache = RoroClient._read_metadata_cache
+    _write_metadata_cache = RoroClient._write_metadata_cache
+    _clear_metadata = RoroClient._clear_metadata
+
+    def __init__(self, server_url, pool_size=None, loop=None, transport=None):
+        self.server_url = server_url.rstrip("/")
+        self.loop = loop or asyncio.get_event_loop()
+        self.auth_provider = self.AUTH_PROVIDER()
+        self.transport = transport or _make_transport(pool_size or config.POOL_SIZE, self.loop)
+        self.circuit_breaker = CircuitBreaker(self.server_url)
+        self.closed = False
+        self._metadata = None
+        self._metadata_from_cache = False
+        # created in the running loop, see _get_metadata
+        self._metadata_lock = None
+
+    def __getattr__(self, func_name):
+        if func_name.startswith("_"):
+            raise AttributeError(func_name)
+        return functools.partial(self.call_func, func_name)
+
+    async def call_func(self, func_name, **kwargs):
+        """Calls the method func_name of the server and returns the result.
+
+        The result is bytes when the server returns a file.
+        """
+        try:
+            return await self._call_func(func_name, kwargs)
+        except FireflyError as e:
+            # the cached method listing may be out of date with the server
+            if not self._metadata_from_cache or str(e) != "Requested function not found":
+                raise
+            logger.info("unknown method %s, refreshing the cached method listing", func_name)
+            self._clear_metadata()
+            return await self._call_func(func_name, kwargs)
+
+    async def _call_func(self, func_name, kwargs):
+        retry = func_name in IDEMPOTENT_METHODS
+        if not retry and "idempotency_key" not in kwargs and await self.has_param(func_name, "idempotency_key"):
+            kwargs["idempotency_key"] = uuid.uuid4().hex
+        retry = retry or "idempotency_key" in kwargs
+        return await self._retry(lambda: self._send(func_name, kwargs), retry)
+
+    async def _send(self, func_name, kwargs):
+        response = await self._open(func_name, kwargs)
+        try:
+            body = await response.read()
+        finally:
+            response.close()
+        return _handle_response(response.status, response.headers, body)
+
+    async def stream_func(self, func_name, **kwargs):
+        """Calls the method func_name of the server, which returns a file,
+        and yields the lines of it as they are received.
+        """
+        response = await self._open(func_name, kwargs)
+        try:
+            if response.status != 200:
+                _handle_response(response.status, response.headers, await response.read())
+            while True:
+                line = await response.readline()
+                if not line:
+                    break
+                yield line
+        finally:
+            response.close()
+
+    async def _open(self, func_name, kwargs):
+        for name, value in kwargs.items():
+            if hasattr(value, 'read'):
+                raise ValueError("Uploading files is not supported by the async client ({})".format(name))
+        metadata = await self._get_metadata()
+        func_info = metadata.get("functions", {}).get(func_name) or {"path": "/" + func_name}
+        url = self.server_url + func_info["path"]
+        t0 = time.time()
+        try:
+            return await self.transport.open("POST", url, self.prepare_headers(), kwargs)
+        finally:
+            logger.info("%0.3f: POST %s", time.time()-t0, url)
+
+    async def has_method(self, name):
+        """Tells whether the server supports the method with the given name.
+        """
+        metadata = await self._get_metadata()
+        return name in metadata.get("functions", {})
+
+    async def has_param(self, func_name, name):
+        """Tells whether the method func_name of the server accepts the
+        parameter with the given name.
+        """
+        metadata = await self._get_metadata()
+        info = metadata.get("functions", {}).get(func_name) or {}
+        return any(param.get("name") == name for param in info.get("parameters", []))
+
+    async def _retry(self, func, retry=True):
+        """Awaits func(), retrying it on TransientError when retry is true,
+        the same as RoroClient._retry.
+        """
+        attempt = 0
+        while True:
+            self.circuit_breaker.check()
+            try:
+                result = await func()
+            except TransientError as e:
+                self.circuit_breaker.record_failure()
+                if not retry or attempt >= config.RETRIES or self.circuit_breaker.is_open():
+                    raise
+                delay = config.RETRY_BACKOFF * 2 ** attempt * random.uniform(0.5, 1)
+                logger.info("%s, retrying in %0.1f seconds", e, delay)
+                await asyncio.sleep(delay)
+                attempt += 1
+            else:
+                self.circuit_breaker.record_success()
+                return result
+
+    async def _get_metadata(self):
+        if self._metadata_lock is None:
+            self._metadata_lock = asyncio.Lock()
+        async with self._metadata_lock:
+            if self._metadata is None:
+                cached = self._read_metadata_cache()
+                if cached and time.time() - cached['timestamp'] < config.METADATA_CACHE_TTL:
+                    self._metadata = cached['metadata']
+                    self._metadata_from_cache = True
+                else:
+                    self._metadata = await self._retry(lambda: self._fetch_metadata(cached))
+                    self._metadata_from_cache = False
+            return self._metadata
+
+    async def _fetch_metadata(self, cached=None):
+        headers = self.prepare_headers()
+        if cached and cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        response = await self.transport.open("GET", self.server_url + "/", headers)
+        try:
+            body = await response.read()
+        finally:
+            response.close()
+
+        if response.status in TRANSIENT_STATUS_CODES:
+            raise _transient_error(response.status)
+        elif response.status == 304:
+            metadata, etag = cached['metadata'], cached['etag']
+        elif response.status == 200:
+            metadata, etag = json.loads(body.decode('utf-8')), response.headers.get('ETag')
+        else:
+            raise FireflyError(
+                "Failed to contact the server (http status code {}).".format(
+                    response.status))
+        self._write_metadata_cache(metadata, etag)
+        return metadata
+
+    async def close(self):
+        if not self.closed:
+            self.closed = True
+            await self.transport.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+def _handle_response(status, headers, body):
+    """Returns the result of the response, raising the same errors as
+    firefly.Client.
+    """
+    content_type = headers.get("Content-Type", "")
+    if status in TRANSIENT_STATUS_CODES:
+        raise _transient_error(status)
+    elif status == 200:
+        if content_type == "application/octet-stream":
+            return body
+        return json.loads(body.decode('utf-8'))
+    elif status == 400:
+        try:
+            error = json.loads(body.decode('utf-8'))["error"]
+        except (KeyError, ValueError):
+            error = "Bad Request"
+        raise ValueError(error)
+    elif status == 403:
+        raise FireflyError("Authorization token mismatch.")
+    elif status == 404:
+        raise FireflyError("Requested function not found")
+    elif status == 422:
+        raise ValidationError(json.loads(body.decode('utf-8'))["error"])
+    elif status == 500:
+        if content_type == "application/json":
+            raise FireflyError(json.loads(body.decode('utf-8'))["error"])
+        else:
+            raise FireflyError(body.decode('utf-8', 'replace'))
+    else:
+        raise FireflyError("Oops! Something really bad happened")
+
+def _transient_error(status):
+    return TransientError(
+        "The server is unavailable (http status code {}), please try again later.".format(status))
+
+def _make_transport(pool_size, loop):
+    if aiohttp is not None:
+        return _AiohttpTransport(pool_size)
+    else:
+        return _ThreadTransport(pool_size, loop)
+
+class _AiohttpTransport:
+    """Sends the requests using aiohttp.
+
+    The session is created on the first request, in the running loop, as
+    aiohttp requires. The client may be created before the loop runs.
+    """
+    def __init__(self, pool_size):
+        self.pool_size = pool_size
+        self.session = None
+
+    def _get_session(self):
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.pool_size)
+            # the logs are streamed for as long as the job runs
+            timeout = aiohttp.ClientTimeout(total=None)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self.session
+
+    async def open(self, method, url, headers, data=None):
+        try:
+            response = await self._get_session().request(method, url, headers=headers, json=data)
+        except aiohttp.ClientConnectionError:
+            raise TransientError('Unable to connect to the server, please try again later.')
+        return _AiohttpResponse(response)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+class _AiohttpResponse:
+    def __init__(self, response):
+        self.response = response
+        self.status = response.status
+        self.headers = response.headers
+
+    async def read(self):
+        return await self.response.read()
+
+    async def readline(self):
+        return await self.response.content.readline()
+
+    def close(self):
+        self.response.release()
+
+class _ThreadTransport:
+    """Sends the requests using requests, from a pool of threads.
+    """
+    def __init__(self, pool_size, loop):
+        from concurrent.futures import ThreadPoolExecutor
+        self.loop = loop
+        self.executor = ThreadPoolExecutor(max_workers=pool_size)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def run(self, func, *args, **kwargs):
+        return self.loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def open(self, method, url, headers, data=None):
+        try:
+            response = await self.run(self.session.request, method, url, headers=headers, json=data, stream=True)
+        except requests.ConnectionError:
+            raise TransientError('Unable to connect to the server, please try again later.')
+        return _ThreadResponse(self, response)
+
+    async def close(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
+
+class _ThreadResponse:
+    def __init__(self, transport, response):
+        self.transport = transport
+        self.response = response
+        self.status = response.status_code
+        self.headers = response.headers
+
+    async def read(self):
+        return await self.transport.run(lambda: self.response.content)
+
+    async def readline(self):
+        return await self.transport.run(self.response.raw.readline)
+
+    def close(self):
+        self.response.close()
+
+class AsyncProject:
+    """asyncio counterpart of roro.projects.Project.
+    """
+    SERVER_URL = config.SERVER_URL
+
+    def __init__(self, name, runtime=None, client=None):
+        self.name = name
+        self.runtime = runtime
+        self.client = client or get_async_client(self.SERVER_URL)
+
+    async def create(self, repo_url=None):
+        """Creates a new project.
+
+        Returns an AsyncTask when repo_url is specified and the project
+        data otherwise.
+        """
+        result = await self.client.create(name=self.name, runtime=self.runtime, repo_url=repo_url)
+        if repo_url:
+            return AsyncTask(result['task_id'], self.client)
+        else:
+            return result
+
+    async def delete(self):
+        return await self.client.delete(name=self.name)
+
+    async def run(self, command, instance_size=None):
+        return await self.client.run(project=self.name, command=command, instance_size=instance_size)
+
+    async def run_notebook(self, instance_size=None, lab=False):
+        return await self.client.run_notebook(project=self.name, instance_size=instance_size, lab=lab)
+
+    async def stop(self, jobid):
+        await self.client.stop(project=self.name, jobid=jobid)
+
+    async def stop_service(self, service_name):
+        await self.client.stop_service(project=self.name, service_name=service_name)
+
+    async def start_service(self, service_name):
+        await self.client.start_service(project=self.name, service_name=service_name)
+
+    async def restart_service(self, service_name):
+        await self.client.restart_service(project=self.name, service_name=service_name)
+
+    async def ps(self, jobid=None, all=False):
+        return await self.client.ps(project=self.name, jobid=jobid, all=all)
+
+    async def logs(self, jobid, since=None):
+        """Returns the logs of the job, optionally only the ones with
+        timestamp since or later.
+        """
+        if since is not None and await self.client.has_param("logs", "since"):
+            return await self.client.logs(project=self.name, jobid=jobid, since=since)
+        logs = await self.client.logs(project=self.name, jobid=jobid)
+        if since is not None:
+            logs = [log for log in logs if log['timestamp'] >= since]
+        return logs
+
+    async def follow_logs(self, jobid, since=None, poll_interval=None):
+        """Yields the logs of the job as they are written, until the job
+        has finished. See roro.logs for details.
+        """
+        if await self.client.has_method("stream_logs"):
+            lines = self.client.stream_func("stream_logs", project=self.name, jobid=jobid, since=since)
+            async for line in lines:
+                if not line.strip():
+                    continue
+                record = json.loads(line.decode('utf-8'))
+                if 'message' in record:
+                    yield record
+                elif record.get('status') in FINISHED_STATUSES:
+                    break
+            return
+
+        cursor = LogCursor(since)
+        while True:
+            new_logs = cursor.new_logs(await self.logs(jobid, since=cursor.since))
+            for log in new_logs:
+                yield log
+            # the status is checked only when there are no new logs, as in
+            # roro.logs
+            if not new_logs and (await self.ps(jobid))['status'] in FINISHED_STATUSES:
+                for log in cursor.new_logs(await self.logs(jobid, since=cursor.since)):
+                    yield log
+                break
+            await asyncio.sleep(poll_interval or POLL_INTERVAL)
+
+    async def get_config(self):
+        return await self.client.get_config(project=self.name)
+
+    async def set_config(self, config_vars):
+        return await self.client.set_config(project=self.name, config_vars=config_vars)
+
+    async def unset_config(self, names):
+        return await self.client.unset_config(project=self.name, names=names)
+
+    async def list_volumes(self):
+        volumes = await self.client.volumes(project=self.name)
+        return [volume['volume'] for volume in volumes]
+
+    def __repr__(self):
+        return "<AsyncProject {}>".format(self.name)
+
+class AsyncTask(Task):
+    """asyncio counterpart of roro.projects.Task.
+
+    The poll and wait methods are coroutines.
+    """
+    def __init__(self, task_id, client):
+        self.task_id = task_id
+        self._client = client
+        self.response = None
+
+    async def poll(self):
+        return self._update(await self._client.poll_task(task_id=self.task_id))
+
+    async def wait(self, timeout=None, callback=None, poll_interval=None, max_poll_interval=None):
+        """Waits for the task to finish and returns the result of the task.
+
+        See Task.wait for the details.
+        """
+        long_poll = await self._client.has_method("wait_task")
+        backoff = _Backoff(poll_interval, max_poll_interval)
+        deadline = timeout is not None and time.time() + timeout
+
+        status = None
+        while True:
+            if long_poll and status is not None:
+                await self._wait_for_change(status, deadline)
+            else:
+                await self.poll()
+
+            if self.status != status:
+                status = self.status
+                if callback:
+                    callback(self.response)
+
+            if self.done():
+                return self.result()
+
+            remaining = deadline and deadline - time.time()
+            if deadline and remaining <= 0:
+                raise TaskTimeoutError(self.task_id, timeout)
+            if not long_poll:
+                await asyncio.sleep(backoff.next_delay(remaining))
+
+    async def _wait_for_change(self, status, deadline):
+        timeout = config.TASK_LONG_POLL_TIMEOUT
+        if deadline:
+            timeout = max(0, min(timeout, deadline - time.time()))
+        return self._update(await self._client.wait_task(task_id=self.task_id, status=status, timeout=timeout))
+
+async def wait_all(tasks, timeout=None, limit=None):
+    """Waits for all the AsyncTasks to finish and returns their results, in
+    the same order as the tasks.
+
+    Raises Exception if any of the tasks fails, after all of them have
+    finished, and TaskTimeoutError if they don't finish in timeout seconds.
+
+    :param tasks: the AsyncTasks
+    :param timeout: maximum number of seconds to wait, no limit by default
+    :param limit: maximum number of tasks waited on at the same time,
+        defaults to config.POOL_SIZE
+    """
+    tasks = list(tasks)
+    coros = [task.wait() for task in tasks]
+    try:
+        results = await asyncio.wait_for(bounded_gather(coros, limit=limit, return_exceptions=True), timeout)
+    except asyncio.TimeoutError:
+        task_ids = ", ".join(task.task_id for task in tasks if not task.done())
+        raise TaskTimeoutError(task_ids, timeout)
+    # errors other than the failures of the tasks, like connection errors
+    for task, result in zip(tasks, results):
+        if isinstance(result, Exception) and not task.done():
+            raise result
+    return [task.result() for task in tasks]
+
+async def bounded_gather(coros, limit=None, return_exceptions=False):
+    """Runs the coroutines, at most limit of them at the same time, and
+    returns their results in the same order, like asyncio.gather.
+
+    :param coros: the coroutines
+    :param limit: maximum number of coroutines running at the same time,
+        defaults to config.POOL_SIZE
+    :param return_exceptions: return the exceptions raised by the
+        coroutines as results, instead of raising the first of them
+    """
+    semaphore = asyncio.Semaphore(limit or config.POOL_SIZE)
+
+    async def run(coro):
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(*[run(coro) for coro in coros], return_exceptions=return_exceptions)
+
+async def bounded_map(func, items, limit=None):
+    """Calls the coroutine function func with each of the items, at most
+    limit of them at the same time, and returns the results in the same
+    order.
+    """
+    return await bounded_gather([func(item) for item in items], limit=limit)
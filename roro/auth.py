@@ -1,3 +1,4 @@
+import base64
 import os
 import sys
 import stat
@@ -12,6 +13,31 @@ class AuthProvider:
         """
         raise NotImplementedError()
 
+    def get_auth_header(self):
+        """Returns the value of the Authorization header for the current user.
+
+        The header is computed once and reused as long as get_auth keeps
+        returning the same login details.
+        """
+        login = self.get_auth()
+        if not login:
+            return None
+
+        if isinstance(login, str):
+            key = login
+        else:
+            key = (login['email'], login['password'])
+
+        if getattr(self, "_auth_header_key", None) != key:
+            if isinstance(login, str):
+                basic_auth = login
+            else:
+                both = "{}:{}".format(login['email'], login['password']).encode('utf-8')
+                basic_auth = base64.b64encode(both).decode("ascii")
+            self._auth_header = 'Basic {}'.format(basic_auth)
+            self._auth_header_key = key
+        return self._auth_header
+
 class RorodataAuthProvider(AuthProvider):
     """An implementation of AuthProvider that returns the login details
     from the environment or netrc file.
@@ -19,6 +45,8 @@ class RorodataAuthProvider(AuthProvider):
     This returns the login details from environment variable RORODATA_AUTHORIZATION
     if available, or else from the netrc file if present. This
     does not deal about writing the login details to the netrc file.
+
+    The netrc file is parsed only when it is modified, see get_saved_login.
     """
     def get_auth(self):
         return os.getenv("RORODATA_AUTHORIZATION") or get_saved_login()
@@ -32,18 +60,38 @@ def just_login(email, password):
     token = client.login(email=email, password=password)
     return token
 
+# cache of the parsed netrc file, maps (path, mtime, size) to the hosts in it
+_netrc_cache = {}
+
 def get_saved_login():
-    create_netrc_if_not_exists()
-    rc = netrc()
+    """Returns the login details of config.SERVER_URL from the netrc file.
 
+    The parsed netrc file is cached and it is parsed again only when the
+    modification time or the size of the file changes.
+    """
+    hosts = _get_netrc_hosts()
     hostname = get_host_name(config.SERVER_URL)
-    if hostname in rc.hosts:
-        login, _, password = rc.hosts[hostname]
+    if hostname in hosts:
+        login, _, password = hosts[hostname]
         return {
             "email": login,
             "password": password
         }
 
+def _get_netrc_hosts():
+    netrc_file = netrc.find_default_file()
+    try:
+        st = os.stat(netrc_file)
+    except OSError:
+        netrc_file = create_netrc_if_not_exists()
+        st = os.stat(netrc_file)
+
+    key = (netrc_file, st.st_mtime, st.st_size)
+    if key not in _netrc_cache:
+        _netrc_cache.clear()
+        _netrc_cache[key] = netrc(netrc_file).hosts
+    return _netrc_cache[key]
+
 def save_token(email, token):
     netrc_file = create_netrc_if_not_exists()
     rc = netrc()
@@ -54,6 +102,7 @@ def save_token(email, token):
             token = token.encode('utf-8')
         rc.hosts[host_name] = (email, None, token)
         f.write(str(rc))
+    _netrc_cache.clear()
 
 def create_netrc_if_not_exists():
     prefix = '.' if os.name != 'nt' else '_'
@@ -78,7 +127,8 @@ class netrc(_netrc):
             file = self.find_default_file()
         _netrc.__init__(self, file=file)
 
-    def find_default_file(self):
+    @staticmethod
+    def find_default_file():
         filename = "_netrc" if sys.platform == 'win32' else ".netrc"
         p = os.path.join(os.path.expanduser('~'), filename)
         return str(p)
@@ -1,5 +1,4 @@
 from __future__ import print_function
-import time
 import itertools
 import click
 import datetime
@@ -7,18 +6,20 @@ import os
 import sys
 import logging
 
-from tabulate import tabulate
 from . import config
-from . import projects
 from . import helpers as h
-from .projects import Project
-from . import auth
+from . import logs as roro_logs
+from . import logexport
 from .path import Path
 from . import __version__
-from .client import RoroClient
 
-from firefly.client import FireflyError
-from requests import ConnectionError
+# imported on first use, to keep the startup of roro fast
+projects = h.LazyModule("roro.projects")
+auth = h.LazyModule("roro.auth")
+roro_client = h.LazyModule("roro.client")
+firefly_client = h.LazyModule("firefly.client")
+requests = h.LazyModule("requests")
+tabulate = h.LazyModule("tabulate")
 
 
 class PathType(click.ParamType):
@@ -31,14 +32,10 @@ class CatchAllExceptions(click.Group):
     def __call__(self, *args, **kwargs):
         try:
             return self.main(*args, **kwargs)
-        except FireflyError as e:
-            if e.args and e.args[0] == "Forbidden":
+        except Exception as exc:
+            if isinstance(exc, firefly_client.FireflyError) and exc.args and exc.args[0] == "Forbidden":
                 click.echo("Unauthorized. Please login and try again.")
                 sys.exit(2)
-            else:
-                click.echo('ERROR %s' % e)
-                sys.exit(3)
-        except Exception as exc:
             click.echo('ERROR %s' % exc)
             sys.exit(3)
 
@@ -64,9 +61,9 @@ def login(email, password):
     try:
         auth.login(email, password)
         click.echo("Login successful.")
-    except ConnectionError:
+    except requests.ConnectionError:
         click.echo('unable to connect to the server, try again later')
-    except FireflyError as e:
+    except firefly_client.FireflyError as e:
         click.echo(e)
         raise
 
@@ -79,7 +76,7 @@ def version():
 def whoami():
     """prints the details of current user.
     """
-    client = RoroClient(config.SERVER_URL)
+    client = roro_client.get_client(config.SERVER_URL)
     user = client.whoami()
     if user:
         click.echo(user['email'])
@@ -91,8 +88,7 @@ def whoami():
 def _projects():
     """Lists all the projects.
     """
-    projects = Project.find_all()
-    for p in projects:
+    for p in projects.Project.find_all():
         print(p.name)
 
 @cli.command()
@@ -101,7 +97,7 @@ def _projects():
 def create(project, repo_url=None):
     """Creates a new Project.
     """
-    p = Project(project)
+    p = projects.Project(project)
     if repo_url:
         task = p.create(repo_url=repo_url)
         click.echo("Waiting for the project to get created...")
@@ -116,7 +112,7 @@ def create(project, repo_url=None):
 def project_delete(name):
     """Deletes a project
     """
-    p = Project(name)
+    p = projects.Project(name)
     p.delete()
     click.echo("Project {} deleted successfully.".format(name))
 
@@ -151,6 +147,36 @@ def cp(src, dest):
     project = projects.current_project()
     project.copy(src, dest)
 
+@cli.command()
+@click.argument('src', type=PathType())
+@click.argument('dest', type=PathType())
+@click.option('-n', '--dry-run', default=False, is_flag=True, help="Show the changes without copying the files")
+@click.option('--delete', default=False, is_flag=True, help="Delete the files in dest that are not in src")
+@click.option('-c', '--checksum', default=False, is_flag=True, help="Compare the files by checksum instead of size and time")
+def sync(src, dest, dry_run, delete, checksum):
+    """Sync directories to and from volumes.
+
+    Only the files that are new or changed are copied.
+
+    Example:
+
+        $ roro sync data:/dataset ./dataset
+
+        downloads the changed files in the dataset directory from the server
+
+        $ roro sync ./dataset data:/dataset
+
+        uploads the changed files in the dataset directory to the server
+    """
+    if src.is_volume() is dest.is_volume():
+        raise Exception('One of the arguments has to be a volume, other a local path')
+    project = projects.current_project()
+    changes = project.sync(src, dest, dry_run=dry_run, delete=delete, checksum=checksum)
+    for action, path in changes:
+        click.echo("{} {}".format(action, path))
+    if not changes:
+        click.echo("Everything up-to-date")
+
 @cli.command()
 @click.option('-a', '--all', default=False, is_flag=True)
 def ps(all):
@@ -166,7 +192,7 @@ def ps(all):
         total_time = datetime.timedelta(total_time.days, total_time.seconds)
         command = " ".join(job["details"]["command"])
         rows.append([job['jobid'], job['status'], h.datestr(start), str(total_time), job['instance_type'], h.truncate(command, 50)])
-    print(tabulate(rows, headers=['JOBID', 'STATUS', 'WHEN', 'TIME', 'INSTANCE TYPE', 'CMD'], disable_numparse=True))
+    print(tabulate.tabulate(rows, headers=['JOBID', 'STATUS', 'WHEN', 'TIME', 'INSTANCE TYPE', 'CMD'], disable_numparse=True))
 
 @cli.command(name='ps:restart')
 @click.argument('name')
@@ -231,7 +257,7 @@ def run_notebook(instance_size=None):
     """
     project = projects.current_project()
     job = project.run_notebook(instance_size=instance_size)
-    _logs(project, job["jobid"], follow=True, end_marker="-" * 40)
+    _logs(project, [job["jobid"]], follow=True, end_marker="-" * 40)
 
 @cli.command()
 @click.argument('jobid')
@@ -258,55 +284,61 @@ def restart(service_name):
     project.restart_service(service_name)
 
 @cli.command()
-@click.argument('jobid')
+@click.argument('jobids', nargs=-1)
 @click.option('-s', '--show-timestamp', default=False, is_flag=True)
 @click.option('-f', '--follow', default=False, is_flag=True)
-def logs(jobid, show_timestamp, follow):
-    """Shows all the logs of the project.
+@click.option('--all-running', default=False, is_flag=True, help="Show the logs of all the running jobs")
+@click.option('--raw', default=False, is_flag=True, help="Print the logs as JSON lines")
+@click.option('-o', '--output', help="Save the logs to a compressed JSON lines file, .gz or .zst")
+def logs(jobids, show_timestamp, follow, all_running, raw, output):
+    """Shows the logs of one or more jobs.
+
+    The logs of multiple jobs are merged by timestamp and each line is
+    prefixed with the job id.
     """
     project = projects.current_project()
-    _logs(project, jobid, follow, show_timestamp)
+    if all_running:
+        jobids = [job['jobid'] for job in project.ps() if job['status'] not in roro_logs.FINISHED_STATUSES]
+        if not jobids:
+            click.echo("No running jobs")
+            return
+    elif not jobids:
+        raise click.UsageError("Please specify a job id or --all-running")
+    if output:
+        _save_logs(project, jobids, output, follow)
+    else:
+        _logs(project, jobids, follow, show_timestamp, raw=raw)
 
-def _logs(project, job_id, follow=False, show_timestamp=False, end_marker=None):
-    """Shows the logs of job_id.
+def _save_logs(project, job_ids, path, follow=False):
+    """Saves the logs of the jobs job_ids to path.
     """
-    def get_logs(job_id, follow=False):
-        if follow:
-            seen = 0
-            while True:
-                logs = project.logs(job_id)
-                for log in logs[seen:]:
-                    yield log
-                seen = len(logs)
-                job = project.ps(job_id)
-                if job['status'] in ['success', 'cancelled', 'failed']:
-                    break
-                time.sleep(0.5)
-        else:
-            logs = project.logs(job_id)
-            for log in logs:
-                yield log
-
+    if len(job_ids) > 1:
+        logs = roro_logs.merge_logs(project, job_ids, follow=follow)
+    elif follow:
+        logs = project.follow_logs(job_ids[0])
+    else:
+        logs = project.logs(job_ids[0])
+    count = logexport.write_logs(logs, path)
+    click.echo("Saved {} logs to {}".format(count, path))
 
-    logs = get_logs(job_id, follow)
+def _logs(project, job_ids, follow=False, show_timestamp=False, end_marker=None, raw=False):
+    """Shows the logs of the jobs job_ids.
+    """
+    if len(job_ids) > 1:
+        logs = roro_logs.merge_logs(project, job_ids, follow=follow, idle_marker=True)
+    elif follow:
+        logs = roro_logs.follow_logs(project, job_ids[0], idle_marker=True)
+    else:
+        logs = project.logs(job_ids[0])
     if end_marker:
-        logs = itertools.takewhile(lambda log: not log['message'].startswith(end_marker), logs)
+        logs = itertools.takewhile(lambda log: log is None or not log['message'].startswith(end_marker), logs)
 
-    _display_logs(logs, show_timestamp=show_timestamp)
-
-def _display_logs(logs, show_timestamp=False):
-    def parse_time(timestamp):
-        t = datetime.datetime.fromtimestamp(timestamp//1000)
-        return t.isoformat()
-
-    if show_timestamp:
-        log_pattern = "[{timestamp}] {message}"
-    else:
-        log_pattern = "{message}"
+    _display_logs(logs, show_timestamp=show_timestamp, show_jobid=len(job_ids) > 1, raw=raw)
 
-    for line in logs:
-        line['timestamp'] = parse_time(line['timestamp'])
-        click.echo(log_pattern.format(**line))
+def _display_logs(logs, show_timestamp=False, show_jobid=False, raw=False):
+    formatter = roro_logs.LogFormatter(show_timestamp=show_timestamp, show_jobid=show_jobid, raw=raw)
+    # click's stdout handles the encoding of the output, like click.echo
+    roro_logs.write_logs(logs, click.get_text_stream('stdout'), formatter)
 
 @cli.command()
 @click.argument('project')
@@ -362,7 +394,7 @@ def ls_volume(path):
     project = projects.current_project()
     stat = project.ls(path)
     rows = [[item['mode'], item['size'], item['name']] for item in stat]
-    click.echo(tabulate(rows, tablefmt='plain'))
+    click.echo(tabulate.tabulate(rows, tablefmt='plain'))
 
 @cli.command()
 def models():
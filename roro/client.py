@@ -1,8 +1,66 @@
 """The rorodata client
 """
-import base64
+import binascii
+import hashlib
+import json
+import logging
+import os
+import random
+import stat
+import threading
+import time
+import uuid
+import requests
+from requests import ConnectionError
+from requests.adapters import HTTPAdapter
+from requests.utils import guess_filename
+from urllib3.fields import RequestField
 import firefly
-from . import auth
+from firefly.client import FireflyError
+from firefly.validator import ValidationError
+from . import auth, config
+from .helpers import atomic_write
+from .responsecache import get_response_cache
+from .transfers import run_concurrently
+
+logger = logging.getLogger(__name__)
+
+# methods without side effects, which are safe to retry
+IDEMPOTENT_METHODS = set([
+    "ps", "logs", "stream_logs", "ls_volume", "get_config", "volumes",
+    "projects", "get_project", "whoami",
+    "list_models", "get_model", "get_model_version", "get_activity",
+    "poll_task", "poll_tasks", "wait_task",
+    "get_file", "stat_file", "get_file_range", "missing_blobs",
+])
+
+# maximum number of calls sent in one batch request
+MAX_BATCH_SIZE = 100
+
+# http status codes of the errors that are expected to go away on retry
+TRANSIENT_STATUS_CODES = [502, 503, 504]
+
+# shared clients, keyed by the server url
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_client(server_url=None):
+    """Returns the shared RoroClient for the given server URL.
+
+    The client is created on first use and reused afterwards. All the
+    projects, tasks and model repositories talking to the same server share
+    it, so the method discovery and the TLS handshake are done only once per
+    process.
+
+    :param server_url: url of the roro-server, defaults to config.SERVER_URL
+    :return: the RoroClient for that server
+    """
+    server_url = (server_url or config.SERVER_URL).rstrip("/")
+    with _clients_lock:
+        client = _clients.get(server_url)
+        if client is None:
+            client = _clients[server_url] = RoroClient(server_url)
+        return client
 
 class RoroClient(firefly.Client):
     """Client to roro-server.
@@ -13,27 +71,544 @@ class RoroClient(firefly.Client):
 
     The ``AUTH_PROVIDER`` field which maintains the class of AuthProvider. It
     can be changed to provide alternative implementations of AuthProvider.
+
+    Unlike firefly.Client, all the requests are sent over a single
+    requests.Session so that the connections to the server are kept alive
+    and reused. The size of the connection pool defaults to config.POOL_SIZE.
+
+    Files are uploaded by streaming the multipart body, see MultipartStream,
+    instead of reading them fully into memory.
+
+    The method listing of the server is cached on disk in config.CACHE_DIR
+    for config.METADATA_CACHE_TTL seconds. Once expired, it is revalidated
+    using the ETag sent by the server.
+
+    Calls failing with connection errors or with 502, 503 or 504 responses
+    are retried up to config.RETRIES times, with exponential backoff. This
+    is done for the methods in IDEMPOTENT_METHODS and for the methods
+    accepting an idempotency_key parameter, which the client generates
+    once per call so that the server can discard the duplicates. A circuit
+    breaker makes the calls fail fast once the server looks down, see
+    CircuitBreaker.
+
+    The responses of the read-mostly methods are cached when enabled in
+    config.RESPONSE_CACHE, see roro.responsecache. The cache is available
+    as ``response_cache``, or None when disabled.
     """
     AUTH_PROVIDER = auth.RorodataAuthProvider
 
-    def __init__(self, *args, **kwargs):
-        firefly.Client.__init__(self, *args, **kwargs)
+    def __init__(self, server_url, auth_token=None, pool_size=None):
+        firefly.Client.__init__(self, server_url, auth_token=auth_token)
         self.auth_provider = self.AUTH_PROVIDER()
+        self.session = self._make_session(pool_size or config.POOL_SIZE)
+        self.circuit_breaker = CircuitBreaker(self.server_url)
+        self.response_cache = get_response_cache(self.server_url, self.auth_provider.get_auth_header)
+        self._metadata_from_cache = False
+
+    def _make_session(self, pool_size):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
 
     def prepare_headers(self):
-        login = self.auth_provider.get_auth()
-        if not login:
+        auth_header = self.auth_provider.get_auth_header()
+        if not auth_header:
             return {}
+        return {
+            'Authorization': auth_header
+        }
+
+    def request(self, _path, **kwargs):
+        url = self.server_url + _path
+        t0 = time.time()
+        try:
+            headers = self.prepare_headers()
+            data, files = self.decouple_files(kwargs)
+            if files:
+                body = MultipartStream(data, files)
+                headers['Content-Type'] = body.content_type
+                response = self.session.post(url, data=body, headers=headers, stream=True)
+            else:
+                response = self.session.post(url, json=data, headers=headers, stream=True)
+        except ConnectionError:
+            raise TransientError('Unable to connect to the server, please try again later.')
+        finally:
+            t1 = time.time()
+            logger.info("%0.3f: POST %s", t1-t0, url)
+        if response.status_code in TRANSIENT_STATUS_CODES:
+            raise TransientError(
+                "The server is unavailable (http status code {}), please try again later.".format(
+                    response.status_code))
+        return self.handle_response(response)
+
+    def batch(self):
+        """Returns a Batch to send many calls to the server together.
+
+            with client.batch() as batch:
+                jobs = batch.ps(project="credit-risk")
+                config = batch.get_config(project="credit-risk")
+            print(jobs.result(), config.result())
+
+        The calls are sent in a single batch request when the server
+        supports it, and as concurrent requests over the connection pool
+        otherwise.
+        """
+        return Batch(self)
+
+    def has_method(self, name):
+        """Tells whether the server supports the method with the given name.
 
-        if isinstance(login, str):
-            basic_auth = login
+        This is used to take advantage of newer features of the server,
+        falling back to the older methods when they are not available.
+        """
+        return name in self._get_metadata().get("functions", {})
+
+    def has_param(self, func_name, name):
+        """Tells whether the method func_name of the server accepts the
+        parameter with the given name.
+        """
+        info = self._get_metadata().get("functions", {}).get(func_name) or {}
+        return any(param.get("name") == name for param in info.get("parameters", []))
+
+    def call_func(self, func_name, **kwargs):
+        if self.response_cache is None:
+            return self._call_with_retries(func_name, kwargs)
+        return self.response_cache.call(
+            func_name, kwargs,
+            lambda: self._call_with_retries(func_name, kwargs),
+            read_only=func_name in IDEMPOTENT_METHODS)
+
+    def _call_with_retries(self, func_name, kwargs):
+        retry = func_name in IDEMPOTENT_METHODS
+        if not retry and "idempotency_key" not in kwargs and self.has_param(func_name, "idempotency_key"):
+            kwargs["idempotency_key"] = uuid.uuid4().hex
+        retry = retry or "idempotency_key" in kwargs
+        return self._retry(lambda: self._call_func(func_name, **kwargs), retry, kwargs)
+
+    def _call_func(self, func_name, **kwargs):
+        try:
+            return firefly.Client.call_func(self, func_name, **kwargs)
+        except FireflyError as e:
+            # the cached method listing may be out of date with the server
+            if not self._metadata_from_cache or str(e) != "Requested function not found":
+                raise
+            logger.info("unknown method %s, refreshing the cached method listing", func_name)
+            self._clear_metadata()
+            self._get_metadata()
+            return firefly.Client.call_func(self, func_name, **kwargs)
+
+    def _retry(self, func, retry=True, kwargs=None):
+        """Calls func, retrying it on TransientError when retry is true.
+
+        The files in kwargs are seeked back to their current position
+        before retrying. The call is not retried when that is not possible.
+        """
+        positions = _get_file_positions(kwargs or {})
+        attempt = 0
+        while True:
+            self.circuit_breaker.check()
+            try:
+                result = func()
+            except TransientError as e:
+                self.circuit_breaker.record_failure()
+                if not retry or attempt >= config.RETRIES or positions is None or self.circuit_breaker.is_open():
+                    raise
+                delay = config.RETRY_BACKOFF * 2 ** attempt * random.uniform(0.5, 1)
+                logger.info("%s, retrying in %0.1f seconds", e, delay)
+                time.sleep(delay)
+                _seek_files(positions)
+                attempt += 1
+            else:
+                self.circuit_breaker.record_success()
+                return result
+
+    def _get_metadata(self):
+        if self._metadata is None:
+            cached = self._read_metadata_cache()
+            if cached and time.time() - cached['timestamp'] < config.METADATA_CACHE_TTL:
+                self._metadata = cached['metadata']
+                self._metadata_from_cache = True
+            else:
+                self._metadata = self._retry(lambda: self._fetch_metadata(cached))
+                self._metadata_from_cache = False
+        return self._metadata
+
+    def _fetch_metadata(self, cached=None):
+        url = self.server_url + "/"
+        headers = self.prepare_headers()
+        if cached and cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        try:
+            response = self.session.get(url, headers=headers)
+        except ConnectionError:
+            raise TransientError('Unable to connect to the server, please try again later.')
+
+        if response.status_code in TRANSIENT_STATUS_CODES:
+            raise TransientError(
+                "The server is unavailable (http status code {}), please try again later.".format(
+                    response.status_code))
+        elif response.status_code == 304:
+            metadata, etag = cached['metadata'], cached['etag']
+        elif response.status_code == 200:
+            metadata, etag = response.json(), response.headers.get('ETag')
         else:
-            both = "{}:{}".format(login['email'], login['password']).encode('utf-8')
-            basic_auth = base64.b64encode(both).decode("ascii")
+            raise FireflyError(
+                "Failed to contact the server (http status code {}).".format(
+                    response.status_code))
+        self._write_metadata_cache(metadata, etag)
+        return metadata
 
-        return {
-            'Authorization': 'Basic {}'.format(basic_auth)
+    def _clear_metadata(self):
+        self._metadata = None
+        self._metadata_from_cache = False
+        path = self._get_metadata_cache_path()
+        if os.path.exists(path):
+            os.remove(path)
+
+    def _get_metadata_cache_path(self):
+        key = hashlib.sha1(self.server_url.encode('utf-8')).hexdigest()
+        return os.path.join(config.CACHE_DIR, "metadata", key + ".json")
+
+    def _read_metadata_cache(self):
+        if config.METADATA_CACHE_TTL <= 0:
+            return
+        path = self._get_metadata_cache_path()
+        try:
+            with open(path) as f:
+                cached = json.load(f)
+        except (IOError, OSError, ValueError):
+            return
+        if cached.get('server_url') == self.server_url:
+            return cached
+
+    def _write_metadata_cache(self, metadata, etag):
+        if config.METADATA_CACHE_TTL <= 0:
+            return
+        cached = {
+            'server_url': self.server_url,
+            'timestamp': time.time(),
+            'etag': etag,
+            'metadata': metadata
         }
+        try:
+            atomic_write(self._get_metadata_cache_path(), json.dumps(cached).encode('utf-8'))
+        except (IOError, OSError) as e:
+            logger.warning("Unable to cache the method listing of %s (%s)", self.server_url, e)
+
+class Batch:
+    """Queue of calls to be sent to the server together, see
+    RoroClient.batch.
+
+    The calls are queued by calling the remote methods on the batch, which
+    return a BatchResult each. The calls are sent when the with block
+    exits, or when execute is called.
+    """
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    def __getattr__(self, func_name):
+        if func_name.startswith("_"):
+            raise AttributeError(func_name)
+        return lambda **kwargs: self.call(func_name, **kwargs)
+
+    def call(self, func_name, **kwargs):
+        """Queues a call to the method func_name and returns the BatchResult
+        of it.
+        """
+        for name, value in kwargs.items():
+            if self.client.is_file(value):
+                raise ValueError("Files can not be sent in a batch ({})".format(name))
+        result = BatchResult(func_name)
+        self.calls.append((func_name, kwargs, result))
+        return result
+
+    def execute(self):
+        """Sends the queued calls and returns their results, in the same
+        order as the calls.
+
+        The errors of the individual calls are raised only when their
+        results are accessed. The server sends the http status code each
+        call would have had on its own along with the error, so that the
+        same exceptions are raised as for calls made outside a batch.
+        """
+        calls, self.calls = self.calls, []
+        if self.client.has_method("batch"):
+            for i in range(0, len(calls), MAX_BATCH_SIZE):
+                self._send_batch(calls[i:i+MAX_BATCH_SIZE])
+        else:
+            run_concurrently(self._send_one, calls, config.POOL_SIZE)
+        return [result for _, _, result in calls]
+
+    def _send_batch(self, calls):
+        cache = self.client.response_cache
+        if cache is not None:
+            calls = [call for call in calls if not self._set_cached_result(cache, call)]
+            if not calls:
+                return
+
+        retry = all(func_name in IDEMPOTENT_METHODS for func_name, _, _ in calls)
+        payload = [{"method": func_name, "params": kwargs} for func_name, kwargs, _ in calls]
+        try:
+            responses = self.client._retry(lambda: self.client._call_func("batch", calls=payload), retry)
+        except Exception:
+            # the calls may have changed the data even when the batch failed
+            if cache is not None:
+                for func_name, _, _ in calls:
+                    if func_name not in IDEMPOTENT_METHODS:
+                        cache.invalidate_for(func_name)
+            raise
+
+        if len(responses) != len(calls):
+            raise FireflyError("Expected {} responses for the batch, received {}".format(
+                len(calls), len(responses)))
+        for (func_name, kwargs, result), response in zip(calls, responses):
+            read_only = func_name in IDEMPOTENT_METHODS
+            if "error" in response:
+                if cache is not None and not read_only:
+                    cache.invalidate_for(func_name)
+                result.set_exception(_make_error(response.get("status", 500), response["error"]))
+            else:
+                value = response.get("result")
+                if cache is not None:
+                    value = cache.record(func_name, kwargs, value, read_only=read_only)
+                result.set_result(value)
+
+    def _set_cached_result(self, cache, call):
+        func_name, kwargs, result = call
+        found, value = cache.lookup(func_name, kwargs)
+        if found:
+            result.set_result(value)
+        return found
+
+    def _send_one(self, call):
+        func_name, kwargs, result = call
+        try:
+            result.set_result(self.client.call_func(func_name, **kwargs))
+        except Exception as e:
+            result.set_exception(e)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.execute()
+
+class BatchResult:
+    """The result of a call queued in a Batch.
+    """
+    def __init__(self, func_name):
+        self.func_name = func_name
+        self._done = False
+        self._result = None
+        self._exception = None
+
+    def done(self):
+        return self._done
+
+    def result(self):
+        """Returns the result of the call, or raises the error of it.
+        """
+        if not self._done:
+            raise Exception("The batch has not been executed yet")
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def set_result(self, result):
+        self._result = result
+        self._done = True
+
+    def set_exception(self, exception):
+        self._exception = exception
+        self._done = True
+
+    def __repr__(self):
+        return "<BatchResult {}>".format(self.func_name)
+
+class TransientError(FireflyError):
+    """Error talking to the server that is expected to go away on retry,
+    like a connection error or a 503 response.
+    """
+
+class CircuitOpenError(FireflyError):
+    """Raised without contacting the server, when it has failed too many
+    times in a row.
+    """
+
+class CircuitBreaker:
+    """Keeps track of the consecutive failures of a server.
+
+    After config.CIRCUIT_BREAKER_THRESHOLD consecutive transient failures,
+    the circuit opens and the calls fail immediately with CircuitOpenError
+    for config.CIRCUIT_BREAKER_TIMEOUT seconds. After that, the calls are
+    let through again. The next failure opens the circuit again and a
+    success closes it.
+    """
+    def __init__(self, server_url):
+        self.server_url = server_url
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def is_open(self):
+        return self.opened_at is not None and time.time() - self.opened_at < config.CIRCUIT_BREAKER_TIMEOUT
+
+    def check(self):
+        if self.is_open():
+            raise CircuitOpenError(
+                "The server {} is not responding, please try again later.".format(self.server_url))
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= config.CIRCUIT_BREAKER_THRESHOLD:
+                if self.opened_at is None or not self.is_open():
+                    logger.warning("%s failed %d times in a row, failing fast for %s seconds",
+                        self.server_url, self.failures, config.CIRCUIT_BREAKER_TIMEOUT)
+                self.opened_at = time.time()
+
+def _make_error(status_code, error):
+    """Returns the exception for the error of a call in a batch, the same
+    as firefly.Client raises for the http status code the call would have
+    had on its own.
+    """
+    if status_code in TRANSIENT_STATUS_CODES:
+        return TransientError(
+            "The server is unavailable (http status code {}), please try again later.".format(status_code))
+    elif status_code == 400:
+        return ValueError(error or "Bad Request")
+    elif status_code == 403:
+        return FireflyError("Authorization token mismatch.")
+    elif status_code == 404:
+        return FireflyError("Requested function not found")
+    elif status_code == 422:
+        return ValidationError(error)
+    elif status_code == 500:
+        return FireflyError(error)
+    else:
+        return FireflyError("Oops! Something really bad happened")
+
+def _get_file_positions(kwargs):
+    """Returns the current positions of the files in kwargs, or None when
+    some file is not seekable.
+    """
+    positions = []
+    for value in kwargs.values():
+        if hasattr(value, 'read'):
+            try:
+                positions.append((value, value.tell()))
+            except (AttributeError, IOError, OSError, ValueError):
+                return None
+    return positions
+
+def _seek_files(positions):
+    for fileobj, position in positions:
+        fileobj.seek(position)
+
+class MultipartStream:
+    """Streams a multipart/form-data body.
+
+    requests reads the files completely into memory to build a multipart
+    body. This generates the body in chunks instead, reading the files only
+    as the data is sent.
+
+    The length of the body is available as ``len`` when the sizes of all
+    the files are known, so that requests sends a Content-Length header.
+    Otherwise, for example when uploading from a pipe, it is None and the
+    body is sent with chunked transfer encoding.
+    """
+    def __init__(self, data, files, chunk_size=None):
+        self.boundary = binascii.hexlify(os.urandom(16)).decode('ascii')
+        self.content_type = 'multipart/form-data; boundary={}'.format(self.boundary)
+        self.chunk_size = chunk_size or config.COPY_BUFFER_SIZE
+        self.parts = self._make_parts(data, files)
+        self.len = self._get_length()
+
+    def _make_parts(self, data, files):
+        """Returns a list of (headers, payload) for each part of the body.
+
+        The payload is bytes for the regular fields and a file object for
+        the files.
+        """
+        parts = []
+        for name, value in sorted(data.items()):
+            # same as requests, lists are sent as multiple values
+            if isinstance(value, (list, tuple)):
+                values = value
+            else:
+                values = [value]
+            for v in values:
+                if v is None:
+                    continue
+                if not isinstance(v, bytes):
+                    v = str(v).encode('utf-8')
+                parts.append((self._make_headers(name), v))
+
+        for name, fileobj in sorted(files.items()):
+            filename = guess_filename(fileobj) or name
+            parts.append((self._make_headers(name, filename), fileobj))
+        return parts
+
+    def _make_headers(self, name, filename=None):
+        field = RequestField(name=name, data=b'', filename=filename)
+        field.make_multipart()
+        header = '--{}\r\n{}'.format(self.boundary, field.render_headers())
+        return header.encode('utf-8')
+
+    def _get_length(self):
+        length = len(self._get_trailer())
+        for headers, payload in self.parts:
+            size = len(payload) if isinstance(payload, bytes) else _get_file_size(payload)
+            if size is None:
+                return None
+            length += len(headers) + size + 2
+        return length
+
+    def _get_trailer(self):
+        return '--{}--\r\n'.format(self.boundary).encode('utf-8')
+
+    def __iter__(self):
+        for headers, payload in self.parts:
+            yield headers
+            if isinstance(payload, bytes):
+                yield payload
+            else:
+                while True:
+                    chunk = payload.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+            yield b'\r\n'
+        yield self._get_trailer()
+
+def _get_file_size(fileobj):
+    """Returns the number of bytes remaining to be read from fileobj or None
+    when it can not be found.
+    """
+    try:
+        st = os.fstat(fileobj.fileno())
+        if stat.S_ISREG(st.st_mode):
+            return st.st_size - fileobj.tell()
+    except (AttributeError, IOError, OSError, ValueError):
+        pass
+
+    try:
+        position = fileobj.tell()
+        fileobj.seek(0, os.SEEK_END)
+        size = fileobj.tell() - position
+        fileobj.seek(position)
+        return size
+    except (AttributeError, IOError, OSError, ValueError):
+        return None
 
 # For backward compatibility. Will be removed in future releases
 Client = RoroClient
@@ -1,3 +1,69 @@
 import os
 
 SERVER_URL = os.getenv("RORODATA_SERVER_URL", "https://api.rorodata.com/")
+
+# maximum number of keep-alive connections kept open to the server by the
+# shared client
+POOL_SIZE = int(os.getenv("RORODATA_POOL_SIZE", "10"))
+
+# directory used to cache data across invocations of roro
+CACHE_DIR = os.getenv("RORODATA_CACHE_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "roro")
+
+# number of seconds the method listing of the server is cached on disk
+METADATA_CACHE_TTL = int(os.getenv("RORODATA_METADATA_CACHE_TTL", "3600"))
+
+# size of the buffer used when copying files to and from the server
+COPY_BUFFER_SIZE = int(os.getenv("RORODATA_COPY_BUFFER_SIZE", str(1024*1024)))
+
+# directory to cache the downloaded models and the maximum size of it in bytes
+MODEL_CACHE_DIR = os.getenv("RORODATA_MODEL_CACHE_DIR") or os.path.join(CACHE_DIR, "models")
+MODEL_CACHE_SIZE = int(os.getenv("RORODATA_MODEL_CACHE_SIZE", str(10*1024*1024*1024)))
+
+# default compression for saving models, like "zlib", "lz4" or "zstd:3"
+MODEL_COMPRESSION = os.getenv("RORODATA_MODEL_COMPRESSION")
+
+# files larger than this are uploaded in chunks of this size, when the
+# server supports it
+UPLOAD_CHUNK_SIZE = int(os.getenv("RORODATA_UPLOAD_CHUNK_SIZE", str(32*1024*1024)))
+
+# files are downloaded in ranges of this size, when the server supports it
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("RORODATA_DOWNLOAD_CHUNK_SIZE", str(32*1024*1024)))
+
+# number of chunks or files transferred concurrently
+TRANSFER_CONCURRENCY = int(os.getenv("RORODATA_TRANSFER_CONCURRENCY", "4"))
+
+# number of files read and hashed concurrently when packing the project
+# for deploys
+PACK_CONCURRENCY = int(os.getenv("RORODATA_PACK_CONCURRENCY", "8"))
+
+# format of the archive of the project sent on deploys, "tar.gz" or
+# "tar.zst" (needs the zstandard package), to the servers that accept
+# streamed archives. The others get a plain tar.
+DEPLOY_ARCHIVE_FORMAT = os.getenv("RORODATA_DEPLOY_ARCHIVE_FORMAT", "tar.gz")
+
+# the initial and the maximum delay in seconds between polls when waiting
+# for a task to finish
+TASK_POLL_INTERVAL = float(os.getenv("RORODATA_TASK_POLL_INTERVAL", "0.5"))
+TASK_MAX_POLL_INTERVAL = float(os.getenv("RORODATA_TASK_MAX_POLL_INTERVAL", "10"))
+
+# maximum number of seconds a single long-poll request for the status of a
+# task is held by the server, when the server supports it
+TASK_LONG_POLL_TIMEOUT = float(os.getenv("RORODATA_TASK_LONG_POLL_TIMEOUT", "30"))
+
+# number of times the calls failing with transient errors are retried and
+# the initial delay in seconds between the retries
+RETRIES = int(os.getenv("RORODATA_RETRIES", "3"))
+RETRY_BACKOFF = float(os.getenv("RORODATA_RETRY_BACKOFF", "0.5"))
+
+# number of consecutive failures after which the calls to the server fail
+# immediately, and for how many seconds
+CIRCUIT_BREAKER_THRESHOLD = int(os.getenv("RORODATA_CIRCUIT_BREAKER_THRESHOLD", "5"))
+CIRCUIT_BREAKER_TIMEOUT = float(os.getenv("RORODATA_CIRCUIT_BREAKER_TIMEOUT", "30"))
+
+# cache of the responses of the read-mostly methods of the server, off by
+# default. "memory" keeps them in memory and "disk" also in CACHE_DIR, see
+# roro.responsecache
+RESPONSE_CACHE = os.getenv("RORODATA_RESPONSE_CACHE", "")
+
+# maximum number of responses kept in memory
+RESPONSE_CACHE_SIZE = int(os.getenv("RORODATA_RESPONSE_CACHE_SIZE", "256"))
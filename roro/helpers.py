@@ -1,5 +1,10 @@
 import datetime
+import importlib
+import os
 import sys
+import tempfile
+import threading
+import types
 
 try:
     from urllib.parse import urlparse
@@ -7,9 +12,45 @@ except ImportError:
     # python 2
     from urlparse import urlparse
 
+try:
+    import fcntl
+except ImportError:
+    # windows
+    fcntl = None
+    import msvcrt
+
 PY2 = (sys.version_info.major == 2)
 
 
+class LazyModule(types.ModuleType):
+    """Stand-in for a module that is imported on first use.
+
+    This keeps the modules with heavy dependencies out of the startup of
+    the roro command, for the subcommands that don't need them.
+
+        >>> projects = LazyModule("roro.projects")
+        >>> projects.current_project()  # roro.projects is imported here
+
+    The attributes can also come from different modules, given as a dict
+    from the attribute name to the module name. The roro package uses that
+    for its public API.
+    """
+    def __init__(self, name, attributes=None):
+        types.ModuleType.__init__(self, name)
+        self._attributes = attributes
+
+    def __getattr__(self, attr):
+        if self._attributes is None:
+            module = self.__name__
+        elif attr in self._attributes:
+            module = self._attributes[attr]
+        else:
+            raise AttributeError("module {!r} has no attribute {!r}".format(self.__name__, attr))
+        return getattr(importlib.import_module(module), attr)
+
+    def __dir__(self):
+        return sorted(set(self.__dict__) | set(self._attributes or []))
+
 def parse_time(timestr):
     if not timestr:
         return datetime.datetime.utcnow()
@@ -133,3 +174,117 @@ def get_host_name(url):
     host = urlparse(url).netloc
     host_name = host.split(':')[0]
     return host_name
+
+def replace_file(src, dest):
+    """Renames src to dest, replacing dest if it already exists.
+
+    The rename is atomic on posix systems.
+    """
+    if hasattr(os, "replace"):
+        os.replace(src, dest)
+    else:
+        # python 2
+        if os.name == "nt" and os.path.exists(dest):
+            os.remove(dest)
+        os.rename(src, dest)
+
+def atomic_write(path, data):
+    """Writes the given bytes to path atomically.
+
+    The data is written to a temp file in the same directory and renamed to
+    path, so that readers never see a partially written file.
+    """
+    dirname = os.path.dirname(path)
+    try:
+        os.makedirs(dirname)
+    except OSError:
+        if not os.path.isdir(dirname):
+            raise
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        replace_file(tmp_path, path)
+    except:
+        os.remove(tmp_path)
+        raise
+
+class FileLock:
+    """Exclusive lock across processes, held on the given lock file.
+
+        with FileLock("/tmp/foo.lock"):
+            ...
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, "a+")
+        if fcntl:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        else:
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+        return self
+
+    def __exit__(self, *exc_info):
+        if fcntl:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        else:
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        self._file.close()
+        self._file = None
+
+class PipeStream:
+    """File object to read the data written by a function running in a
+    background thread, through a pipe.
+
+    The function is called with a file object opened for writing. If the
+    function fails, reading raises that error instead of reaching EOF, so
+    that partial data is never taken for the complete data.
+
+        with PipeStream(lambda f: f.write(b"hello")) as f:
+            f.read()
+    """
+    def __init__(self, write_func, name=None):
+        read_fd, write_fd = os.pipe()
+        self._fileobj = os.fdopen(read_fd, "rb")
+        self.name = name
+        self.error = None
+        self._thread = threading.Thread(target=self._write, args=(write_func, write_fd))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _write(self, write_func, write_fd):
+        f = os.fdopen(write_fd, "wb")
+        try:
+            write_func(f)
+        except Exception as e:
+            # set the error before closing, so that the reader sees it at EOF
+            self.error = e
+        finally:
+            try:
+                f.close()
+            except (IOError, OSError):
+                # the reader is closed already
+                pass
+
+    def read(self, size=-1):
+        data = self._fileobj.read(size)
+        if not data and self.error is not None:
+            raise self.error
+        return data
+
+    def close(self):
+        """Closes the stream. The writer is stopped if it hasn't finished.
+        """
+        self._fileobj.close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,113 @@
+"""
+    roro.ignore
+    ~~~~~~~~~~~
+
+    Support for ignoring files when deploying a project.
+
+    The patterns are read from the .gitignore and .roroignore files in the
+    project directory, in that order, and follow the syntax of .gitignore.
+    Since the patterns from .roroignore come later, they take precedence.
+    For example, a data directory ignored by git can still be deployed by
+    adding ``!data/`` to .roroignore.
+"""
+import os
+import re
+
+IGNORE_FILES = [".gitignore", ".roroignore"]
+
+# always ignored, unless included explicitly
+DEFAULT_PATTERNS = [".git/", "__pycache__/", "*.pyc"]
+
+class IgnoreRules:
+    def __init__(self, patterns):
+        self.rules = [rule for rule in (_parse_pattern(p) for p in patterns) if rule]
+
+    @classmethod
+    def from_directory(cls, root):
+        """Returns the IgnoreRules from the ignore files in the given directory.
+        """
+        patterns = list(DEFAULT_PATTERNS)
+        for filename in IGNORE_FILES:
+            path = os.path.join(root, filename)
+            if os.path.exists(path):
+                with open(path) as f:
+                    patterns += f.read().splitlines()
+        return cls(patterns)
+
+    def is_ignored(self, path, is_dir=False):
+        """Tells whether the given path is ignored.
+
+        :param path: the path relative to the project directory with / as
+            the separator
+        :param is_dir: whether the path is a directory
+        """
+        ignored = False
+        for regex, negate, dir_only in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if regex.match(path):
+                ignored = not negate
+        return ignored
+
+def _parse_pattern(pattern):
+    """Parses the gitignore pattern into a tuple of (regex, negate, dir_only).
+
+    Returns None for blank lines and comments.
+    """
+    pattern = pattern.rstrip()
+    if not pattern or pattern.startswith("#"):
+        return None
+
+    negate = pattern.startswith("!")
+    if negate:
+        pattern = pattern[1:]
+    elif pattern.startswith("\\"):
+        pattern = pattern[1:]
+
+    dir_only = pattern.endswith("/")
+    pattern = pattern.rstrip("/")
+
+    # patterns with a / in them are relative to the root, others match
+    # the name at any level
+    anchored = "/" in pattern
+    pattern = pattern.lstrip("/")
+
+    regex = _translate(pattern)
+    if anchored:
+        regex = "^" + regex + "$"
+    else:
+        regex = "^(.*/)?" + regex + "$"
+    return re.compile(regex), negate, dir_only
+
+def _translate(pattern):
+    """Translates the glob pattern into a regular expression.
+    """
+    i, n = 0, len(pattern)
+    result = ""
+    while i < n:
+        if pattern.startswith("**/", i):
+            result += "(.*/)?"
+            i += 3
+        elif pattern.startswith("/**", i) and i + 3 == n:
+            result += "/.*"
+            i += 3
+        elif pattern.startswith("**", i):
+            result += ".*"
+            i += 2
+        elif pattern[i] == "*":
+            result += "[^/]*"
+            i += 1
+        elif pattern[i] == "?":
+            result += "[^/]"
+            i += 1
+        elif pattern[i] == "[" and "]" in pattern[i+1:]:
+            j = pattern.index("]", i+1)
+            chars = pattern[i+1:j]
+            if chars.startswith("!"):
+                chars = "^" + chars[1:]
+            result += "[" + chars.replace("\\", "\\\\") + "]"
+            i = j + 1
+        else:
+            result += re.escape(pattern[i])
+            i += 1
+    return result
@@ -0,0 +1,213 @@
+"""
+    roro.logexport
+    ~~~~~~~~~~~~~~
+
+    Exporting the logs of jobs to compressed local files.
+
+    The logs are written as JSON lines, compressed with gzip or zstd. The
+    file is made of independently compressed blocks of about BLOCK_SIZE
+    bytes of logs each. Concatenated gzip members and zstd frames are valid
+    files of their own, so the file can be read by zcat or zstdcat.
+
+    A small index is written next to the file, with the same name and an
+    extra .idx extension. It has the offset, the length and the time range
+    of every block, from its oldest to its newest log, so that reading the logs of a time range decompresses
+    only the blocks overlapping it:
+
+        {
+            "version": 1,
+            "compression": "gzip",
+            "blocks": [
+                {"offset": 0, "length": 5123, "count": 1000, "start": 1500000000000, "end": 1500000060000},
+                ...
+            ]
+        }
+"""
+import gzip
+import io
+import json
+import os
+import zlib
+from .helpers import atomic_write, replace_file
+
+# number of bytes of uncompressed logs in a block
+BLOCK_SIZE = 1024 * 1024
+
+INDEX_VERSION = 1
+
+def write_logs(logs, path, compression=None):
+    """Writes the logs to a compressed JSON lines file at path, along with
+    the time index at path + ".idx".
+
+    The logs are best written in the order of their timestamps, so that
+    reading a time range decompresses fewer blocks. The file is
+    replaced only once all the logs are written, or when interrupted by
+    KeyboardInterrupt, with the logs written until then. On other errors
+    nothing is written.
+
+    :param logs: iterable of logs
+    :param path: path of the file
+    :param compression: "gzip" or "zstd", guessed from the extension of
+        path by default, gzip unless it ends with .zst
+    :return: the number of logs written
+    """
+    compression = compression or guess_compression(path)
+    compress = _get_compressor(compression)
+    blocks = []
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            for block in _make_blocks(logs):
+                data = compress(b"".join(line for _, line in block))
+                blocks.append({
+                    "offset": f.tell(),
+                    "length": len(data),
+                    "count": len(block),
+                    "start": min(timestamp for timestamp, _ in block),
+                    "end": max(timestamp for timestamp, _ in block)
+                })
+                f.write(data)
+    except KeyboardInterrupt:
+        # stopping roro logs -f keeps the logs written so far
+        _finish(tmp_path, path, compression, blocks)
+        raise
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return _finish(tmp_path, path, compression, blocks)
+
+def _finish(tmp_path, path, compression, blocks):
+    """Moves the file written at tmp_path to path and writes its index.
+    Returns the number of logs in it.
+    """
+    index = {
+        "version": INDEX_VERSION,
+        "compression": compression,
+        "blocks": blocks
+    }
+    replace_file(tmp_path, path)
+    atomic_write(get_index_path(path), json.dumps(index).encode("utf-8"))
+    return sum(block["count"] for block in blocks)
+
+def read_logs(path, since=None, until=None):
+    """Yields the logs from the file at path, written by write_logs,
+    optionally only the ones with timestamp since or later and before
+    until.
+
+    Only the blocks overlapping the time range are read, when the index
+    is available. Otherwise the whole file is read.
+    """
+    index = _read_index(path)
+    if index is None:
+        compression = guess_compression(path)
+        chunks = [_decompress_all(path, compression)]
+    else:
+        chunks = _read_blocks(path, index, since, until)
+
+    for data in chunks:
+        for line in io.BytesIO(data):
+            log = json.loads(line.decode("utf-8"))
+            if since is not None and log["timestamp"] < since:
+                continue
+            if until is not None and log["timestamp"] >= until:
+                continue
+            yield log
+
+def get_index_path(path):
+    return path + ".idx"
+
+def guess_compression(path):
+    return "zstd" if path.endswith(".zst") else "gzip"
+
+def _make_blocks(logs):
+    """Yields the logs, as lists of (timestamp, line), in blocks of about
+    BLOCK_SIZE bytes.
+    """
+    block = []
+    size = 0
+    try:
+        for log in logs:
+            line = (json.dumps(log) + "\n").encode("utf-8")
+            block.append((log["timestamp"], line))
+            size += len(line)
+            if size >= BLOCK_SIZE:
+                yield block
+                block = []
+                size = 0
+    except KeyboardInterrupt:
+        # the logs read so far are written before stopping
+        if block:
+            yield block
+        raise
+    if block:
+        yield block
+
+def _read_blocks(path, index, since, until):
+    decompress = _get_decompressor(index["compression"])
+    with open(path, "rb") as f:
+        for block in index["blocks"]:
+            if since is not None and block["end"] < since:
+                continue
+            if until is not None and block["start"] >= until:
+                continue
+            f.seek(block["offset"])
+            yield decompress(f.read(block["length"]))
+
+def _read_index(path):
+    try:
+        with open(get_index_path(path)) as f:
+            index = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    if index.get("version") != INDEX_VERSION:
+        return None
+    # the index is stale when the file has been written again
+    blocks = index["blocks"]
+    size = blocks[-1]["offset"] + blocks[-1]["length"] if blocks else 0
+    if os.path.getsize(path) != size:
+        return None
+    return index
+
+def _get_compressor(compression):
+    if compression == "gzip":
+        return _gzip_compress
+    elif compression == "zstd":
+        return _import_zstandard().ZstdCompressor(level=3).compress
+    else:
+        raise ValueError("Unsupported compression {!r}".format(compression))
+
+def _get_decompressor(compression):
+    if compression == "gzip":
+        return lambda data: zlib.decompress(data, 16 + zlib.MAX_WBITS)
+    elif compression == "zstd":
+        return _import_zstandard().ZstdDecompressor().decompress
+    else:
+        raise ValueError("Unsupported compression {!r}".format(compression))
+
+def _gzip_compress(data):
+    f = io.BytesIO()
+    with gzip.GzipFile(filename="", mode="wb", fileobj=f, mtime=0) as gz:
+        gz.write(data)
+    return f.getvalue()
+
+def _decompress_all(path, compression):
+    if compression == "gzip":
+        with gzip.open(path, "rb") as f:
+            return f.read()
+
+    zstandard = _import_zstandard()
+    with open(path, "rb") as f:
+        data = f.read()
+    chunks = []
+    while data:
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+        chunks.append(decompressor.decompress(data))
+        data = decompressor.unused_data
+    return b"".join(chunks)
+
+def _import_zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise Exception("The zstd compression needs the zstandard package")
+    return zstandard
@@ -0,0 +1,313 @@
+"""
+    roro.logs
+    ~~~~~~~~~
+
+    Fetching the logs of jobs.
+
+    Each log is a dict with timestamp, in milliseconds, and message. While
+    following the logs of a running job, only the new logs are fetched:
+
+    * when the server advertises stream_logs, the logs are read from a
+      single long-lived response, with one JSON record per line. The last
+      record has the status of the job instead of a message, once it has
+      finished.
+    * when the logs method of the server accepts since, the logs from the
+      last seen timestamp onwards are fetched every poll_interval seconds.
+    * otherwise, the full log is fetched every time and only the new logs
+      are returned.
+
+    The logs of many jobs are followed concurrently by merge_logs, which
+    merges them in the order of their timestamps.
+
+    The logs are rendered as text, or as JSON lines, by write_logs.
+"""
+import datetime
+import heapq
+import json
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    # python 2
+    import Queue as queue
+
+# statuses of jobs that are not running anymore
+FINISHED_STATUSES = ['success', 'cancelled', 'failed']
+
+# number of seconds between polls, when the logs can't be streamed
+POLL_INTERVAL = 0.5
+
+# number of logs held back to merge the logs of many jobs by timestamp, and
+# the maximum number of seconds a log is held back
+REORDER_BUFFER_SIZE = 1000
+REORDER_DELAY = 1.0
+
+def get_logs(project, jobid, since=None):
+    """Returns the logs of the job, optionally only the ones with timestamp
+    since or later.
+    """
+    if since is not None and supports_since(project.client):
+        return project.client.logs(project=project.name, jobid=jobid, since=since)
+    logs = project.client.logs(project=project.name, jobid=jobid)
+    if since is not None:
+        logs = [log for log in logs if log['timestamp'] >= since]
+    return logs
+
+def follow_logs(project, jobid, since=None, poll_interval=None, idle_marker=False):
+    """Yields the logs of the job as they are written, until the job has
+    finished.
+
+    :param project: the Project
+    :param jobid: id of the job
+    :param since: only the logs with this timestamp or later are returned
+    :param poll_interval: seconds between the polls, when the logs can't
+        be streamed, defaults to POLL_INTERVAL
+    :param idle_marker: yield None whenever all the logs available so far
+        have been yielded, before waiting for more. This is used to flush
+        the output, see write_logs.
+    """
+    if supports_streaming(project.client):
+        return _stream_logs(project, jobid, since, idle_marker)
+    else:
+        return _poll_logs(project, jobid, since, poll_interval or POLL_INTERVAL, idle_marker)
+
+def supports_since(client):
+    return client.has_param("logs", "since")
+
+def supports_streaming(client):
+    return client.has_method("stream_logs")
+
+def _stream_logs(project, jobid, since=None, idle_marker=False):
+    stream = project.client.stream_logs(project=project.name, jobid=jobid, since=since)
+    try:
+        lines = _read_ahead(stream) if idle_marker else stream
+        for line in lines:
+            if line is None:
+                yield None
+                continue
+            if not line.strip():
+                continue
+            record = json.loads(line.decode('utf-8'))
+            if 'message' in record:
+                yield record
+            elif record.get('status') in FINISHED_STATUSES:
+                break
+    finally:
+        stream.close()
+
+def _read_ahead(stream, buffer_size=None):
+    """Yields the lines of the stream, read in a background thread, and
+    None whenever the lines read so far have all been yielded.
+    """
+    q = queue.Queue(maxsize=buffer_size or REORDER_BUFFER_SIZE)
+    _DONE = object()
+
+    def read():
+        try:
+            for line in stream:
+                q.put(line)
+            q.put(_DONE)
+        except Exception as e:
+            q.put(e)
+
+    t = threading.Thread(target=read)
+    t.daemon = True
+    t.start()
+    while True:
+        if q.empty():
+            yield None
+        item = q.get()
+        if item is _DONE:
+            break
+        elif isinstance(item, Exception):
+            raise item
+        yield item
+
+def _poll_logs(project, jobid, since, poll_interval, idle_marker=False):
+    cursor = LogCursor(since)
+    while True:
+        new_logs = cursor.new_logs(get_logs(project, jobid, since=cursor.since))
+        for log in new_logs:
+            yield log
+        # the status is checked only when there are no new logs, and the
+        # logs written just before the job has finished are fetched after
+        if not new_logs and project.ps(jobid)['status'] in FINISHED_STATUSES:
+            for log in cursor.new_logs(get_logs(project, jobid, since=cursor.since)):
+                yield log
+            break
+        if idle_marker:
+            yield None
+        time.sleep(poll_interval)
+
+class LogCursor:
+    """Tracks the logs seen so far.
+
+    The logs are fetched again from the timestamp of the last seen log,
+    inclusive, as more logs with the same timestamp may have been written
+    after the last fetch. The ones already seen are skipped.
+    """
+    def __init__(self, since=None):
+        self.since = since
+        self.seen = 0
+
+    def new_logs(self, logs):
+        """Returns the logs that are not seen yet, from the logs with
+        timestamp self.since or later.
+        """
+        new = []
+        skip = self.seen
+        for log in logs:
+            if self.since is not None and log['timestamp'] == self.since and skip:
+                skip -= 1
+                continue
+            new.append(log)
+            if log['timestamp'] == self.since:
+                self.seen += 1
+            else:
+                self.since = log['timestamp']
+                self.seen = 1
+        return new
+
+def merge_logs(project, jobids, follow=False, buffer_size=None, delay=None, idle_marker=False):
+    """Yields the logs of all the jobs, ordered by timestamp. Each log has
+    the jobid added to it.
+
+    When following, the jobs are followed concurrently, each in its own
+    thread, and the logs are merged through a reorder buffer. A log is
+    held back until buffer_size newer logs have arrived or for at most
+    delay seconds, so the output is ordered unless the logs of some job
+    arrive later than that. The memory used doesn't grow with the length
+    of the logs.
+
+    :param project: the Project
+    :param jobids: ids of the jobs
+    :param follow: follow the logs until all the jobs have finished
+    :param buffer_size: size of the reorder buffer, defaults to
+        REORDER_BUFFER_SIZE
+    :param delay: seconds a log is held back, defaults to REORDER_DELAY
+    :param idle_marker: yield None, when following, whenever the logs
+        that are due have been yielded, see follow_logs
+    """
+    if not follow:
+        streams = [_with_jobid(jobid, get_logs(project, jobid)) for jobid in jobids]
+        return (entry.log for entry in heapq.merge(*streams))
+    return _follow_merged(project, jobids, buffer_size or REORDER_BUFFER_SIZE, delay or REORDER_DELAY, idle_marker)
+
+def _with_jobid(jobid, logs):
+    # heapq.merge in python 2 doesn't take a key
+    for i, log in enumerate(logs):
+        yield _Entry(log['timestamp'], i, dict(log, jobid=jobid))
+
+class _Entry:
+    """A log ordered by the timestamp and then the order of arrival.
+    """
+    def __init__(self, timestamp, seq, log, arrival=None):
+        self.timestamp = timestamp
+        self.seq = seq
+        self.log = log
+        self.arrival = arrival
+
+    def __lt__(self, other):
+        return (self.timestamp, self.seq) < (other.timestamp, other.seq)
+
+def _follow_merged(project, jobids, buffer_size, delay, idle_marker=False):
+    q = queue.Queue(maxsize=buffer_size)
+    _DONE = object()
+
+    def follow(jobid):
+        try:
+            for log in follow_logs(project, jobid):
+                q.put((jobid, log))
+            q.put((jobid, _DONE))
+        except Exception as e:
+            q.put((jobid, e))
+
+    for jobid in jobids:
+        t = threading.Thread(target=follow, args=(jobid,))
+        t.daemon = True
+        t.start()
+
+    heap = []
+    seq = 0
+    running = len(jobids)
+    while running or heap:
+        # wait no longer than until the oldest log in the buffer is due
+        timeout = delay if not heap else max(0, heap[0].arrival + delay - time.time())
+        try:
+            jobid, item = q.get(timeout=timeout) if running else (None, None)
+        except queue.Empty:
+            jobid, item = None, None
+
+        if item is _DONE:
+            running -= 1
+        elif isinstance(item, Exception):
+            raise item
+        elif item is not None:
+            seq += 1
+            heapq.heappush(heap, _Entry(item['timestamp'], seq, dict(item, jobid=jobid), time.time()))
+
+        # all the logs are flushed once all the jobs have finished
+        now = time.time()
+        emitted = False
+        while heap and (not running or len(heap) > buffer_size or now - heap[0].arrival >= delay):
+            yield heapq.heappop(heap).log
+            emitted = True
+        if idle_marker and emitted and q.empty():
+            yield None
+
+class LogFormatter:
+    """Formats logs as lines of text.
+
+    This is on the hot path when printing long logs, so the formatting
+    function is picked once for the given options and the timestamp
+    string is computed only once for all the logs in the same second.
+    """
+    def __init__(self, show_timestamp=False, show_jobid=False, raw=False):
+        self._second = None
+        self._timestr = None
+        if raw:
+            self.format = self._format_raw
+        elif show_timestamp and show_jobid:
+            self.format = lambda log: log['jobid'] + ": [" + self.format_timestamp(log['timestamp']) + "] " + log['message'] + "\n"
+        elif show_timestamp:
+            self.format = lambda log: "[" + self.format_timestamp(log['timestamp']) + "] " + log['message'] + "\n"
+        elif show_jobid:
+            self.format = lambda log: log['jobid'] + ": " + log['message'] + "\n"
+        else:
+            self.format = lambda log: log['message'] + "\n"
+
+    def format_timestamp(self, timestamp):
+        second = timestamp // 1000
+        if second != self._second:
+            self._timestr = datetime.datetime.fromtimestamp(second).isoformat()
+            self._second = second
+        return self._timestr
+
+    def _format_raw(self, log):
+        return json.dumps(log) + "\n"
+
+def write_logs(logs, stream, formatter, batch_size=1000):
+    """Writes the logs to the stream, formatted using the formatter.
+
+    The lines are written in batches of batch_size lines. A None in the
+    logs, see the idle_marker of follow_logs, writes and flushes the lines
+    pending so far.
+    """
+    format = formatter.format
+    batch = []
+    for log in logs:
+        if log is None:
+            if batch:
+                stream.write("".join(batch))
+                stream.flush()
+                del batch[:]
+            continue
+        batch.append(format(log))
+        if len(batch) >= batch_size:
+            stream.write("".join(batch))
+            del batch[:]
+    if batch:
+        stream.write("".join(batch))
+    stream.flush()
@@ -0,0 +1,140 @@
+"""
+    roro.modelcache
+    ~~~~~~~~~~~~~~~
+
+    On-disk cache of the models downloaded from the server.
+
+    The models are stored in config.MODEL_CACHE_DIR, keyed by the project,
+    the repository, the version and the Model-ID of the model image. When
+    the total size of the cache grows beyond config.MODEL_CACHE_SIZE, the
+    least recently used models are evicted.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+from . import config
+from .helpers import FileLock, replace_file
+
+logger = logging.getLogger(__name__)
+
+def get_model_cache():
+    """Returns the ModelCache as per the current configuration.
+    """
+    return ModelCache(config.MODEL_CACHE_DIR, config.MODEL_CACHE_SIZE)
+
+class ModelCache:
+    SUFFIX = ".model"
+
+    def __init__(self, root, max_size):
+        """Creates a new ModelCache.
+
+        :param root: directory to keep the cached models
+        :param max_size: maximum size of the cache in bytes
+        """
+        self.root = root
+        self.max_size = max_size
+
+    def get_path(self, key):
+        """Returns the path of the cached file for the given key.
+        """
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.root, name + self.SUFFIX)
+
+    def get(self, key):
+        """Returns the path of the cached file for the given key if it is
+        present in the cache, None otherwise.
+        """
+        path = self.get_path(key)
+        if os.path.exists(path):
+            self._touch(path)
+            return path
+
+    def fetch(self, key, download):
+        """Returns the path of the cached file for the given key, downloading
+        it if it is not present in the cache.
+
+        The download function is called with a file object opened for
+        writing. When many processes try to fetch the same key, only one of
+        them downloads it and the others wait for it to finish.
+
+        :param key: the cache key
+        :param download: function to write the contents to the given file object
+        :return: path to the cached file
+        """
+        path = self.get(key)
+        if path:
+            return path
+
+        self._makedirs()
+        with FileLock(self.get_path(key) + ".lock"):
+            # some other process may have downloaded it while we waited
+            path = self.get(key)
+            if not path:
+                path = self._download(key, download)
+        self.evict(keep=path)
+        return path
+
+    def _download(self, key, download):
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                download(f)
+            path = self.get_path(key)
+            replace_file(tmp_path, path)
+            return path
+        except:
+            os.remove(tmp_path)
+            raise
+
+    def evict(self, keep=None):
+        """Removes the least recently used files from the cache till the size
+        of the cache is within the limit.
+
+        :param keep: path of a file that must not be evicted
+        """
+        with FileLock(os.path.join(self.root, ".lock")):
+            entries = []
+            for name in os.listdir(self.root):
+                if not name.endswith(self.SUFFIX):
+                    continue
+                path = os.path.join(self.root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_size:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError as e:
+                    # the file could be in use on windows
+                    logger.warning("Unable to remove %s from the model cache (%s)", path, e)
+                    continue
+                # a process fetching the same key meanwhile may lock a new
+                # lock file, at worst the model is downloaded twice, each
+                # download replacing the file atomically
+                try:
+                    os.remove(path + ".lock")
+                except OSError:
+                    pass
+
+    def _touch(self, path):
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+    def _makedirs(self):
+        try:
+            os.makedirs(self.root)
+        except OSError:
+            if not os.path.isdir(self.root):
+                raise
@@ -1,34 +1,40 @@
 from __future__ import print_function
 import io
 import os.path
-import joblib
 import re
 import shutil
 import tempfile
-from . import serializers
+from . import serializers, config
+from .modelcache import get_model_cache
+from .helpers import PipeStream
 
-def get_model_repository(client, project, name):
+def get_model_repository(client, project, name, compression=None):
     """Returns the ModelRepository with given name from the specified project.
 
     :param project: the name of the project
     :param name: name of the repository
+    :param compression: compression used when saving models to the repository
     """
-    return ModelRepository(client, project, name)
+    return ModelRepository(client, project, name, compression=compression)
 
 def list_model_repositories(client, project):
     return ModelRepository.find_all(client, project)
 
 class ModelRepository:
-    def __init__(self, client, project, name):
+    def __init__(self, client, project, name, compression=None):
         """Creates a new ModelRepository.
 
         :param client: the client instance used to interact with the roro-server.
         :param project: name of the project
         :param name: name of the repository
+        :param compression: compression used when saving the models to this
+            repository, defaults to config.MODEL_COMPRESSION.
+            See roro.serializers.save_model for the supported values.
         """
         self.client = client
         self.project = project
         self.name = name
+        self.compression = compression or config.MODEL_COMPRESSION
 
     def get_model_image(self, tag=None, version=None):
         metadata = self.client.get_model_version(
@@ -88,7 +94,7 @@ class ModelImage:
 
     @property
     def id(self):
-        return self._metadata.get("Model-Id")
+        return self._metadata.get("Model-ID") or self._metadata.get("Model-Id")
 
     @property
     def version(self):
@@ -140,41 +146,106 @@ class ModelImage:
     def get(self, name, default=None):
         return self._metadata.get(name, default)
 
-    def get_model(self):
+    def get_model(self, mmap_mode=None):
+        """Returns the model object of this image.
+
+        The model is downloaded on first access. When mmap_mode is given,
+        for example ``'r'``, the large numpy arrays in the model are
+        memory-mapped from disk instead of being read into memory. With
+        ``'r'`` the arrays are read-only.
+        """
         if self._model is None:
-            self._model = self._load_model()
+            self._model = self._load_model(mmap_mode=mmap_mode)
         return self._model
 
-    def _load_model(self):
+    def _load_model(self, mmap_mode=None):
+        path = self._get_model_file()
+        # models saved before Content-Encoding was recorded used joblib
+        serializer = self.get("Content-Encoding") or "joblib"
+        if self.get("Content-Compression"):
+            # compressed models can't be memory-mapped
+            mmap_mode = None
+        return serializers.load_model(path, serializer, mmap_mode=mmap_mode)
+
+    def _get_model_file(self):
+        """Returns the path to the serialized model in the local model cache,
+        downloading it if required.
+        """
+        return get_model_cache().fetch(self._get_cache_key(), self._download_model)
+
+    def _get_cache_key(self):
+        return "{}/{}/{}/{}".format(
+            self._repo.project,
+            self._repo.name,
+            self.version,
+            self.id or "")
+
+    def _download_model(self, fileobj):
+        """Streams the serialized model from the server into fileobj.
+        """
         f = self._repo.client.get_model(
                     project=self._repo.project,
                     name=self._repo.name,
                     version=self.version)
-        f2 = io.BytesIO()
-        shutil.copyfileobj(f, f2)
-        f2.seek(0)
-        return joblib.load(f2)
+        shutil.copyfileobj(f, fileobj, config.COPY_BUFFER_SIZE)
 
-    def save(self, comment=""):
+    def save(self, comment="", compression=None):
         """Saves a new version of the model image.
+
+        The model is serialized and uploaded at the same time, without
+        writing it to disk, when the serializer can write it to a pipe. Once
+        saved, the Model-ID and the Model-Version of the new version are
+        updated in the metadata.
+
+        :param comment: the comment to record with this version
+        :param compression: compression to use for the model, defaults to
+            the compression of the repository. The compression used is
+            recorded as Content-Compression in the metadata.
         """
         if self.id is not None:
             raise Exception("ModelImage can't be modified once created.")
         if self._model is None:
             raise Exception("model object is not specified")
 
+        compression = compression or self._repo.compression
+        serializer = serializers._find_suitable_serializer(self._model)
+        self['Content-Encoding'] = serializer.NAME
+        if not serializer.SUPPORTS_COMPRESSION:
+            compression = None
+        if compression:
+            self['Content-Compression'] = compression
+
+        if serializer.can_dump_fileobj(compression):
+            response = self._save_streaming(serializer, compression, comment)
+        else:
+            response = self._save_tempfile(serializer, compression, comment)
+
+        # the response has the metadata of the newly created version
+        if isinstance(response, dict):
+            self._metadata.update(response)
+        self.comment = comment
+
+    def _save_streaming(self, serializer, compression, comment):
+        def dump(f):
+            serializers._dump(serializer, self._model, f, compression=compression)
+
+        with PipeStream(dump, name="model.model") as f:
+            return self._upload(f, comment)
+
+    def _save_tempfile(self, serializer, compression, comment):
         with tempfile.TemporaryDirectory() as tmpdir:
             filepath = os.path.join(tmpdir, "model.model")
-            serializer_name = serializers.save_model(self._model, filepath)
-            self['Content-Encoding'] = serializer_name
-            self._repo.client.save_model(
-                project=self._repo.project,
-                name=self._repo.name,
-                model=open(filepath, 'rb'),
-                comment=comment,
-                **self._metadata)
-            # TODO: Update the version and model-id
-
+            serializers._dump(serializer, self._model, filepath, compression=compression)
+            with open(filepath, 'rb') as f:
+                return self._upload(f, comment)
+
+    def _upload(self, fileobj, comment):
+        return self._repo.client.save_model(
+            project=self._repo.project,
+            name=self._repo.name,
+            model=fileobj,
+            comment=comment,
+            **self._metadata)
 
     def __repr__(self):
         return "<ModelImage {}/{}@{}>".format(self._repo.project, self._repo.name, self.version)
@@ -0,0 +1,286 @@
+"""
+    roro.packer
+    ~~~~~~~~~~~
+
+    Packing the project directory for deploys.
+
+    For incremental deploys, the project directory is described by a
+    manifest listing the path, size, mode and sha256 hash of every file.
+    The server is asked which of those blobs it doesn't have yet and only
+    those are uploaded.
+
+    The hashes are cached in config.CACHE_DIR, keyed on the size and the
+    modification time of each file, so that unchanged files are not hashed
+    again on the next deploy.
+
+    Otherwise, the project is deployed as a compressed tar archive, which
+    is generated while it is uploaded, or as a plain tar archive to the
+    servers that don't accept streamed archives. The files are read ahead on a pool
+    of threads and the archive is deterministic, the files are added in
+    sorted order with fixed timestamps and owners, so that identical trees
+    give byte-identical archives.
+
+    The files matching the patterns in .gitignore and .roroignore are not
+    deployed, see roro.ignore.
+"""
+import contextlib
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import tarfile
+from multiprocessing.pool import ThreadPool
+from . import config
+from .helpers import atomic_write, PipeStream
+from .ignore import IgnoreRules
+from .transfers import run_concurrently
+
+logger = logging.getLogger(__name__)
+
+def supports_incremental_deploy(client):
+    return client.has_method("deploy_manifest")
+
+def supports_streamed_archive(client):
+    """Tells whether the deploy method of the server accepts compressed
+    archives streamed without a size, see config.DEPLOY_ARCHIVE_FORMAT.
+    """
+    return client.has_param("deploy", "streamed")
+
+def deploy(client, project, root, async_=False):
+    """Deploys the project from the directory root, uploading only the
+    files that the server doesn't have already.
+
+    :param client: the RoroClient
+    :param project: name of the project
+    :param root: the project directory
+    :param async_: return the task id instead of waiting for the deploy
+    :return: the response of the deploy_manifest call
+    """
+    manifest = build_manifest(root)
+    hashes = sorted(set(f["sha256"] for f in manifest))
+    missing = client.missing_blobs(project=project, hashes=hashes)
+    logger.info("uploading %d of %d blobs", len(missing), len(hashes))
+    if missing:
+        upload_blobs(client, project, root, manifest, missing)
+    return client.deploy_manifest(project=project, manifest=manifest, **{"async": async_})
+
+ARCHIVE_FORMATS = ["tar", "tar.gz", "tar.zst"]
+
+def open_archive(root, format="tar.gz"):
+    """Returns a file object to read the archive of the directory root.
+
+    The archive is generated in a background thread as it is read, without
+    writing it to disk.
+    """
+    name = "roro-project." + format
+    return PipeStream(lambda f: write_archive(root, f, format), name=name)
+
+def write_archive(root, fileobj, format="tar.gz", concurrency=None):
+    """Writes the archive of the directory root to the given file object.
+
+    :param root: the directory
+    :param fileobj: the file object to write to
+    :param format: one of "tar", "tar.gz" or "tar.zst". The zstd format
+        needs the zstandard package and compresses using multiple threads.
+    :param concurrency: number of files read ahead concurrently, defaults
+        to config.PACK_CONCURRENCY
+    """
+    if format not in ARCHIVE_FORMATS:
+        raise ValueError("Unsupported archive format {!r}".format(format))
+    paths = list_files(root)
+    with _open_compressed(fileobj, format) as f:
+        with tarfile.open(fileobj=f, mode="w|", format=tarfile.PAX_FORMAT) as tar:
+            for path, size, mode, data in _read_files(root, paths, concurrency or config.PACK_CONCURRENCY):
+                tarinfo = _make_tarinfo(path, size, mode)
+                if data is not None:
+                    tar.addfile(tarinfo, io.BytesIO(data))
+                else:
+                    with open(os.path.join(root, path), "rb") as src:
+                        tar.addfile(tarinfo, src)
+
+def _make_tarinfo(path, size, mode):
+    """Returns the TarInfo of a file, leaving out everything that depends
+    on the machine or on the time the file was written.
+    """
+    tarinfo = tarfile.TarInfo(path)
+    tarinfo.size = size
+    tarinfo.mode = mode
+    tarinfo.mtime = 0
+    tarinfo.uid = tarinfo.gid = 0
+    tarinfo.uname = tarinfo.gname = ""
+    return tarinfo
+
+def _read_files(root, paths, concurrency, batch_size=None):
+    """Yields (path, size, mode, data) for each of the paths, in the same
+    order.
+
+    The files are read on a pool of threads, one batch ahead of the
+    consumer. The contents of the files larger than config.COPY_BUFFER_SIZE
+    are not read ahead and data is None for them.
+    """
+    def read(path):
+        filename = os.path.join(root, path)
+        st = os.stat(filename)
+        mode = st.st_mode & 0o777
+        if st.st_size > config.COPY_BUFFER_SIZE:
+            return path, st.st_size, mode, None
+        with open(filename, "rb") as f:
+            data = f.read()
+        return path, len(data), mode, data
+
+    batch_size = batch_size or concurrency * 16
+    batches = [paths[i:i+batch_size] for i in range(0, len(paths), batch_size)]
+    if not batches:
+        return
+
+    pool = ThreadPool(concurrency)
+    try:
+        pending = pool.map_async(read, batches[0])
+        for batch in batches[1:] + [None]:
+            results = pending.get()
+            if batch is not None:
+                pending = pool.map_async(read, batch)
+            for result in results:
+                yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+@contextlib.contextmanager
+def _open_compressed(fileobj, format):
+    if format == "tar.gz":
+        # fixed mtime and no filename in the gzip header
+        f = gzip.GzipFile(filename="", mode="wb", fileobj=fileobj, mtime=0)
+    elif format == "tar.zst":
+        f = _ZstdWriter(fileobj)
+    else:
+        yield fileobj
+        return
+    try:
+        yield f
+    finally:
+        f.close()
+
+class _ZstdWriter:
+    """Writes data compressed with zstd to a file object, using as many
+    threads as the CPUs available.
+    """
+    def __init__(self, fileobj, level=3):
+        try:
+            import zstandard
+        except ImportError:
+            raise Exception("The tar.zst format needs the zstandard package")
+        self.fileobj = fileobj
+        self.compressor = zstandard.ZstdCompressor(level=level, threads=-1).compressobj()
+
+    def write(self, data):
+        self.fileobj.write(self.compressor.compress(data))
+        return len(data)
+
+    def close(self):
+        self.fileobj.write(self.compressor.flush())
+
+def list_files(root, rules=None):
+    """Returns the paths of all the files in the directory root, relative
+    to root and with / as separator, in sorted order.
+
+    The files and directories matched by the ignore rules are skipped.
+
+    :param root: the directory
+    :param rules: the IgnoreRules, read from the ignore files in root by default
+    """
+    if rules is None:
+        rules = IgnoreRules.from_directory(root)
+
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        reldir = os.path.relpath(dirpath, root).replace(os.sep, "/")
+        prefix = "" if reldir == "." else reldir + "/"
+        dirnames[:] = [d for d in dirnames if not rules.is_ignored(prefix + d, is_dir=True)]
+        for filename in filenames:
+            path = prefix + filename
+            if os.path.isfile(os.path.join(dirpath, filename)) and not rules.is_ignored(path):
+                paths.append(path)
+    return sorted(paths)
+
+def build_manifest(root, concurrency=None):
+    """Returns the manifest of the files in the directory root.
+
+    The manifest is a list of dicts with path, size, mode and sha256 of
+    each file, sorted by path. The files not found in the hash cache are
+    hashed on a pool of threads.
+    """
+    cache = HashCache(root)
+
+    def get_entry(path):
+        filename = os.path.join(root, path)
+        st = os.stat(filename)
+        return {
+            "path": path,
+            "size": st.st_size,
+            "mode": st.st_mode & 0o777,
+            "sha256": cache.get_hash(path, filename, st)
+        }
+
+    manifest = run_concurrently(get_entry, list_files(root), concurrency or config.PACK_CONCURRENCY)
+    cache.save()
+    return manifest
+
+def upload_blobs(client, project, root, manifest, hashes):
+    """Uploads the files with given hashes as a tar archive, with each file
+    named by its hash.
+    """
+    hashes = set(hashes)
+
+    def write_blobs(f):
+        with tarfile.open(fileobj=f, mode="w|") as tar:
+            for entry in manifest:
+                if entry["sha256"] in hashes:
+                    tar.add(os.path.join(root, entry["path"]), arcname=entry["sha256"])
+                    hashes.discard(entry["sha256"])
+
+    with PipeStream(write_blobs, name="blobs.tar") as f:
+        client.put_blobs(project=project, blobs=f, format="tar")
+
+def sha256sum(filename):
+    sha256 = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for data in iter(lambda: f.read(config.COPY_BUFFER_SIZE), b""):
+            sha256.update(data)
+    return sha256.hexdigest()
+
+class HashCache:
+    """Cache of the hashes of files in a directory, keyed on the size and
+    the modification time of each file.
+    """
+    def __init__(self, root):
+        key = hashlib.sha1(os.path.abspath(root).encode("utf-8")).hexdigest()
+        self.path = os.path.join(config.CACHE_DIR, "deploy", key + ".json")
+        self.entries = self._load()
+        self.modified = False
+
+    def get_hash(self, path, filename, st):
+        entry = self.entries.get(path)
+        if entry and entry[0] == st.st_size and entry[1] == st.st_mtime:
+            return entry[2]
+        sha256 = sha256sum(filename)
+        self.entries[path] = [st.st_size, st.st_mtime, sha256]
+        self.modified = True
+        return sha256
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def save(self):
+        if not self.modified:
+            return
+        try:
+            atomic_write(self.path, json.dumps(self.entries).encode("utf-8"))
+        except (IOError, OSError) as e:
+            logger.warning("Unable to save the hash cache (%s)", e)
@@ -1,6 +1,7 @@
 import shutil
 import  pathlib
-from .helpers import PY2
+from . import config
+from .helpers import PY2, replace_file
 
 if PY2:
     # FileNotFoundError is not defined for Python 2
@@ -29,13 +30,25 @@ class Path:
         return self._path.open(*args, **kwargs)
 
     def safe_write(self, fileobj, name):
+        file_path = self.get_dest_path(name)
+        p = self.get_tmp_path(file_path)
+        with p.open('wb') as f:
+            shutil.copyfileobj(fileobj, f, config.COPY_BUFFER_SIZE)
+        replace_file(str(p), str(file_path))
+
+    def get_dest_path(self, name):
+        """Returns the path to write the file with given name when copying
+        to this path.
+        """
         file_path = self._get_file_path(name)
         if file_path.is_dir():
             raise Exception('Cannot copy, {} is a directory'.format(str(file_path)))
-        p = file_path.with_suffix('.tmp')
-        with p.open('wb') as f:
-            shutil.copyfileobj(fileobj, f)
-            p.rename(file_path)
+        return file_path
+
+    def get_tmp_path(self, file_path):
+        """Returns the temp file used while writing to file_path.
+        """
+        return file_path.with_name(file_path.name + '.tmp')
 
     def _get_file_path(self, name):
         dest = self._path
@@ -1,17 +1,12 @@
 import os
-import shutil
+import random
+import tempfile
 import yaml
 import time
-from . import models, config
-from .client import RoroClient
-from .helpers import PY2
+from . import models, config, transfers, sync, packer, logs, logexport
+from .client import get_client
 from click import ClickException
 
-if PY2:
-    from backports import tempfile
-else:
-    import tempfile
-
 
 class Project:
     SERVER_URL = config.SERVER_URL
@@ -19,7 +14,7 @@ class Project:
     def __init__(self, name, runtime=None):
         self.name = name
         self.runtime = runtime
-        self.client = RoroClient(self.SERVER_URL)
+        self.client = get_client(self.SERVER_URL)
 
     def create(self, repo_url=None):
         """Creates a new project.
@@ -72,32 +67,91 @@ class Project:
             path=path.path
         )
 
-    def logs(self, jobid):
-        return self.client.logs(project=self.name, jobid=jobid)
-        #return self.client.logs(project=self.name)
+    def logs(self, jobid, since=None):
+        """Returns the logs of the job, optionally only the ones with
+        timestamp since or later.
+        """
+        return logs.get_logs(self, jobid, since=since)
+
+    def follow_logs(self, jobid, since=None):
+        """Yields the logs of the job as they are written, until the job
+        has finished. See roro.logs for details.
+        """
+        return logs.follow_logs(self, jobid, since=since)
+
+    def download_logs(self, jobid, path, since=None, until=None, compression=None):
+        """Downloads the logs of the job to a compressed JSON lines file,
+        with a time index to read the logs of a time range quickly. See
+        roro.logexport for details.
+
+        :param jobid: id of the job
+        :param path: path of the file
+        :param since: only the logs with this timestamp or later are downloaded
+        :param until: only the logs before this timestamp are downloaded
+        :param compression: "gzip" or "zstd", guessed from the extension
+            of path by default
+        :return: the number of logs downloaded
+        """
+        job_logs = self.logs(jobid, since=since)
+        if until is not None:
+            job_logs = (log for log in job_logs if log['timestamp'] < until)
+        return logexport.write_logs(job_logs, path, compression=compression)
 
     def deploy(self, async=False):
+        """Deploys the project from the current directory.
+
+        When the server supports it, only the files that are changed since
+        the previous deploys are uploaded. See roro.packer for details.
+        """
         print("Deploying project {}. This may take a few moments ...".format(self.name))
-        with tempfile.TemporaryDirectory() as tmpdir:
-            archive = self.archive(tmpdir)
-            size = os.path.getsize(archive)
-            with open(archive, 'rb') as f:
-                format = 'tar'
-                response =  self.client.deploy(
+        if packer.supports_incremental_deploy(self.client):
+            response = packer.deploy(self.client, self.name, os.getcwd(), async_=async)
+        else:
+            response = self._deploy_archive(async=async)
+
+        if async:
+            return Task(response['task_id'], self.SERVER_URL)
+        else:
+            return response
+
+    def _deploy_archive(self, async=False):
+        if packer.supports_streamed_archive(self.client):
+            # the archive is compressed while it is uploaded, so its size
+            # isn't known in advance
+            format = config.DEPLOY_ARCHIVE_FORMAT
+            with packer.open_archive(os.getcwd(), format) as f:
+                return self.client.deploy(
                     project=self.name,
                     archived_project=f,
-                    size=size,
                     format=format,
+                    streamed=True,
                     async=async
                 )
-            if async:
-                return Task(response['task_id'], self.SERVER_URL)
-            else:
-                return response
+
+        # older servers expect a plain tar archive of known size
+        with tempfile.TemporaryFile() as f:
+            packer.write_archive(os.getcwd(), f, "tar")
+            size = f.tell()
+            f.seek(0)
+            return self.client.deploy(
+                project=self.name,
+                archived_project=f,
+                size=size,
+                format="tar",
+                async=async
+            )
 
     def archive(self, rootdir, format='tar'):
-        base_name = os.path.join(rootdir, "roro-project-" + self.name)
-        return shutil.make_archive(base_name, format)
+        """Writes the archive of the current directory to rootdir and
+        returns the path to it.
+
+        The files ignored by the .gitignore and .roroignore files are not
+        included.
+        """
+        path = os.path.join(rootdir, "roro-project-{}.{}".format(self.name, format))
+        with open(path, 'wb') as f:
+            packer.write_archive(os.getcwd(), f, format)
+        return path
 
     def get_config(self):
         return self.client.get_config(project=self.name)
@@ -116,10 +170,13 @@ class Project:
         volume =  self.client.add_volume(project=self.name, name=volume_name)
         return volume['volume']
 
-    def get_model_repository(self, name):
+    def get_model_repository(self, name, compression=None):
         """Returns the ModelRepository from this project with given name.
+
+        The optional compression, like "zstd:3", is used when saving models
+        to that repository.
         """
-        return models.get_model_repository(client=self.client, project=self.name, name=name)
+        return models.get_model_repository(client=self.client, project=self.name, name=name, compression=compression)
 
     def list_model_repositories(self):
         """Returns a list of all the ModelRepository objects present in this project.
@@ -130,13 +187,36 @@ class Project:
         response = self.client.get_activity(project=self.name, name=repo)
         return [models.ModelImage.from_activity(project=self, metadata=x) for x in response]
 
-    def copy(self, src, dest):
+    def copy(self, src, dest, size=None):
+        """Copies the file src to dest. One of them must be a volume path.
+
+        :param size: size of the file in the volume, when already known,
+            to download it without asking the server for it
+        """
         if src.is_volume():
-            self._get_file(src, dest)
+            self._get_file(src, dest, size)
         else:
             self._put_file(src, dest)
 
-    def _get_file(self, src, dest):
+    def sync(self, src, dest, dry_run=False, delete=False, checksum=False):
+        """Syncs the directory src to dest, copying only the files that
+        are changed. One of them must be a volume path.
+
+        See roro.sync.sync for details.
+        """
+        return sync.sync(self, src, dest, dry_run=dry_run, delete=delete, checksum=checksum)
+
+    def _get_file(self, src, dest, size=None):
+        # small files are downloaded in one request, like for uploads
+        if transfers.supports_ranged_download(self.client):
+            info = None
+            if size is None:
+                info = self.client.stat_file(project=self.name, volume=src.volume, path=src.path)
+                size = info["size"]
+            if size > config.DOWNLOAD_CHUNK_SIZE:
+                transfers.download_file(self.client, self.name, src, dest, info=info)
+                return
+
         fileobj = self.client.get_file(
             project=self.name,
             volume=src.volume,
@@ -145,6 +225,10 @@ class Project:
         dest.safe_write(fileobj, src.name)
 
     def _put_file(self, src, dest):
+        if src.size > config.UPLOAD_CHUNK_SIZE and transfers.supports_chunked_upload(self.client):
+            transfers.upload_file(self.client, self.name, src, dest)
+            return
+
         with src.open('rb') as fileobj:
             self.client.put_file(
                 project=self.name,
@@ -157,13 +241,13 @@ class Project:
 
     @classmethod
     def find_all(cls):
-        client = RoroClient(cls.SERVER_URL)
+        client = get_client(cls.SERVER_URL)
         projects = client.projects()
         return [cls(p['name'], p.get('runtime')) for p in projects]
 
     @classmethod
     def find(cls, name, active_only=True):
-        client = RoroClient(cls.SERVER_URL)
+        client = get_client(cls.SERVER_URL)
         p = client.get_project(project=name, active_only=active_only)
         return p and cls(p['name'], p.get('runtime'))
 
@@ -188,23 +272,198 @@ get_current_project = current_project
 def list_projects():
     return Project.find_all()
 
+class TaskTimeoutError(Exception):
+    """Raised when a task doesn't finish in the given time.
+    """
+    def __init__(self, task_id, timeout):
+        Exception.__init__(self, "Task {} did not finish in {} seconds".format(task_id, timeout))
+        self.task_id = task_id
+        self.timeout = timeout
+
 class Task:
     def __init__(self, task_id, server_url):
         self.task_id = task_id
-        self._client = RoroClient(server_url)
+        self._client = get_client(server_url)
+        # the last response of the server about this task
+        self.response = None
 
     def poll(self):
-        return self._client.poll_task(task_id=self.task_id)
+        return self._update(self._client.poll_task(task_id=self.task_id))
 
-    def wait(self):
+    def _update(self, response):
+        self.response = response
+        return response
+
+    @property
+    def status(self):
+        return self.response and self.response.get('status')
+
+    def done(self):
+        """Tells whether the task has finished, as of the last poll.
+        """
+        response = self.response or {}
+        return 'error' in response or ('result' in response and response['status'] == 'SUCCESS')
+
+    def result(self):
+        """Returns the result of the finished task.
+
+        Raises Exception if the task has failed or hasn't finished yet.
+        """
+        if not self.done():
+            raise Exception("Task {} has not finished yet".format(self.task_id))
+        if 'error' in self.response:
+            raise Exception(self.response['error'])
+        return self.response['result']
+
+    def wait(self, timeout=None, callback=None, poll_interval=None, max_poll_interval=None):
         """Waits for the task to finish and returns the result of the task.
 
-        Raises Exception if the task fails.
+        The task is polled with an exponential backoff, starting at
+        poll_interval seconds and growing up to max_poll_interval seconds,
+        with some random jitter so that many tasks waited on together don't
+        poll the server in lockstep. When the server supports it, the
+        client blocks on the server until the status of the task changes
+        instead of polling.
+
+        To wait for many tasks, use wait_all or as_completed instead.
+
+        Raises Exception if the task fails and TaskTimeoutError if it
+        doesn't finish in timeout seconds.
+
+        :param timeout: maximum number of seconds to wait, no limit by default
+        :param callback: function called with the response of the server
+            every time the status of the task changes
+        :param poll_interval: the initial delay between polls in seconds,
+            defaults to config.TASK_POLL_INTERVAL
+        :param max_poll_interval: the maximum delay between polls in
+            seconds, defaults to config.TASK_MAX_POLL_INTERVAL
         """
+        long_poll = self._client.has_method("wait_task")
+        backoff = _Backoff(poll_interval, max_poll_interval)
+        deadline = timeout is not None and time.time() + timeout
+
+        status = None
         while True:
-            response = self.poll()
-            if 'error' in response:
-                raise Exception(response['error'])
-            elif 'result' in response and response['status'] == 'SUCCESS':
-                return response['result']
-            time.sleep(1)
+            if long_poll and status is not None:
+                self._wait_for_change(status, deadline)
+            else:
+                self.poll()
+
+            if self.status != status:
+                status = self.status
+                if callback:
+                    callback(self.response)
+
+            if self.done():
+                return self.result()
+
+            remaining = deadline and deadline - time.time()
+            if deadline and remaining <= 0:
+                raise TaskTimeoutError(self.task_id, timeout)
+            if not long_poll:
+                backoff.sleep(remaining)
+
+    def _wait_for_change(self, status, deadline):
+        """Blocks on the server until the status of the task is different
+        from status, or until config.TASK_LONG_POLL_TIMEOUT seconds pass.
+        """
+        timeout = config.TASK_LONG_POLL_TIMEOUT
+        if deadline:
+            timeout = max(0, min(timeout, deadline - time.time()))
+        return self._update(self._client.wait_task(task_id=self.task_id, status=status, timeout=timeout))
+
+class _Backoff:
+    """Exponentially growing delays with random jitter.
+    """
+    def __init__(self, interval=None, max_interval=None):
+        self.initial_interval = interval or config.TASK_POLL_INTERVAL
+        self.max_interval = max_interval or config.TASK_MAX_POLL_INTERVAL
+        self.interval = self.initial_interval
+
+    def next_delay(self, remaining=None):
+        """Returns the next delay, but not more than remaining seconds.
+        """
+        delay = random.uniform(self.interval / 2.0, self.interval)
+        self.interval = min(self.interval * 2, self.max_interval)
+        return min(delay, remaining) if remaining else delay
+
+    def sleep(self, remaining=None):
+        """Sleeps for the next delay, but not more than remaining seconds.
+        """
+        time.sleep(self.next_delay(remaining))
+
+    def reset(self):
+        self.interval = self.initial_interval
+
+def wait_all(tasks, timeout=None, poll_interval=None, max_poll_interval=None):
+    """Waits for all the tasks to finish and returns their results, in the
+    same order as the tasks.
+
+    Raises Exception if any of the tasks fails, after all of them have
+    finished, and TaskTimeoutError if they don't finish in timeout seconds.
+
+    See as_completed for the other parameters.
+    """
+    tasks = list(tasks)
+    for task in as_completed(tasks, timeout, poll_interval, max_poll_interval):
+        pass
+    return [task.result() for task in tasks]
+
+def as_completed(tasks, timeout=None, poll_interval=None, max_poll_interval=None):
+    """Waits for the tasks to finish and yields each of them as soon as it
+    finishes, successfully or not. Use task.result() to get the result.
+
+    All the pending tasks are polled together in every round, with a single
+    poll_tasks call per server when the server supports it, so the number
+    of requests doesn't grow with the number of tasks. The delay between
+    rounds grows as in Task.wait and starts again from poll_interval when
+    some task finishes.
+
+    Raises TaskTimeoutError if the tasks don't finish in timeout seconds.
+
+    :param tasks: the Task objects to wait for
+    :param timeout: maximum number of seconds to wait, no limit by default
+    :param poll_interval: the initial delay between polls in seconds,
+        defaults to config.TASK_POLL_INTERVAL
+    :param max_poll_interval: the maximum delay between polls in seconds,
+        defaults to config.TASK_MAX_POLL_INTERVAL
+    """
+    pending = list(tasks)
+    backoff = _Backoff(poll_interval, max_poll_interval)
+    deadline = timeout is not None and time.time() + timeout
+
+    while pending:
+        _poll_tasks(pending)
+        finished = [task for task in pending if task.done()]
+        pending = [task for task in pending if not task.done()]
+        for task in finished:
+            yield task
+        if not pending:
+            break
+
+        remaining = deadline and deadline - time.time()
+        if deadline and remaining <= 0:
+            task_ids = ", ".join(task.task_id for task in pending)
+            raise TaskTimeoutError(task_ids, timeout)
+        if finished:
+            backoff.reset()
+        backoff.sleep(remaining)
+
+def _poll_tasks(tasks):
+    """Polls the status of all the tasks, grouping them by client.
+    """
+    groups = {}
+    for task in tasks:
+        groups.setdefault(id(task._client), []).append(task)
+
+    for group in groups.values():
+        client = group[0]._client
+        if client.has_method("poll_tasks"):
+            responses = client.poll_tasks(task_ids=[task.task_id for task in group])
+            for task in group:
+                # the tasks missing from the response are polled again later
+                response = responses.get(task.task_id)
+                if response is not None:
+                    task._update(response)
+        else:
+            transfers.run_concurrently(lambda task: task.poll(), group, config.POOL_SIZE)
@@ -0,0 +1,239 @@
+"""
+    roro.responsecache
+    ~~~~~~~~~~~~~~~~~~
+
+    Client-side cache of the responses of the read-mostly methods of the
+    server.
+
+    The cache is off by default. It is enabled by setting
+    config.RESPONSE_CACHE, or the RORODATA_RESPONSE_CACHE environment
+    variable, to "memory" to keep the responses in memory, or to "disk" to
+    also keep them in config.CACHE_DIR across invocations of roro.
+
+    Each cached method has its own time to live, see TTLS. The responses
+    are kept in an LRU of config.RESPONSE_CACHE_SIZE entries, and as many
+    on disk, where the expired and the oldest ones are deleted. A call to a
+    method that changes the data, made by the same client, drops the
+    cached responses it may have made stale, see INVALIDATES.
+"""
+import copy
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from . import config
+from .helpers import atomic_write
+
+logger = logging.getLogger(__name__)
+
+# seconds the responses of each method are cached
+TTLS = {
+    "get_config": 60,
+    "volumes": 60,
+    "list_models": 60,
+    "projects": 60,
+    "get_project": 300,
+}
+
+# the cached methods made stale by each method changing the data. Any
+# other method that is not known to be read-only drops the whole cache.
+INVALIDATES = {
+    "set_config": ["get_config"],
+    "unset_config": ["get_config"],
+    "add_volume": ["volumes"],
+    "save_model": ["list_models"],
+    "create": ["projects", "get_project"],
+    "delete": ["projects", "get_project"],
+}
+
+def get_response_cache(server_url, get_identity=None):
+    """Returns the ResponseCache as configured in config.RESPONSE_CACHE,
+    or None when it is disabled.
+
+    :param server_url: url of the server
+    :param get_identity: function returning the identity of the user,
+        like the Authorization header, to keep the responses of different
+        users apart on disk. It is called only for the disk cache.
+    """
+    if config.RESPONSE_CACHE == "memory":
+        return ResponseCache()
+    elif config.RESPONSE_CACHE == "disk":
+        identity = get_identity and get_identity()
+        key = hashlib.sha1("{} {}".format(server_url, identity or "").encode("utf-8")).hexdigest()
+        return ResponseCache(root=os.path.join(config.CACHE_DIR, "responses", key))
+    elif config.RESPONSE_CACHE:
+        logger.warning("Unknown response cache %r, expected memory or disk", config.RESPONSE_CACHE)
+
+class ResponseCache:
+    """LRU cache of the responses of the server, optionally persisted in
+    the directory root.
+
+    The files in root are pruned on the first write, keeping the max_size
+    most recent ones that have not expired.
+    """
+    def __init__(self, max_size=None, ttls=None, root=None):
+        self.max_size = max_size or config.RESPONSE_CACHE_SIZE
+        self.ttls = TTLS if ttls is None else ttls
+        self.root = root
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.pruned = False
+
+    def call(self, func_name, kwargs, func, read_only=False):
+        """Returns the response for the call of func_name with kwargs,
+        from the cache or by calling func.
+
+        Calls to the methods that are not cached drop the stale responses,
+        unless read_only.
+        """
+        if func_name not in self.ttls:
+            try:
+                return func()
+            finally:
+                if not read_only:
+                    self.invalidate_for(func_name)
+
+        found, value = self.lookup(func_name, kwargs)
+        if found:
+            return value
+        value = func()
+        return self.record(func_name, kwargs, value)
+
+    def lookup(self, func_name, kwargs):
+        """Returns (found, value) for the call of func_name with kwargs.
+        """
+        if func_name not in self.ttls:
+            return False, None
+        return self.get(self._make_key(func_name, kwargs))
+
+    def record(self, func_name, kwargs, value, read_only=False):
+        """Records the response of a call made to the server, caching it
+        or dropping the responses it made stale, and returns it.
+        """
+        if func_name in self.ttls:
+            self.put(func_name, self._make_key(func_name, kwargs), value)
+            return copy.deepcopy(value)
+        elif not read_only:
+            self.invalidate_for(func_name)
+        return value
+
+    def get(self, key):
+        """Returns (found, value) for the key.
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None and self.root:
+                entry = self._read(key)
+            if entry is None or entry["expires"] <= now:
+                self.misses += 1
+                return False, None
+            self.entries[key] = entry
+            self.hits += 1
+            return True, copy.deepcopy(entry["value"])
+
+    def put(self, func_name, key, value):
+        entry = {
+            "method": func_name,
+            "expires": time.time() + self.ttls[func_name],
+            "value": value
+        }
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = entry
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+            if self.root:
+                if not self.pruned:
+                    self.prune()
+                self._write(key, entry)
+
+    def invalidate(self, func_name=None):
+        """Drops the cached responses of func_name, or all of them.
+        """
+        with self.lock:
+            for key in list(self.entries):
+                if func_name is None or self.entries[key]["method"] == func_name:
+                    del self.entries[key]
+            if self.root:
+                path = self.root if func_name is None else os.path.join(self.root, func_name)
+                shutil.rmtree(path, ignore_errors=True)
+
+    def invalidate_for(self, func_name):
+        """Drops the responses made stale by a call to func_name.
+        """
+        if func_name in INVALIDATES:
+            for name in INVALIDATES[func_name]:
+                self.invalidate(name)
+        else:
+            self.invalidate()
+
+    def prune(self):
+        """Deletes the expired responses from the disk, and the oldest ones
+        beyond max_size.
+        """
+        self.pruned = True
+        now = time.time()
+        files = []
+        for func_name in _listdir(self.root):
+            ttl = self.ttls.get(func_name, 0)
+            dirname = os.path.join(self.root, func_name)
+            for filename in _listdir(dirname):
+                path = os.path.join(dirname, filename)
+                try:
+                    mtime = os.path.getmtime(path)
+                    if mtime + ttl <= now:
+                        os.remove(path)
+                    else:
+                        files.append((mtime, path))
+                except OSError:
+                    pass
+        files.sort(reverse=True)
+        for _, path in files[self.max_size:]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.entries)}
+
+    def _make_key(self, func_name, kwargs):
+        return func_name + " " + json.dumps(kwargs, sort_keys=True)
+
+    def _get_path(self, key):
+        func_name = key.split(" ", 1)[0]
+        filename = hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json"
+        return os.path.join(self.root, func_name, filename)
+
+    def _read(self, key):
+        path = self._get_path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if entry["expires"] <= time.time():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return entry
+
+    def _write(self, key, entry):
+        try:
+            atomic_write(self._get_path(key), json.dumps(entry).encode("utf-8"))
+        except (IOError, OSError, TypeError, ValueError) as e:
+            logger.warning("Unable to save the response of %s in the cache (%s)", entry["method"], e)
+
+def _listdir(path):
+    try:
+        return os.listdir(path)
+    except OSError:
+        return []
@@ -3,6 +3,12 @@
     ~~~~~~~~~~~~~~~~
 
     serialization support for various types of models.
+
+    Additional serializers can be added using register_serializer or by
+    other packages using the ``roro.serializers`` entry point::
+
+        [roro.serializers]
+        onnx = roro_onnx:ONNXSerializer
 """
 from collections import OrderedDict
 import logging
@@ -12,53 +18,138 @@ logger = logging.getLogger(__name__)
 # mapping from serializer name to class
 _SERIALIZERS = OrderedDict()
 
-def save_model(model, filename):
+ENTRY_POINT_GROUP = "roro.serializers"
+_plugins_loaded = False
+
+def register_serializer(name, serializer_class):
+    """Registers a new serializer.
+
+    :param name: name of the serializer, it is recorded as the
+        Content-Encoding of the models saved using it
+    :param serializer_class: class implementing the BaseSerializer interface
+    """
+    _SERIALIZERS[name] = serializer_class
+
+def save_model(model, filename, compression=None):
     """Saves the given model into a file.
 
+    The compression is specified as name of the codec, optionally followed
+    by the compression level. For example, "zlib", "lz4" or "zstd:9".
+
     :param model: the model object
     :param filename: path to the file where the model is to be saved
+    :param compression: the compression to use, if the serializer supports it
     :return: the name of the serializer used to save the model
     """
     serializer = _find_suitable_serializer(model)
-    serializer.dump(model, filename)
+    _dump(serializer, model, filename, compression=compression)
     return serializer.NAME
 
-def load_model(filename, serializer):
-    """Saves the given model into a file.
+def _dump(serializer, model, filename, compression=None):
+    """Dumps the model using the serializer.
+
+    The compression is passed only to the serializers that support it, so
+    that the serializers with the older ``dump(model, filename)`` signature
+    keep working.
+    """
+    if compression and serializer.SUPPORTS_COMPRESSION:
+        serializer.dump(model, filename, compression=compression)
+    else:
+        serializer.dump(model, filename)
+
+def parse_compression(compression):
+    """Parses the compression spec into a tuple of codec and level.
+
+        >>> parse_compression("zstd:9")
+        ('zstd', 9)
+        >>> parse_compression("lz4")
+        ('lz4', None)
+    """
+    if ":" in compression:
+        codec, level = compression.split(":", 1)
+        return codec, int(level)
+    else:
+        return compression, None
+
+def load_model(filename, serializer, mmap_mode=None):
+    """Loads the model from a file.
 
     :param filename: path to the filename containing the serialized model
     :param serializer: name of the serializer used to save this model
+    :param mmap_mode: memory-map the large arrays in the model using this
+        mode instead of reading them into memory, if the serializer supports it
     :return: the model object
     """
     serializer_object = _get_serializer(name=serializer)
-    return serializer_object.load(filename)
+    return serializer_object.load(filename, mmap_mode=mmap_mode)
 
 def _get_serializer(name):
+    _load_plugins()
+    if name not in _SERIALIZERS:
+        raise ValueError("Unknown serializer {!r}".format(name))
     return _SERIALIZERS[name]()
 
+def _load_plugins():
+    """Registers the serializers from the installed plugins.
+    """
+    global _plugins_loaded
+    if _plugins_loaded:
+        return
+    _plugins_loaded = True
+
+    try:
+        import pkg_resources
+    except ImportError:
+        return
+
+    for entry_point in pkg_resources.iter_entry_points(ENTRY_POINT_GROUP):
+        try:
+            register_serializer(entry_point.name, entry_point.load())
+        except Exception as e:
+            logger.warning("Unable to load the serializer plugin {!r} ({})".format(entry_point.name, e))
+
 def _find_suitable_serializer(model):
+    _load_plugins()
     for name, serializer_class in _SERIALIZERS.items():
         try:
             serializer = serializer_class()
             if serializer.can_dump(model):
                 return serializer
         except ImportError as e:
-            logger.warn("Unable to load the required dependencies for serializer {!r} ({})".format(name, e))
+            logger.warning("Unable to load the required dependencies for serializer {!r} ({})".format(name, e))
     raise ValueError("Object of type %s is not serializable" % model.__class__)
 
 class BaseSerializer:
-    def dump(model, filename):
+    SUPPORTS_COMPRESSION = False
+
+    # whether dump accepts a file object opened for writing in place of
+    # the filename
+    SUPPORTS_FILEOBJ = False
+
+    def dump(self, model, filename, compression=None):
         """Dumps the model into a file.
 
+        The compression is passed only when SUPPORTS_COMPRESSION is set.
+
         :param model: the model object
         :param filename: path to the filename where the model is to be saved
+        :param compression: the compression spec, see parse_compression
         """
         raise NotImplementedError()
 
-    def load(self, filename):
+    def can_dump_fileobj(self, compression=None):
+        """Checks if the model can be dumped into a non-seekable file
+        object, like a pipe, with the given compression.
+        """
+        return self.SUPPORTS_FILEOBJ
+
+    def load(self, filename, mmap_mode=None):
         """Loads the model from the given file.
 
+        Serializers that can't memory-map the model ignore mmap_mode.
+
         :param filename: path to the filename containing the serialized model.
+        :param mmap_mode: mode to memory-map the large arrays in the model
         :return: the model object
         """
         raise NotImplementedError()
@@ -69,29 +160,50 @@ class BaseSerializer:
         raise NotImplementedError()
 
 
-class JoblibSerializer:
+class JoblibSerializer(BaseSerializer):
+    """Serializer for scikit-learn models using joblib.
+
+    Supports all the compression codecs of joblib (zlib, gzip, bz2, lzma,
+    xz, lz4) and zstd, when the zstandard package is installed. The codec is
+    detected from the file when loading.
+    """
     NAME = "joblib"
+    SUPPORTS_COMPRESSION = True
+    SUPPORTS_FILEOBJ = True
+    DEFAULT_COMPRESSION_LEVEL = 3
 
     def __init__(self):
-        from sklearn.base import BaseEstimator
-        self.BaseEstimator = BaseEstimator
-
         import joblib
         self.joblib = joblib
-
-    def dump(self, model, filename):
-        self.joblib.dump(model, filename)
-
-    def load(self, filename):
-        return self.joblib.load(filename)
+        _register_zstd_compressor(joblib)
+
+    def dump(self, model, filename, compression=None):
+        if compression:
+            codec, level = parse_compression(compression)
+            if level is None:
+                level = self.DEFAULT_COMPRESSION_LEVEL
+            self.joblib.dump(model, filename, compress=(codec, level))
+        else:
+            self.joblib.dump(model, filename)
+
+    def can_dump_fileobj(self, compression=None):
+        # joblib >= 1.2 calls tell() on the file to align the numpy arrays,
+        # which a pipe doesn't support. The compressor files keep track of
+        # the position themselves, so only the compressed models can be
+        # streamed.
+        return bool(compression)
+
+    def load(self, filename, mmap_mode=None):
+        return self.joblib.load(filename, mmap_mode=mmap_mode)
 
     def can_dump(self, model):
-        return isinstance(model, self.BaseEstimator)
+        from sklearn.base import BaseEstimator
+        return isinstance(model, BaseEstimator)
 
     def get_name(self):
         return "joblib"
 
-class KerasSerializer:
+class KerasSerializer(BaseSerializer):
     NAME = "keras"
 
     def __init__(self):
@@ -100,15 +212,42 @@ class KerasSerializer:
         self._keras_load_model = load_model
         self._Model = Model
 
-    def dump(self, model, filename):
+    def dump(self, model, filename, compression=None):
         self._keras_save_model(model, filename)
 
-    def load(self, filename):
+    def load(self, filename, mmap_mode=None):
         return self._keras_load_model(filename)
 
     def can_dump(self, model):
         return isinstance(model, self._Model)
 
-_SERIALIZERS['joblib'] = JoblibSerializer
-_SERIALIZERS['keras'] = KerasSerializer
+def _register_zstd_compressor(joblib):
+    """Registers the zstd codec with joblib, if zstandard is installed.
+
+    The compression uses as many threads as the CPUs available.
+    """
+    try:
+        import zstandard
+    except ImportError:
+        return
+
+    from joblib.compressor import CompressorWrapper, _COMPRESSORS
+    if "zstd" in _COMPRESSORS:
+        return
+
+    class ZstdCompressorWrapper(CompressorWrapper):
+        def __init__(self):
+            CompressorWrapper.__init__(self, obj=None, prefix=b'\x28\xb5\x2f\xfd', extension='.zst')
+
+        def compressor_file(self, fileobj, compresslevel=None):
+            cctx = zstandard.ZstdCompressor(level=compresslevel or 3, threads=-1)
+            return zstandard.open(fileobj, 'wb', cctx=cctx)
+
+        def decompressor_file(self, fileobj):
+            return zstandard.open(fileobj, 'rb')
+
+    joblib.register_compressor("zstd", ZstdCompressorWrapper())
+
+register_serializer('joblib', JoblibSerializer)
+register_serializer('keras', KerasSerializer)
 
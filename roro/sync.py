@@ -0,0 +1,160 @@
+"""
+    roro.sync
+    ~~~~~~~~~
+
+    Sync of directories between the local disk and the volumes.
+
+    The files in the source and the destination are compared by size and
+    modification time, or by the md5 checksum when asked for, and only
+    the files that differ are copied.
+"""
+import logging
+import os
+import posixpath
+from . import config
+from .path import Path
+from .transfers import run_concurrently, md5sum
+
+logger = logging.getLogger(__name__)
+
+class FileInfo:
+    def __init__(self, path, size, mtime=None, md5=None):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.md5 = md5
+
+def sync(project, src, dest, dry_run=False, delete=False, checksum=False, concurrency=None):
+    """Syncs the directory src to dest. One of them must be a volume path.
+
+    :param project: the Project
+    :param src: the source Path
+    :param dest: the destination Path
+    :param dry_run: only find the changes, without copying the files
+    :param delete: delete the files in dest that are not present in src
+    :param checksum: compare the files by md5 checksum, when the volume
+        has it, instead of size and modification time. The local files are
+        hashed only when there is a checksum to compare with.
+    :param concurrency: number of files copied concurrently, defaults to
+        config.TRANSFER_CONCURRENCY
+    :return: list of (action, path) tuples, where action is either
+        "copy" or "delete" and path is relative to the directory
+    """
+    if src.is_volume() is dest.is_volume():
+        raise Exception('One of the arguments has to be a volume, other a local path')
+    concurrency = concurrency or config.TRANSFER_CONCURRENCY
+
+    src_files = _list_files(project, src)
+    dest_files = _list_files(project, dest)
+    if checksum:
+        if src.is_volume():
+            _add_checksums(dest.path, dest_files, src_files)
+        else:
+            _add_checksums(src.path, src_files, dest_files)
+
+    changes = []
+    size_only = 0
+    for path in sorted(src_files):
+        if _is_modified(src_files[path], dest_files.get(path), checksum):
+            changes.append(("copy", path))
+        elif _is_compared_by_size(src_files[path], dest_files[path], checksum):
+            size_only += 1
+    if size_only:
+        logger.warning("%d files were compared only by size, as the modification time "
+            "or the checksum of the files is not available", size_only)
+    if delete:
+        changes += [("delete", path) for path in sorted(dest_files) if path not in src_files]
+
+    if not dry_run:
+        run_concurrently(lambda change: _apply(project, src, dest, change, src_files), changes, concurrency)
+    return changes
+
+def _is_modified(src, dest, checksum):
+    if dest is None or src.size != dest.size:
+        return True
+    if checksum and src.md5 and dest.md5:
+        return src.md5 != dest.md5
+    if src.mtime is not None and dest.mtime is not None:
+        return src.mtime > dest.mtime
+    return False
+
+def _is_compared_by_size(src, dest, checksum):
+    has_checksums = checksum and src.md5 and dest.md5
+    return not has_checksums and (src.mtime is None or dest.mtime is None)
+
+def _add_checksums(root, local_files, remote_files):
+    """Computes the md5 checksum of the local files in the directory root,
+    only for the ones to be compared with a remote file of the same size
+    having a checksum.
+    """
+    for path, info in local_files.items():
+        remote = remote_files.get(path)
+        if remote is not None and remote.md5 and remote.size == info.size:
+            info.md5 = md5sum(os.path.join(root, *path.split("/")))
+
+def _apply(project, src, dest, change, src_files):
+    action, path = change
+    logger.info("%s %s", action, path)
+    if action == "copy":
+        _copy(project, src, dest, path, src_files[path].size)
+    else:
+        _delete(project, dest, path)
+
+def _copy(project, src, dest, path, size=None):
+    dirname = posixpath.dirname(path)
+    if src.is_volume():
+        local_dir = os.path.join(dest.path, *dirname.split("/")) if dirname else dest.path
+        if not os.path.isdir(local_dir):
+            os.makedirs(local_dir)
+        project.copy(_volume_path(src, path), Path(local_dir), size=size)
+    else:
+        local_path = os.path.join(src.path, *path.split("/"))
+        project.copy(Path(local_path), _volume_path(dest, path))
+
+def _delete(project, dest, path):
+    if dest.is_volume():
+        if not project.client.has_method("delete_file"):
+            raise Exception("Deleting files from volumes is not supported by the server")
+        project.client.delete_file(project=project.name, volume=dest.volume, path=_join(dest.path, path))
+    else:
+        os.remove(os.path.join(dest.path, *path.split("/")))
+
+def _volume_path(root, path):
+    return Path("{}:{}".format(root.volume, _join(root.path, path)))
+
+def _join(root, path):
+    return posixpath.join(root or "/", path)
+
+def _list_files(project, root):
+    """Returns a dict mapping the path of every file under root, relative
+    to root, to the FileInfo.
+    """
+    if root.is_volume():
+        return _list_volume_files(project, root)
+    else:
+        return _list_local_files(root.path)
+
+def _list_local_files(root):
+    files = {}
+    if not os.path.exists(root):
+        return files
+    if not os.path.isdir(root):
+        raise Exception('Cannot sync, {} is not a directory'.format(root))
+    for dirpath, dirnames, filenames in os.walk(root):
+        for filename in filenames:
+            filepath = os.path.join(dirpath, filename)
+            path = os.path.relpath(filepath, root).replace(os.sep, "/")
+            st = os.stat(filepath)
+            files[path] = FileInfo(path, st.st_size, st.st_mtime)
+    return files
+
+def _list_volume_files(project, root, prefix=""):
+    files = {}
+    path = Path("{}:{}".format(root.volume, _join(root.path, prefix)))
+    for item in project.ls(path):
+        relpath = posixpath.join(prefix, item["name"])
+        if item["mode"].startswith("d"):
+            files.update(_list_volume_files(project, root, relpath))
+        else:
+            files[relpath] = FileInfo(relpath, item["size"], item.get("mtime"), item.get("md5"))
+    return files
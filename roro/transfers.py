@@ -0,0 +1,253 @@
+"""
+    roro.transfers
+    ~~~~~~~~~~~~~~
+
+    Transfer of large files to and from the volumes.
+
+    Large files are uploaded and downloaded in chunks, with many chunks
+    transferred concurrently. The progress of each transfer is recorded in
+    a manifest in config.CACHE_DIR, so that an interrupted transfer resumes
+    from the chunks that are not transferred yet. An upload the server
+    doesn't know anymore starts over.
+"""
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+from multiprocessing.pool import ThreadPool
+from firefly.client import FireflyError
+from . import config
+from .helpers import atomic_write, replace_file
+
+logger = logging.getLogger(__name__)
+
+def supports_chunked_upload(client):
+    return client.has_method("start_upload")
+
+def supports_ranged_download(client):
+    return client.has_method("get_file_range")
+
+def upload_file(client, project, src, dest, chunk_size=None, concurrency=None):
+    """Uploads the local file src to the volume path dest in chunks.
+
+    The server must support the start_upload, put_file_chunk and
+    complete_upload methods.
+
+    :param client: the RoroClient
+    :param project: name of the project
+    :param src: the local Path
+    :param dest: the volume Path
+    :param chunk_size: size of each chunk, defaults to config.UPLOAD_CHUNK_SIZE
+    :param concurrency: number of chunks uploaded concurrently, defaults to
+        config.TRANSFER_CONCURRENCY
+    """
+    chunk_size = chunk_size or config.UPLOAD_CHUNK_SIZE
+    concurrency = concurrency or config.TRANSFER_CONCURRENCY
+
+    filename = os.path.abspath(src.path)
+    st = os.stat(filename)
+    manifest = Manifest.for_upload(project, filename, st, dest, chunk_size)
+
+    state = manifest.load()
+    if state is not None:
+        logger.info("resuming upload %s of %s", state["upload_id"], filename)
+        try:
+            _upload_chunks(client, project, filename, st.st_size, manifest, state, chunk_size, concurrency)
+            return
+        except Exception as e:
+            if not _is_rejected(e):
+                raise
+            # the server may have expired the upload
+            logger.info("upload %s rejected by the server (%s), starting over", state["upload_id"], e)
+            manifest.remove()
+
+    response = client.start_upload(
+        project=project,
+        volume=dest.volume,
+        path=dest.path,
+        name=src.name,
+        size=st.st_size,
+        chunk_size=chunk_size)
+    state = {"upload_id": response["upload_id"], "done": []}
+    manifest.save(state)
+    _upload_chunks(client, project, filename, st.st_size, manifest, state, chunk_size, concurrency)
+
+def _upload_chunks(client, project, filename, size, manifest, state, chunk_size, concurrency):
+    """Uploads the chunks not done yet in the upload with the given state
+    and completes it.
+    """
+    upload_id = state["upload_id"]
+    nchunks = max(1, (size + chunk_size - 1) // chunk_size)
+    done = set(state["done"])
+    lock = threading.Lock()
+
+    def upload_chunk(index):
+        with open(filename, "rb") as f:
+            f.seek(index * chunk_size)
+            data = f.read(chunk_size)
+        client.put_file_chunk(
+            project=project,
+            upload_id=upload_id,
+            index=index,
+            checksum=hashlib.md5(data).hexdigest(),
+            chunk=io.BytesIO(data))
+        with lock:
+            done.add(index)
+            manifest.save({"upload_id": upload_id, "done": sorted(done)})
+
+    pending = [i for i in range(nchunks) if i not in done]
+    run_concurrently(upload_chunk, pending, concurrency)
+
+    client.complete_upload(project=project, upload_id=upload_id, chunks=nchunks)
+    manifest.remove()
+
+def _is_rejected(e):
+    """Tells whether the error is an error response of the server, as
+    opposed to failing to reach it.
+    """
+    # imported here as roro.client uses this module
+    from .client import TransientError, CircuitOpenError
+    return isinstance(e, (ValueError, FireflyError)) and not isinstance(e, (TransientError, CircuitOpenError))
+
+def download_file(client, project, src, dest, chunk_size=None, concurrency=None, info=None):
+    """Downloads the file at volume path src to the local Path dest.
+
+    The file is downloaded in ranges, concurrently, into a temp file next
+    to the destination, which is renamed once the download is complete and
+    the checksum is verified. The server must support the stat_file and
+    get_file_range methods.
+
+    :param client: the RoroClient
+    :param project: name of the project
+    :param src: the volume Path
+    :param dest: the local Path
+    :param chunk_size: size of each range, defaults to config.DOWNLOAD_CHUNK_SIZE
+    :param concurrency: number of ranges downloaded concurrently, defaults
+        to config.TRANSFER_CONCURRENCY
+    :param info: the response of stat_file for src, when already known
+    """
+    chunk_size = chunk_size or config.DOWNLOAD_CHUNK_SIZE
+    concurrency = concurrency or config.TRANSFER_CONCURRENCY
+
+    file_path = dest.get_dest_path(src.name)
+    tmp_path = str(dest.get_tmp_path(file_path))
+    if info is None:
+        info = client.stat_file(project=project, volume=src.volume, path=src.path)
+    size, checksum = info["size"], info.get("md5")
+
+    manifest = Manifest.for_download(project, src, info, os.path.abspath(str(file_path)), chunk_size)
+    state = manifest.load()
+    if state is None or not os.path.exists(tmp_path):
+        state = {"done": []}
+        # preallocate the file, it is sparse on most filesystems
+        with open(tmp_path, "wb") as f:
+            f.truncate(size)
+        manifest.save(state)
+    else:
+        logger.info("resuming download of %s", tmp_path)
+
+    nchunks = (size + chunk_size - 1) // chunk_size
+    done = set(state["done"])
+    lock = threading.Lock()
+
+    def download_chunk(index):
+        offset = index * chunk_size
+        length = min(chunk_size, size - offset)
+        fileobj = client.get_file_range(
+            project=project,
+            volume=src.volume,
+            path=src.path,
+            offset=offset,
+            length=length)
+        with open(tmp_path, "r+b") as f:
+            f.seek(offset)
+            _copy(fileobj, f, length)
+        with lock:
+            done.add(index)
+            manifest.save({"done": sorted(done)})
+
+    pending = [i for i in range(nchunks) if i not in done]
+    run_concurrently(download_chunk, pending, concurrency)
+
+    if checksum and md5sum(tmp_path) != checksum:
+        os.remove(tmp_path)
+        manifest.remove()
+        raise Exception("Checksum mismatch for {}, please try again".format(src.path))
+
+    replace_file(tmp_path, str(file_path))
+    manifest.remove()
+
+def run_concurrently(func, items, concurrency):
+    """Calls func with each of the items, from a pool of threads.
+
+    All the items are processed even if some of them fail, and the first
+    error is raised after that.
+
+    :return: the list of results
+    """
+    if not items:
+        return []
+    pool = ThreadPool(min(concurrency, len(items)))
+    try:
+        return pool.map(func, items)
+    finally:
+        pool.close()
+        pool.join()
+
+def _copy(src, dest, length):
+    remaining = length
+    while remaining > 0:
+        data = src.read(min(config.COPY_BUFFER_SIZE, remaining))
+        if not data:
+            raise IOError("Connection closed before the download is complete")
+        dest.write(data)
+        remaining -= len(data)
+
+def md5sum(filename):
+    """Returns the md5 checksum of the file as a hex string.
+    """
+    md5 = hashlib.md5()
+    with open(filename, "rb") as f:
+        for data in iter(lambda: f.read(config.COPY_BUFFER_SIZE), b""):
+            md5.update(data)
+    return md5.hexdigest()
+
+class Manifest:
+    """The state of a transfer, persisted as a JSON file.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    @classmethod
+    def for_upload(cls, project, filename, st, dest, chunk_size):
+        # any change to the file or the destination starts a new upload
+        key = json.dumps([
+            project, filename, st.st_size, st.st_mtime,
+            dest.volume, dest.path, chunk_size])
+        name = hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json"
+        return cls(os.path.join(config.CACHE_DIR, "uploads", name))
+
+    @classmethod
+    def for_download(cls, project, src, info, filename, chunk_size):
+        # the download starts over if the file on the server is modified
+        key = json.dumps([
+            project, src.volume, src.path, info, filename, chunk_size],
+            sort_keys=True)
+        name = hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json"
+        return cls(os.path.join(config.CACHE_DIR, "downloads", name))
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def save(self, state):
+        atomic_write(self.path, json.dumps(state).encode("utf-8"))
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -43,7 +43,7 @@ install_requires = [
     'click>=6.7',
     'tabulate>=0.7.7',
     'PyYAML>=3.12',
-    'joblib>=0.11',
+    'joblib>=0.12',
 ]
 
 if PY2:
@@ -62,6 +62,10 @@ setup(
     packages=find_packages(),
     include_package_data=True,
     install_requires=install_requires,
+    extras_require={
+        # the asyncio client in roro.aio
+        'async': ['aiohttp>=3.3'],
+    },
     entry_points='''
         [console_scripts]
         roro = roro.cli:cli
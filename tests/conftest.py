@@ -0,0 +1,16 @@
+import sys
+import pytest
+from roro import client, config
+
+@pytest.fixture(autouse=True)
+def isolate(monkeypatch, tmpdir):
+    """Keeps the caches written by each test in its tmpdir, and gives it
+    new clients, so that the tests don't depend on each other or on the
+    caches of the user running them.
+    """
+    monkeypatch.setattr(config, "CACHE_DIR", str(tmpdir.join("cache")))
+    monkeypatch.setattr(config, "MODEL_CACHE_DIR", str(tmpdir.join("cache", "models")))
+    monkeypatch.setattr(client, "_clients", {})
+    # the async client is only importable on python 3.6 and later
+    if "roro.aio" in sys.modules:
+        monkeypatch.setattr(sys.modules["roro.aio"], "_clients", {})
@@ -0,0 +1,87 @@
+"""Stand-in for the roro-server to test the client against.
+
+Each method of the server is a python function, registered using the
+responses library:
+
+    server = MockServer("https://example.com")
+    server.add("ps", lambda project, jobid=None, all=False: [])
+"""
+import email.parser
+import inspect
+import json
+import responses
+
+class MockServer:
+    def __init__(self, server_url):
+        self.server_url = server_url.rstrip("/")
+        self.functions = {}
+        self.failures = {}
+        responses.add_callback(
+            responses.GET, self.server_url + "/",
+            callback=self._index, content_type="application/json")
+
+    def add(self, name, func):
+        self.functions[name] = func
+        responses.add_callback(
+            responses.POST, self.server_url + "/" + name,
+            callback=lambda request: self._call(name, request))
+
+    def fail(self, name, times=1, status=500):
+        """Fails the next calls to the method with given name.
+        """
+        self.failures[name] = (times, status)
+
+    def _index(self, request):
+        functions = {}
+        for name, func in self.functions.items():
+            params = inspect.signature(func).parameters.values()
+            functions[name] = {
+                "path": "/" + name,
+                "parameters": [{"name": p.name} for p in params if p.kind == p.POSITIONAL_OR_KEYWORD]
+            }
+        return (200, {}, json.dumps({"functions": functions}))
+
+    def _call(self, name, request):
+        times, status = self.failures.get(name, (0, None))
+        if times:
+            self.failures[name] = (times - 1, status)
+            return (status, {"Content-Type": "application/json"}, json.dumps({"error": "Internal Server Error"}))
+
+        kwargs = self._parse_request(request)
+        try:
+            result = self.functions[name](**kwargs)
+        except Exception as e:
+            return (500, {"Content-Type": "application/json"}, json.dumps({"error": str(e)}))
+
+        if isinstance(result, bytes):
+            return (200, {"Content-Type": "application/octet-stream"}, result)
+        else:
+            return (200, {"Content-Type": "application/json"}, json.dumps(result))
+
+    def _parse_request(self, request):
+        content_type = request.headers.get("Content-Type", "")
+        if content_type.startswith("multipart/form-data"):
+            body = request.body
+            if not isinstance(body, bytes):
+                body = b"".join(body)
+            return parse_multipart(content_type, body)
+        elif request.body:
+            return json.loads(request.body.decode("utf-8"))
+        else:
+            return {}
+
+def parse_multipart(content_type, body):
+    """Parses the multipart body into a dict.
+
+    The files are returned as bytes and the other values as strings.
+    """
+    data = b"Content-Type: " + content_type.encode("ascii") + b"\r\n\r\n" + body
+    message = email.parser.BytesParser().parsebytes(data)
+    result = {}
+    for part in message.get_payload():
+        name = part.get_param("name", header="content-disposition")
+        payload = part.get_payload(decode=True)
+        if part.get_param("filename", header="content-disposition") is None:
+            payload = payload.decode("utf-8")
+        result[name] = payload
+    return result
@@ -0,0 +1,201 @@
+import asyncio
+import collections
+import json
+import socket
+import sys
+import pytest
+import responses
+from roro import config
+from .mock_server import MockServer
+
+SERVER_URL = "https://example.com"
+
+if sys.version_info < (3, 6):
+    pytest.skip("the async client needs python 3.6", allow_module_level=True)
+
+from roro import aio
+from roro.projects import TaskTimeoutError
+
+try:
+    from aiohttp import web
+except ImportError:
+    web = None
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(aio.AsyncProject, "SERVER_URL", SERVER_URL)
+    # responses only patches requests, so that the thread transport is
+    # used even when aiohttp is installed
+    monkeypatch.setattr(aio, "aiohttp", None)
+    responses.start()
+    yield MockServer(aio.AsyncProject.SERVER_URL)
+    responses.stop()
+    responses.reset()
+
+def test_call(server):
+    server.add("ps", lambda project, jobid=None, all=False: [{"jobid": "job-1", "project": project}])
+    server.add("fail", lambda: 1/0)
+
+    p = aio.AsyncProject("test-project")
+    assert p.client is aio.get_async_client(aio.AsyncProject.SERVER_URL)
+    assert run(p.ps()) == [{"jobid": "job-1", "project": "test-project"}]
+    assert run(p.client.has_method("ps"))
+    assert not run(p.client.has_method("poll_tasks"))
+    with pytest.raises(Exception) as e:
+        run(p.client.fail())
+    assert "division by zero" in str(e.value)
+
+def test_retry(server, monkeypatch):
+    monkeypatch.setattr(config, "RETRY_BACKOFF", 0)
+    server.add("ps", lambda project, jobid=None, all=False: [])
+    server.fail("ps", times=2, status=503)
+
+    p = aio.AsyncProject("test-project")
+    assert run(p.ps()) == []
+    assert p.client.circuit_breaker.failures == 0
+
+def test_bounded_gather(server):
+    running = []
+    peak = []
+
+    async def work(i):
+        running.append(i)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.remove(i)
+        return i * 2
+
+    assert run(aio.bounded_map(work, range(10), limit=3)) == [2 * i for i in range(10)]
+    assert max(peak) == 3
+
+def test_task_wait(server):
+    statuses = {"t0": ["PENDING", "SUCCESS"], "t1": ["PENDING", "PENDING", "SUCCESS"]}
+
+    def poll_task(task_id):
+        status = statuses[task_id].pop(0)
+        if status == "SUCCESS":
+            return {"status": status, "result": task_id.upper()}
+        return {"status": status}
+
+    server.add("poll_task", poll_task)
+    client = aio.get_async_client(aio.AsyncProject.SERVER_URL)
+    tasks = [aio.AsyncTask("t0", client), aio.AsyncTask("t1", client)]
+    assert run(aio.wait_all(tasks)) == ["T0", "T1"]
+
+    server.add("poll_task", lambda task_id: {"status": "PENDING"})
+    with pytest.raises(TaskTimeoutError):
+        run(aio.AsyncTask("t2", client).wait(timeout=0.1, poll_interval=0.01))
+
+def test_follow_logs(server):
+    logs = [{"timestamp": 1000, "message": "a"}, {"timestamp": 2000, "message": "b"}]
+
+    def stream_logs(project, jobid, since=None):
+        records = logs + [{"status": "success"}]
+        return "".join(json.dumps(r) + "\n" for r in records).encode("utf-8")
+
+    server.add("stream_logs", stream_logs)
+
+    async def follow():
+        p = aio.AsyncProject("test-project")
+        return [log async for log in p.follow_logs("job-1")]
+
+    assert run(follow()) == logs
+
+_Request = collections.namedtuple("_Request", "headers body")
+
+class AiohttpServer(MockServer):
+    """MockServer served using aiohttp.web on localhost, to test the
+    aiohttp transport, which isn't patched by responses.
+    """
+    def __init__(self):
+        self.functions = {}
+        self.failures = {}
+        self.server_url = None
+        self.runner = None
+
+    def add(self, name, func):
+        self.functions[name] = func
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/", self._handle_index)
+        app.router.add_post("/{name}", self._handle_call)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        await web.SockSite(self.runner, sock).start()
+        self.server_url = "http://127.0.0.1:{}".format(sock.getsockname()[1])
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+    async def _handle_index(self, request):
+        return self._respond(self._index(await self._read(request)))
+
+    async def _handle_call(self, request):
+        name = request.match_info["name"]
+        if name not in self.functions:
+            return web.Response(status=404)
+        return self._respond(self._call(name, await self._read(request)))
+
+    async def _read(self, request):
+        return _Request(request.headers, await request.read())
+
+    def _respond(self, result):
+        status, headers, body = result
+        if not isinstance(body, bytes):
+            body = body.encode("utf-8")
+        return web.Response(status=status, headers=headers, body=body)
+
+@pytest.fixture
+def aiohttp_server():
+    if web is None:
+        pytest.skip("aiohttp is not installed")
+    server = AiohttpServer()
+    run(server.start())
+    yield server
+    run(server.stop())
+
+def test_aiohttp_transport(aiohttp_server, monkeypatch):
+    monkeypatch.setattr(config, "RETRY_BACKOFF", 0)
+    aiohttp_server.add("ps", lambda project, jobid=None, all=False: [{"jobid": "job-1", "project": project}])
+    aiohttp_server.add("fail", lambda: 1/0)
+
+    client = aio.AsyncRoroClient(aiohttp_server.server_url)
+    assert isinstance(client.transport, aio._AiohttpTransport)
+    try:
+        assert run(client.has_method("ps"))
+        assert run(client.ps(project="test-project")) == [{"jobid": "job-1", "project": "test-project"}]
+
+        aiohttp_server.fail("ps", times=2, status=503)
+        assert run(client.ps(project="test-project")) == [{"jobid": "job-1", "project": "test-project"}]
+
+        with pytest.raises(Exception) as e:
+            run(client.fail())
+        assert "division by zero" in str(e.value)
+    finally:
+        run(client.close())
+
+def test_aiohttp_follow_logs(aiohttp_server):
+    logs = [{"timestamp": 1000, "message": "a"}, {"timestamp": 2000, "message": "b"}]
+
+    def stream_logs(project, jobid, since=None):
+        records = logs + [{"status": "success"}]
+        return "".join(json.dumps(r) + "\n" for r in records).encode("utf-8")
+
+    aiohttp_server.add("stream_logs", stream_logs)
+    client = aio.AsyncRoroClient(aiohttp_server.server_url)
+
+    async def follow():
+        p = aio.AsyncProject("test-project", client=client)
+        return [log async for log in p.follow_logs("job-1")]
+
+    try:
+        assert run(follow()) == logs
+    finally:
+        run(client.close())
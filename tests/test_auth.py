@@ -0,0 +1,35 @@
+from roro import auth, config
+from roro.auth import RorodataAuthProvider, get_saved_login, save_token
+
+def test_get_saved_login(monkeypatch, tmpdir):
+    monkeypatch.setenv("HOME", str(tmpdir))
+    monkeypatch.delenv("RORODATA_AUTHORIZATION", raising=False)
+    monkeypatch.setattr(config, "SERVER_URL", "https://example.com/")
+
+    assert get_saved_login() is None
+    save_token("user@test.com", "token1")
+    assert get_saved_login() == {"email": "user@test.com", "password": "token1"}
+
+    # the netrc file must not be parsed again when it is not modified
+    class netrc(auth.netrc):
+        def __init__(self, file=None):
+            raise AssertionError("netrc parsed again")
+    monkeypatch.setattr(auth, "netrc", netrc)
+    assert get_saved_login() == {"email": "user@test.com", "password": "token1"}
+
+def test_auth_header(monkeypatch, tmpdir):
+    monkeypatch.setenv("HOME", str(tmpdir))
+    monkeypatch.delenv("RORODATA_AUTHORIZATION", raising=False)
+    monkeypatch.setattr(config, "SERVER_URL", "https://example.com/")
+
+    provider = RorodataAuthProvider()
+    assert provider.get_auth_header() is None
+
+    save_token("user@test.com", "token1")
+    assert provider.get_auth_header() == "Basic dXNlckB0ZXN0LmNvbTp0b2tlbjE="
+
+    save_token("user@test.com", "token2")
+    assert provider.get_auth_header() == "Basic dXNlckB0ZXN0LmNvbTp0b2tlbjI="
+
+    monkeypatch.setenv("RORODATA_AUTHORIZATION", "abcd")
+    assert provider.get_auth_header() == "Basic abcd"
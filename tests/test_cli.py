@@ -129,3 +129,46 @@ def test_add_volume():
     )
     result = runner.invoke(cli.create_volume, args=['new volume'])
     assert result.output == 'Volume volume-1 added to the project credit-risk\n'
+
+@responses.activate
+def test_logs_many_jobs():
+    mock_get_root()
+    logs = {
+        "job-1": [{"timestamp": 1000, "message": "a"}, {"timestamp": 3000, "message": "c"}],
+        "job-2": [{"timestamp": 2000, "message": "b"}],
+    }
+    for jobid in logs:
+        responses.add(
+            responses.POST, config.SERVER_URL+'/logs',
+            json=logs[jobid], status=200
+        )
+    result = runner.invoke(cli.logs, ["job-1", "job-2"])
+    assert result.exit_code == 0
+    assert result.output == 'job-1: a\njob-2: b\njob-1: c\n'
+
+@responses.activate
+def test_logs_non_ascii():
+    mock_get_root()
+    responses.add(
+        responses.POST, config.SERVER_URL+'/logs',
+        json=[{"timestamp": 1000, "message": u"caf\xe9"}], status=200
+    )
+    result = CliRunner(charset="ascii").invoke(cli.logs, ["job-1"])
+    assert result.exit_code == 0
+    assert result.output.startswith("caf")
+
+def test_logs_no_jobs():
+    result = runner.invoke(cli.logs, [])
+    assert result.exit_code != 0
+    assert "--all-running" in result.output
+
+@responses.activate
+def test_logs_all_running_no_jobs():
+    mock_get_root()
+    responses.add(
+        responses.POST, config.SERVER_URL+'/ps',
+        json=[{"jobid": "job-1", "status": "success"}], status=200
+    )
+    result = runner.invoke(cli.logs, ["--all-running"])
+    assert result.exit_code == 0
+    assert result.output == 'No running jobs\n'
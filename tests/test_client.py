@@ -0,0 +1,182 @@
+import json
+import time
+import pytest
+import responses
+from roro import config
+from firefly.client import FireflyError
+from firefly.validator import ValidationError
+from roro.client import get_client, RoroClient, TransientError, CircuitOpenError
+from .mock_server import MockServer
+from roro.projects import Project, Task
+
+SERVER_URL = "https://example.com"
+
+def test_get_client():
+    c1 = get_client("https://example.com")
+    c2 = get_client("https://example.com/")
+    assert c1 is c2
+    assert isinstance(c1, RoroClient)
+    assert get_client("https://new.example.com") is not c1
+
+def test_shared_client(monkeypatch):
+    monkeypatch.setattr(Project, "SERVER_URL", "https://example.com")
+
+    p1 = Project("test-project")
+    p2 = Project("another-project")
+    task = Task("abcd1234", "https://example.com")
+    assert p1.client is p2.client
+    assert task._client is p1.client
+
+def test_pool_size():
+    client = RoroClient("https://example.com", pool_size=4)
+    adapter = client.session.get_adapter("https://example.com/")
+    assert adapter._pool_maxsize == 4
+
+@responses.activate
+def test_metadata_cache(monkeypatch):
+    metadata = {"functions": {"ps": {"path": "/ps"}}}
+    responses.add(responses.GET, SERVER_URL + "/", json=metadata, headers={"ETag": "v1"})
+
+    assert RoroClient(SERVER_URL)._get_metadata() == metadata
+    assert RoroClient(SERVER_URL)._get_metadata() == metadata
+    assert len(responses.calls) == 1
+
+    # revalidate using the etag once the cache is expired
+    monkeypatch.setattr(config, "METADATA_CACHE_TTL", 0.01)
+    responses.replace(responses.GET, SERVER_URL + "/", status=304)
+    time.sleep(0.02)
+    assert RoroClient(SERVER_URL)._get_metadata() == metadata
+    assert responses.calls[1].request.headers["If-None-Match"] == "v1"
+
+@responses.activate
+def test_metadata_cache_refresh():
+    responses.add(responses.GET, SERVER_URL + "/", json={"functions": {}})
+    RoroClient(SERVER_URL)._get_metadata()
+
+    # the server now has the method at a different path
+    metadata = {"functions": {"whoami": {"path": "/v2/whoami"}}}
+    responses.replace(responses.GET, SERVER_URL + "/", json=metadata)
+    responses.add(responses.POST, SERVER_URL + "/whoami", json={"error": "not found"}, status=404)
+    responses.add(responses.POST, SERVER_URL + "/v2/whoami", json={"email": "user@test.com"})
+
+    client = RoroClient(SERVER_URL)
+    assert client.whoami() == {"email": "user@test.com"}
+    assert client._get_metadata() == metadata
+
+@responses.activate
+def test_retry_idempotent(monkeypatch):
+    monkeypatch.setattr(time, "sleep", lambda seconds: None)
+    server = MockServer(SERVER_URL)
+    server.add("ps", lambda project: [])
+    server.add("run", lambda project, command: {"jobid": "job-1"})
+
+    client = RoroClient(SERVER_URL)
+    server.fail("ps", times=2, status=503)
+    assert client.ps(project="test-project") == []
+
+    # not retried, the job may have been started
+    server.fail("run", times=1, status=502)
+    with pytest.raises(TransientError):
+        client.run(project="test-project", command="python train.py")
+
+@responses.activate
+def test_retry_idempotency_key(monkeypatch):
+    monkeypatch.setattr(time, "sleep", lambda seconds: None)
+    server = MockServer(SERVER_URL)
+    keys = []
+
+    def run(project, command, idempotency_key=None):
+        keys.append(idempotency_key)
+        return {"jobid": "job-1"}
+
+    server.add("run", run)
+    server.fail("run", times=1, status=503)
+
+    client = RoroClient(SERVER_URL)
+    assert client.run(project="test-project", command="python train.py") == {"jobid": "job-1"}
+    assert len(keys) == 1 and keys[0]
+    request_keys = [json.loads(call.request.body.decode("utf-8")).get("idempotency_key")
+                    for call in responses.calls if call.request.url.endswith("/run")]
+    assert request_keys == keys * 2
+
+@responses.activate
+def test_circuit_breaker(monkeypatch):
+    monkeypatch.setattr(config, "CIRCUIT_BREAKER_THRESHOLD", 3)
+    monkeypatch.setattr(time, "sleep", lambda seconds: None)
+    server = MockServer(SERVER_URL)
+    server.add("ps", lambda project: [])
+
+    client = RoroClient(SERVER_URL)
+    client._get_metadata()
+    server.fail("ps", times=10, status=503)
+    with pytest.raises(TransientError):
+        client.ps(project="test-project")
+    calls = len(responses.calls)
+
+    # fails fast without contacting the server
+    with pytest.raises(CircuitOpenError):
+        client.ps(project="test-project")
+    assert len(responses.calls) == calls
+
+    # and lets the calls through once the timeout is over
+    client.circuit_breaker.opened_at -= config.CIRCUIT_BREAKER_TIMEOUT
+    server.fail("ps", times=0)
+    assert client.ps(project="test-project") == []
+
+@responses.activate
+def test_batch():
+    server = MockServer(SERVER_URL)
+    server.add("get_config", lambda project: {"project": project})
+    batches = []
+
+    def batch(calls):
+        batches.append(calls)
+        return [{"result": server.functions[c["method"]](**c["params"])} if c["params"]["project"] != "bad"
+                else {"error": "No such project"} for c in calls]
+
+    server.add("batch", batch)
+
+    client = RoroClient(SERVER_URL)
+    with client.batch() as b:
+        results = [b.get_config(project=name) for name in ["a", "bad", "c"]]
+    assert len(batches) == 1
+    assert results[0].result() == {"project": "a"}
+    assert results[2].result() == {"project": "c"}
+    with pytest.raises(Exception) as e:
+        results[1].result()
+    assert str(e.value) == "No such project"
+
+@responses.activate
+def test_batch_errors():
+    server = MockServer(SERVER_URL)
+    server.add("get_config", lambda project: {"project": project})
+    server.add("batch", lambda calls: [
+        {"error": "Bad project name", "status": 400},
+        {"error": "Invalid arguments", "status": 422},
+    ][:len(calls)])
+
+    client = RoroClient(SERVER_URL)
+    with client.batch() as b:
+        results = [b.get_config(project="a"), b.get_config(project="b")]
+    with pytest.raises(ValueError):
+        results[0].result()
+    with pytest.raises(ValidationError):
+        results[1].result()
+
+    # the server must send a response for every call
+    b = client.batch()
+    for name in "abc":
+        b.get_config(project=name)
+    with pytest.raises(FireflyError):
+        b.execute()
+
+@responses.activate
+def test_batch_fallback():
+    server = MockServer(SERVER_URL)
+    server.add("get_config", lambda project: {"project": project})
+
+    client = RoroClient(SERVER_URL)
+    b = client.batch()
+    b.get_config(project="a")
+    b.get_config(project="b")
+    assert [r.result() for r in b.execute()] == [{"project": "a"}, {"project": "b"}]
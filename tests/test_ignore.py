@@ -0,0 +1,31 @@
+from roro.ignore import IgnoreRules
+
+def test_ignore_rules():
+    rules = IgnoreRules([
+        "# comment",
+        "*.log",
+        "/build",
+        "data/",
+        "docs/**/*.html",
+        "!important.log",
+    ])
+    assert rules.is_ignored("app.log")
+    assert rules.is_ignored("logs/app.log")
+    assert not rules.is_ignored("important.log")
+    assert rules.is_ignored("build", is_dir=True)
+    assert not rules.is_ignored("src/build", is_dir=True)
+    assert rules.is_ignored("data", is_dir=True)
+    assert rules.is_ignored("src/data", is_dir=True)
+    assert not rules.is_ignored("data")
+    assert rules.is_ignored("docs/index.html")
+    assert rules.is_ignored("docs/api/index.html")
+    assert not rules.is_ignored("index.html")
+
+def test_ignore_files(tmpdir):
+    tmpdir.join(".gitignore").write("data/\nvenv/\n")
+    tmpdir.join(".roroignore").write("!data/\n")
+    rules = IgnoreRules.from_directory(str(tmpdir))
+    assert rules.is_ignored(".git", is_dir=True)
+    assert rules.is_ignored("__pycache__", is_dir=True)
+    assert rules.is_ignored("venv", is_dir=True)
+    assert not rules.is_ignored("data", is_dir=True)
@@ -0,0 +1,34 @@
+import json
+import subprocess
+import sys
+
+# seconds allowed for importing roro.cli, as run by `roro --help`
+IMPORT_TIME_BUDGET = 0.5
+
+# modules that no subcommand needs at startup
+HEAVY_MODULES = ["firefly", "requests", "yaml", "tabulate", "joblib", "numpy", "roro.projects", "roro.client"]
+
+SCRIPT = """
+import json, sys, time
+start = time.time()
+from roro.cli import cli
+elapsed = time.time() - start
+try:
+    cli.main(args=["--help"])
+except SystemExit:
+    pass
+print(json.dumps({"elapsed": elapsed, "modules": sorted(sys.modules)}))
+"""
+
+def run_help():
+    output = subprocess.check_output([sys.executable, "-c", SCRIPT])
+    return json.loads(output.decode("utf-8").splitlines()[-1])
+
+def test_help_does_not_import_heavy_modules():
+    result = run_help()
+    assert [m for m in HEAVY_MODULES if m in result["modules"]] == []
+
+def test_import_time():
+    # the best of a few runs, to not fail on a busy machine
+    elapsed = min(run_help()["elapsed"] for i in range(3))
+    assert elapsed < IMPORT_TIME_BUDGET
@@ -0,0 +1,77 @@
+import gzip
+import json
+import pytest
+from roro import logexport
+
+def make_logs(n):
+    return [{"timestamp": 1000 * i, "message": "line {}".format(i)} for i in range(n)]
+
+@pytest.mark.parametrize("filename", ["logs.jsonl.gz", "logs.jsonl.zst"])
+def test_write_logs(monkeypatch, tmpdir, filename):
+    if filename.endswith(".zst"):
+        pytest.importorskip("zstandard")
+    monkeypatch.setattr(logexport, "BLOCK_SIZE", 100)
+    path = str(tmpdir.join(filename))
+    logs = make_logs(50)
+
+    assert logexport.write_logs(iter(logs), path) == 50
+    index = json.load(open(path + ".idx"))
+    assert index["compression"] == ("zstd" if filename.endswith(".zst") else "gzip")
+    assert len(index["blocks"]) > 10
+    assert sum(block["count"] for block in index["blocks"]) == 50
+
+    assert list(logexport.read_logs(path)) == logs
+    assert list(logexport.read_logs(path, since=10000, until=20000)) == logs[10:20]
+
+def test_read_logs_seeks(monkeypatch, tmpdir):
+    monkeypatch.setattr(logexport, "BLOCK_SIZE", 100)
+    path = str(tmpdir.join("logs.jsonl.gz"))
+    logexport.write_logs(make_logs(50), path)
+
+    decompressed = []
+    decompress = logexport._get_decompressor("gzip")
+    monkeypatch.setattr(logexport, "_get_decompressor",
+                        lambda compression: lambda data: decompressed.append(data) or decompress(data))
+    assert [log["timestamp"] for log in logexport.read_logs(path, since=40000, until=42000)] == [40000, 41000]
+    assert len(decompressed) <= 2
+
+def test_read_logs_without_index(tmpdir):
+    path = str(tmpdir.join("logs.jsonl.gz"))
+    logexport.write_logs(make_logs(10), path)
+    tmpdir.join("logs.jsonl.gz.idx").remove()
+
+    # the file is plain gzipped JSON lines
+    with gzip.open(path, "rb") as f:
+        assert [json.loads(line.decode("utf-8")) for line in f] == make_logs(10)
+    assert list(logexport.read_logs(path, since=5000)) == make_logs(10)[5:]
+
+def test_write_logs_interrupted(tmpdir):
+    path = str(tmpdir.join("logs.jsonl.gz"))
+
+    def follow(error):
+        for log in make_logs(10):
+            yield log
+        raise error
+
+    # the logs written until ctrl-c are kept
+    with pytest.raises(KeyboardInterrupt):
+        logexport.write_logs(follow(KeyboardInterrupt()), path)
+    assert list(logexport.read_logs(path)) == make_logs(10)
+
+    # and nothing is left behind on errors
+    other = str(tmpdir.join("other.jsonl.gz"))
+    with pytest.raises(IOError):
+        logexport.write_logs(follow(IOError("connection lost")), other)
+    assert sorted(f.basename for f in tmpdir.listdir()) == ["logs.jsonl.gz", "logs.jsonl.gz.idx"]
+
+def test_read_logs_unordered(monkeypatch, tmpdir):
+    monkeypatch.setattr(logexport, "BLOCK_SIZE", 100)
+    path = str(tmpdir.join("logs.jsonl.gz"))
+    # merged logs arrive slightly out of order
+    logs = make_logs(50)
+    for i in range(0, 50, 3):
+        logs[i]["timestamp"] += 2500
+    logexport.write_logs(logs, path)
+
+    expected = [log for log in logs if 10000 <= log["timestamp"] < 20000]
+    assert list(logexport.read_logs(path, since=10000, until=20000)) == expected
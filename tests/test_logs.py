@@ -0,0 +1,184 @@
+import datetime
+import io
+import json
+import threading
+import pytest
+import responses
+from roro import logs, logexport
+from roro.projects import Project
+from .mock_server import MockServer
+
+SERVER_URL = "https://example.com"
+
+LOGS = [
+    {"timestamp": 1000, "message": "a"},
+    {"timestamp": 2000, "message": "b"},
+    {"timestamp": 2000, "message": "c"},
+    {"timestamp": 3000, "message": "d"},
+]
+
+def test_log_cursor():
+    cursor = logs.LogCursor()
+    assert cursor.new_logs(LOGS[:2]) == LOGS[:2]
+    assert cursor.since == 2000
+    # the logs with the last timestamp are returned again by the server
+    assert cursor.new_logs(LOGS[1:3]) == LOGS[2:3]
+    assert cursor.new_logs(LOGS[1:]) == LOGS[3:]
+    assert cursor.new_logs(LOGS[3:]) == []
+
+def start_job(server_url, since_param=True):
+    """Starts a job that writes one more log on every fetch of its logs,
+    and the last one just before it finishes.
+    """
+    server = MockServer(server_url)
+    state = {"written": 1, "calls": [], "ps": 0}
+
+    def ps(project, jobid=None, all=False):
+        state["ps"] += 1
+        if state["written"] == len(LOGS) - 1:
+            state["written"] += 1
+            return {"jobid": jobid, "status": "success"}
+        return {"jobid": jobid, "status": "running"}
+
+    def get_logs(project, jobid, since=None):
+        state["calls"].append(since)
+        written = LOGS[:state["written"]]
+        state["written"] = min(state["written"] + 1, len(LOGS) - 1)
+        return [log for log in written if since is None or log["timestamp"] >= since]
+
+    server.add("ps", ps)
+    if since_param:
+        server.add("logs", get_logs)
+    else:
+        server.add("logs", lambda project, jobid: get_logs(project, jobid))
+    return server, state
+
+@responses.activate
+@pytest.mark.parametrize("since_param", [True, False])
+def test_follow_logs(monkeypatch, since_param):
+    monkeypatch.setattr("time.sleep", lambda seconds: None)
+    monkeypatch.setattr(Project, "SERVER_URL", SERVER_URL)
+    server, state = start_job(Project.SERVER_URL, since_param)
+
+    p = Project("test-project")
+    assert list(p.follow_logs("job-1")) == LOGS
+    # the status is checked only once there are no new logs
+    assert state["ps"] == 1
+    if since_param:
+        assert state["calls"] == [None, 1000, 2000, 2000, 2000]
+    else:
+        assert state["calls"] == [None] * 5
+
+@responses.activate
+def test_stream_logs(monkeypatch):
+    monkeypatch.setattr(Project, "SERVER_URL", SERVER_URL)
+    server, state = start_job(Project.SERVER_URL)
+
+    def stream_logs(project, jobid, since=None):
+        records = [log for log in LOGS if since is None or log["timestamp"] >= since]
+        records.append({"status": "success"})
+        return "".join(json.dumps(r) + "\n" for r in records).encode("utf-8")
+
+    server.add("stream_logs", stream_logs)
+
+    p = Project("test-project")
+    assert list(p.follow_logs("job-1")) == LOGS
+    assert list(p.follow_logs("job-1", since=2000)) == LOGS[1:]
+    # no polling when streaming
+    assert state["calls"] == []
+
+def test_read_ahead():
+    lines = [b"a\n", b"b\n", b"c\n", b"d\n"]
+    read, release = threading.Event(), threading.Event()
+
+    def stream():
+        for line in lines[:3]:
+            yield line
+        read.set()
+        release.wait()
+        yield lines[3]
+
+    items = logs._read_ahead(stream())
+    first = next(items)
+    read.wait()
+    # no idle marker while more lines are buffered
+    rest = [next(items) for i in range(3 if first is None else 2)]
+    assert None not in rest
+    assert [line for line in [first] + rest if line] == lines[:3]
+    assert next(items) is None
+    release.set()
+    assert [line for line in items if line] == lines[3:]
+
+def start_jobs(server_url, job_logs):
+    """Starts a server streaming the given logs for each job.
+    """
+    server = MockServer(server_url)
+
+    def stream_logs(project, jobid, since=None):
+        records = job_logs[jobid] + [{"status": "success"}]
+        return "".join(json.dumps(r) + "\n" for r in records).encode("utf-8")
+
+    server.add("stream_logs", stream_logs)
+    server.add("logs", lambda project, jobid: job_logs[jobid])
+    return server
+
+JOB_LOGS = {
+    "job-1": [{"timestamp": 1000, "message": "a"}, {"timestamp": 3000, "message": "c"}],
+    "job-2": [{"timestamp": 2000, "message": "b"}, {"timestamp": 4000, "message": "d"}],
+}
+
+@responses.activate
+@pytest.mark.parametrize("follow", [True, False])
+def test_merge_logs(monkeypatch, follow):
+    monkeypatch.setattr(Project, "SERVER_URL", SERVER_URL)
+    start_jobs(Project.SERVER_URL, JOB_LOGS)
+
+    p = Project("test-project")
+    merged = list(logs.merge_logs(p, ["job-1", "job-2"], follow=follow, delay=10))
+    assert [(log["jobid"], log["message"]) for log in merged] == [
+        ("job-1", "a"), ("job-2", "b"), ("job-1", "c"), ("job-2", "d")]
+
+@responses.activate
+def test_merge_logs_error(monkeypatch):
+    monkeypatch.setattr(Project, "SERVER_URL", SERVER_URL)
+    start_jobs(Project.SERVER_URL, JOB_LOGS)
+
+    p = Project("test-project")
+    with pytest.raises(Exception):
+        list(logs.merge_logs(p, ["job-1", "no-such-job"], follow=True, delay=0.1))
+
+def test_log_formatter():
+    log = {"timestamp": 1500000000123, "message": "hello", "jobid": "job-1"}
+    timestr = datetime.datetime.fromtimestamp(1500000000).isoformat()
+
+    assert logs.LogFormatter().format(log) == "hello\n"
+    assert logs.LogFormatter(show_timestamp=True).format(log) == "[{}] hello\n".format(timestr)
+    assert logs.LogFormatter(show_jobid=True).format(log) == "job-1: hello\n"
+    assert json.loads(logs.LogFormatter(raw=True).format(log)) == log
+
+class Stream(io.StringIO):
+    def __init__(self):
+        io.StringIO.__init__(self)
+        self.writes = []
+
+    def write(self, text):
+        self.writes.append(text)
+        return io.StringIO.write(self, text)
+
+def test_write_logs():
+    stream = Stream()
+    lines = [{"timestamp": 1000, "message": str(i)} for i in range(5)]
+    logs.write_logs(lines[:3] + [None] + lines[3:], stream, logs.LogFormatter(), batch_size=2)
+    assert stream.getvalue() == "0\n1\n2\n3\n4\n"
+    # written in batches, and whenever the logs are caught up
+    assert stream.writes == ["0\n1\n", "2\n", "3\n4\n"]
+
+@responses.activate
+def test_download_logs(monkeypatch, tmpdir):
+    monkeypatch.setattr(Project, "SERVER_URL", SERVER_URL)
+    start_jobs(Project.SERVER_URL, JOB_LOGS)
+
+    path = str(tmpdir.join("job-1.jsonl.gz"))
+    p = Project("test-project")
+    assert p.download_logs("job-1", path, until=2000) == 1
+    assert list(logexport.read_logs(path)) == JOB_LOGS["job-1"][:1]
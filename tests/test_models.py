@@ -0,0 +1,170 @@
+import io
+import json
+import os
+import joblib
+import numpy
+import pytest
+import responses
+from roro import serializers
+from roro.client import RoroClient
+from roro.modelcache import ModelCache
+from roro.models import ModelRepository, ModelImage
+
+SERVER_URL = "https://example.com"
+
+def mock_get_model(model):
+    f = io.BytesIO()
+    joblib.dump(model, f)
+    responses.add(responses.GET, SERVER_URL + "/", json={})
+    responses.add(
+        responses.POST, SERVER_URL + "/get_model",
+        body=f.getvalue(), content_type="application/octet-stream"
+    )
+
+def get_model_image(version=1, encoding="joblib"):
+    repo = ModelRepository(RoroClient(SERVER_URL), "credit-risk", "test-model")
+    metadata = {
+        "Model-ID": "f9b3e50c0426",
+        "Model-Name": "test-model",
+        "Model-Version": version,
+        "Content-Encoding": encoding
+    }
+    return ModelImage(repo=repo, metadata=metadata)
+
+@responses.activate
+def test_get_model():
+    mock_get_model({"weights": [1, 2, 3]})
+    image = get_model_image()
+    assert image.get_model() == {"weights": [1, 2, 3]}
+
+    # the model should be read from the cache this time
+    image = get_model_image()
+    assert image.get_model() == {"weights": [1, 2, 3]}
+    assert len([c for c in responses.calls if c.request.url.endswith("/get_model")]) == 1
+
+def test_model_cache_eviction(tmpdir):
+    cache = ModelCache(str(tmpdir), max_size=10)
+
+    def download(data):
+        return lambda f: f.write(data)
+
+    p1 = cache.fetch("a", download(b"12345"))
+    p2 = cache.fetch("b", download(b"12345"))
+    os.utime(p1, (0, 0))
+    os.utime(p2, (1, 1))
+    assert cache.get("a") == p1
+
+    # b is the least recently used one now
+    p3 = cache.fetch("c", download(b"12345"))
+    assert os.path.exists(p1)
+    assert not os.path.exists(p2)
+    assert not os.path.exists(p2 + ".lock")
+    assert os.path.exists(p3)
+    assert os.path.exists(p1 + ".lock")
+    assert cache.get("b") is None
+
+class PlainTextSerializer(serializers.BaseSerializer):
+    NAME = "text"
+    SUPPORTS_FILEOBJ = True
+
+    def dump(self, model, fileobj, compression=None):
+        fileobj.write(model.encode("utf-8"))
+
+    def load(self, filename, mmap_mode=None):
+        with open(filename) as f:
+            return f.read()
+
+    def can_dump(self, model):
+        return isinstance(model, str)
+
+@responses.activate
+def test_get_model_content_encoding(monkeypatch):
+    monkeypatch.setattr(serializers, "_SERIALIZERS", serializers._SERIALIZERS.copy())
+    serializers.register_serializer("text", PlainTextSerializer)
+
+    responses.add(responses.GET, SERVER_URL + "/", json={})
+    responses.add(
+        responses.POST, SERVER_URL + "/get_model",
+        body=b"hello", content_type="application/octet-stream"
+    )
+    image = get_model_image(version=2, encoding="text")
+    assert image.get_model() == "hello"
+
+@responses.activate
+def test_save(monkeypatch):
+    monkeypatch.setattr(serializers, "_SERIALIZERS", serializers._SERIALIZERS.copy())
+    serializers.register_serializer("text", PlainTextSerializer)
+
+    def save_model(request):
+        body = b"".join(request.body)
+        assert b"hello world" in body
+        assert b'name="Content-Encoding"\r\n\r\ntext' in body
+        return (200, {}, json.dumps({"Model-ID": "abcd1234", "Model-Version": 3}))
+
+    responses.add(responses.GET, SERVER_URL + "/", json={})
+    responses.add_callback(
+        responses.POST, SERVER_URL + "/save_model",
+        callback=save_model, content_type="application/json")
+
+    repo = ModelRepository(RoroClient(SERVER_URL), "credit-risk", "test-model")
+    image = repo.new_model_image("hello world", metadata={"Accuracy": 0.9})
+    image.save(comment="first version")
+    assert image.id == "abcd1234"
+    assert image.version == 3
+    assert image.comment == "first version"
+
+class OldTextSerializer(serializers.BaseSerializer):
+    NAME = "text"
+
+    def dump(self, model, filename):
+        with open(filename, "w") as f:
+            f.write(model)
+
+    def can_dump(self, model):
+        return isinstance(model, str)
+
+@responses.activate
+def test_save_without_compression_support(monkeypatch):
+    monkeypatch.setattr(serializers, "_SERIALIZERS", serializers._SERIALIZERS.copy())
+    serializers.register_serializer("text", OldTextSerializer)
+
+    responses.add(responses.GET, SERVER_URL + "/", json={})
+    responses.add(
+        responses.POST, SERVER_URL + "/save_model",
+        json={"Model-ID": "abcd1234", "Model-Version": 3})
+
+    repo = ModelRepository(RoroClient(SERVER_URL), "credit-risk", "test-model", compression="zlib")
+    image = repo.new_model_image("hello world", metadata={})
+    image.save()
+    assert image.version == 3
+    assert "Content-Compression" not in image._metadata
+
+class ArraySerializer(serializers.JoblibSerializer):
+    NAME = "joblib"
+
+    def can_dump(self, model):
+        return isinstance(model, dict)
+
+@pytest.mark.parametrize("compression", [None, "zlib"])
+@responses.activate
+def test_save_numpy_model(monkeypatch, compression):
+    monkeypatch.setattr(serializers, "_SERIALIZERS", serializers._SERIALIZERS.copy())
+    serializers.register_serializer("joblib", ArraySerializer)
+    model = {"coef": numpy.arange(1000.)}
+
+    saved = []
+    def save_model(request):
+        boundary = request.headers["Content-Type"].split("boundary=")[1].encode("ascii")
+        for part in b"".join(request.body).split(b"--" + boundary):
+            if b'name="model"' in part:
+                saved.append(part.split(b"\r\n\r\n", 1)[1][:-len(b"\r\n")])
+        return (200, {}, json.dumps({"Model-ID": "abcd1234", "Model-Version": 3}))
+
+    responses.add(responses.GET, SERVER_URL + "/", json={})
+    responses.add_callback(
+        responses.POST, SERVER_URL + "/save_model",
+        callback=save_model, content_type="application/json")
+
+    repo = ModelRepository(RoroClient(SERVER_URL), "credit-risk", "test-model", compression=compression)
+    repo.new_model_image(model, metadata={}).save()
+    assert (joblib.load(io.BytesIO(saved[0]))["coef"] == model["coef"]).all()
@@ -1,4 +1,15 @@
-from roro.projects import Project
+import hashlib
+import io
+import tarfile
+import pytest
+import responses
+from roro import config, packer, sync
+from roro.transfers import md5sum
+from roro.path import Path
+from roro.projects import Project, Task, TaskTimeoutError, wait_all, as_completed
+from .mock_server import MockServer
+
+SERVER_URL = "https://example.com"
 
 def test_server_url(monkeypatch):
     monkeypatch.setattr(Project, "SERVER_URL", "https://example.com")
@@ -12,3 +23,479 @@ def test_server_url(monkeypatch):
     p = ProjectSubClass("test-project")
     assert p.client.server_url == "https://new.example.com"
 
+
+def start_upload_server(server_url):
+    server = MockServer(server_url)
+    uploads = {}
+    files = {}
+    calls = []
+
+    def start_upload(project, volume, path, name, size, chunk_size):
+        upload_id = "upload-{}".format(len(uploads))
+        uploads[upload_id] = {"name": name, "chunks": {}}
+        return {"upload_id": upload_id}
+
+    def put_file_chunk(project, upload_id, index, checksum, chunk):
+        if upload_id not in uploads:
+            raise Exception("Unknown upload {}".format(upload_id))
+        assert hashlib.md5(chunk).hexdigest() == checksum
+        uploads[upload_id]["chunks"][int(index)] = chunk
+        calls.append(int(index))
+
+    def complete_upload(project, upload_id, chunks):
+        upload = uploads[upload_id]
+        files[upload["name"]] = b"".join(upload["chunks"][i] for i in range(int(chunks)))
+
+    server.add("start_upload", start_upload)
+    server.add("put_file_chunk", put_file_chunk)
+    server.add("complete_upload", complete_upload)
+    server.uploads = uploads
+    return server, files, calls
+
+@responses.activate
+def test_chunked_upload(monkeypatch, tmpdir):
+    monkeypatch.setattr(config, "UPLOAD_CHUNK_SIZE", 10)
+    monkeypatch.setattr(config, "TRANSFER_CONCURRENCY", 1)
+    monkeypatch.setattr(Project, "SERVER_URL", SERVER_URL)
+    server, files, calls = start_upload_server(Project.SERVER_URL)
+
+    data = b"".join(str(i).encode("ascii") for i in range(25))
+    src = tmpdir.join("dataset.txt")
+    src.write(data, mode="wb")
+
+    p = Project("test-project")
+    server.fail("put_file_chunk")
+    with pytest.raises(Exception):
+        p.copy(Path(str(src)), Path("data:/"))
+    assert "dataset.txt" not in files
+    assert sorted(calls) == [1, 2, 3]
+
+    # the second attempt should upload only the failed chunk
+    p.copy(Path(str(src)), Path("data:/"))
+    assert files["dataset.txt"] == data
+    assert sorted(calls) == [0, 1, 2, 3]
+
+@responses.activate
+def test_chunked_upload_expired(monkeypatch, tmpdir):
+    monkeypatch.setattr(config, "UPLOAD_CHUNK_SIZE", 10)
+    monkeypatch.setattr(config, "TRANSFER_CONCURRENCY", 1)
+    monkeypatch.setattr(Project, "SERVER_URL", SERVER_URL)
+    server, files, calls = start_upload_server(Project.SERVER_URL)
+
+    data = b"".join(str(i).encode("ascii") for i in range(25))
+    src = tmpdir.join("dataset.txt")
+    src.write(data, mode="wb")
+
+    p = Project("test-project")
+    server.fail("put_file_chunk")
+    with pytest.raises(Exception):
+        p.copy(Path(str(src)), Path("data:/"))
+
+    # the server has forgotten the upload, it starts over
+    server.uploads.clear()
+    p.copy(Path(str(src)), Path("data:/"))
+    assert files["dataset.txt"] == data
+    assert list(server.uploads) == ["upload-0"]
+    assert sorted(calls) == [0, 1, 1, 2, 2, 3, 3]
+
+@responses.activate
+def test_ranged_download(monkeypatch, tmpdir):
+    monkeypatch.setattr(config, "DOWNLOAD_CHUNK_SIZE", 10)
+    monkeypatch.setattr(config, "TRANSFER_CONCURRENCY", 1)
+    monkeypatch.setattr(Project, "SERVER_URL", SERVER_URL)
+
+    data = b"".join(str(i).encode("ascii") for i in range(25))
+    offsets = []
+
+    def get_file_range(project, volume, path, offset, length):
+        offsets.append(offset)
+        return data[offset:offset+length]
+
+    server = MockServer(Project.SERVER_URL)
+    server.add("stat_file", lambda project, volume, path: {"size": len(data), "md5": hashlib.md5(data).hexdigest()})
+    server.add("get_file_range", get_file_range)
+
+    p = Project("test-project")
+    dest = tmpdir.join("downloads").mkdir()
+    server.fail("get_file_range")
+    with pytest.raises(Exception):
+        p.copy(Path("data:/dataset.txt"), Path(str(dest)))
+    assert not dest.join("dataset.txt").exists()
+    assert sorted(offsets) == [10, 20, 30]
+
+    # the second attempt should download only the failed range
+    p.copy(Path("data:/dataset.txt"), Path(str(dest)))
+    assert dest.join("dataset.txt").read(mode="rb") == data
+    assert not dest.join("dataset.txt.tmp").exists()
+    assert sorted(offsets) == [0, 10, 20, 30]
+
+@responses.activate
+def test_small_download(monkeypatch, tmpdir):
+    monkeypatch.setattr(Project, "SERVER_URL", SERVER_URL)
+    data = b"small file"
+    calls = []
+
+    def get_file_range(project, volume, path, offset, length):
+        calls.append("get_file_range")
+        return data[offset:offset+length]
+
+    def get_file(project, volume, path):
+        calls.append("get_file")
+        return data
+
+    server = MockServer(Project.SERVER_URL)
+    server.add("stat_file", lambda project, volume, path: {"size": len(data)})
+    server.add("get_file_range", get_file_range)
+    server.add("get_file", get_file)
+
+    # files up to DOWNLOAD_CHUNK_SIZE are downloaded in one request
+    p = Project("test-project")
+    dest = tmpdir.join("downloads").mkdir()
+    p.copy(Path("data:/small.txt"), Path(str(dest)))
+    assert dest.join("small.txt").read(mode="rb") == data
+    assert calls == ["get_file"]
+
+def start_volume_server(server_url, files):
+    """Starts a stand-in server with a volume containing the given files.
+    """
+    server = MockServer(server_url)
+    deleted = []
+
+    def ls_volume(project, volume, path):
+        prefix = path.strip("/") + "/" if path.strip("/") else ""
+        items = {}
+        for name, data in files.items():
+            if name.startswith(prefix):
+                parts = name[len(prefix):].split("/")
+                if len(parts) > 1:
+                    items[parts[0]] = {"mode": "drwxr-xr-x", "size": 0, "name": parts[0]}
+                else:
+                    items[parts[0]] = {"mode": "-rw-r--r--", "size": len(data), "name": parts[0]}
+        return list(items.values())
+
+    def put_file(project, fileobj, volume, path, name, size):
+        files[path.strip("/")] = fileobj
+
+    def get_file(project, volume, path):
+        return files[path.strip("/")]
+
+    def delete_file(project, volume, path):
+        deleted.append(path.strip("/"))
+        del files[path.strip("/")]
+
+    server.add("ls_volume", ls_volume)
+    server.add("put_file", put_file)
+    server.add("get_file", get_file)
+    server.add("delete_file", delete_file)
+    return server, deleted
+
+@responses.activate
+def test_sync_upload(monkeypatch, tmpdir):
+    monkeypatch.setattr(Project, "SERVER_URL", SERVER_URL)
+    files = {"dataset/a.txt": b"aaa", "dataset/sub/b.txt": b"bb", "dataset/c.txt": b"c"}
+    start_volume_server(Project.SERVER_URL, files)
+
+    root = tmpdir.join("dataset")
+    root.join("a.txt").write("aaa", ensure=True)
+    root.join("sub", "b.txt").write("bbbb", ensure=True)
+    root.join("sub", "d.txt").write("dd", ensure=True)
+
+    p = Project("test-project")
+    changes = p.sync(Path(str(root)), Path("data:/dataset"), dry_run=True, delete=True)
+    assert changes == [("copy", "sub/b.txt"), ("copy", "sub/d.txt"), ("delete", "c.txt")]
+    assert files["dataset/sub/b.txt"] == b"bb"
+
+    p.sync(Path(str(root)), Path("data:/dataset"), delete=True)
+    assert files == {"dataset/a.txt": b"aaa", "dataset/sub/b.txt": b"bbbb", "dataset/sub/d.txt": b"dd"}
+
+@responses.activate
+def test_sync_download(monkeypatch, tmpdir):
+    monkeypatch.setattr(Project, "SERVER_URL", SERVER_URL)
+    files = {"dataset/a.txt": b"aaa", "dataset/sub/b.txt": b"bb"}
+    start_volume_server(Project.SERVER_URL, files)
+
+    root = tmpdir.join("dataset")
+    root.join("a.txt").write("aaa", ensure=True)
+
+    p = Project("test-project")
+    changes = p.sync(Path("data:/dataset"), Path(str(root)))
+    assert changes == [("copy", "sub/b.txt")]
+    assert root.join("sub", "b.txt").read() == "bb"
+
+@responses.activate
+def test_sync_checksum(monkeypatch, tmpdir, caplog):
+    monkeypatch.setattr(Project, "SERVER_URL", SERVER_URL)
+    server = MockServer(Project.SERVER_URL)
+    server.add("ls_volume", lambda project, volume, path: [
+        {"mode": "-rw-r--r--", "size": 3, "name": "a.txt", "md5": hashlib.md5(b"xyz").hexdigest()},
+        {"mode": "-rw-r--r--", "size": 2, "name": "b.txt"},
+        {"mode": "-rw-r--r--", "size": 1, "name": "c.txt", "md5": "0" * 32},
+    ])
+    hashed = []
+    monkeypatch.setattr(sync, "md5sum", lambda filename: hashed.append(filename) or md5sum(filename))
+
+    root = tmpdir.join("dataset")
+    root.join("a.txt").write("aaa", ensure=True)
+    root.join("b.txt").write("bb")
+    root.join("c.txt").write("cc")
+
+    p = Project("test-project")
+    changes = p.sync(Path(str(root)), Path("data:/dataset"), dry_run=True, checksum=True)
+    assert changes == [("copy", "a.txt"), ("copy", "c.txt")]
+    # only the files with a checksum of the same size to compare with are hashed
+    assert hashed == [str(root.join("a.txt"))]
+    assert "1 files were compared only by size" in caplog.text
+
+@responses.activate
+def test_incremental_deploy(monkeypatch, tmpdir):
+    monkeypatch.setattr(Project, "SERVER_URL", SERVER_URL)
+    store = {}
+    uploads = []
+    deploys = []
+
+    def put_blobs(project, blobs, format):
+        with tarfile.open(fileobj=io.BytesIO(blobs), mode="r") as tar:
+            for member in tar.getmembers():
+                uploads.append(tar.extractfile(member).read())
+                store[member.name] = uploads[-1]
+
+    def deploy_manifest(project, manifest, **kwargs):
+        deploys.append(manifest)
+        return {"task_id": "abcd1234"}
+
+    server = MockServer(Project.SERVER_URL)
+    server.add("missing_blobs", lambda project, hashes: [h for h in hashes if h not in store])
+    server.add("put_blobs", put_blobs)
+    server.add("deploy_manifest", deploy_manifest)
+
+    root = tmpdir.join("project").mkdir()
+    root.join("roro.yml").write("project: test-project\n")
+    root.join("src", "train.py").write("print('hello')\n", ensure=True)
+    monkeypatch.chdir(root)
+
+    p = Project("test-project")
+    p.deploy(async=True)
+    assert [f["path"] for f in deploys[0]] == ["roro.yml", "src/train.py"]
+    assert sorted(uploads) == [b"print('hello')\n", b"project: test-project\n"]
+
+    # only the modified file should be uploaded again
+    del uploads[:]
+    root.join("src", "train.py").write("print('hello world')\n")
+    p.deploy(async=True)
+    assert uploads == [b"print('hello world')\n"]
+
+@responses.activate
+@pytest.mark.parametrize("streamed", [True, False])
+def test_archive_deploy(monkeypatch, tmpdir, streamed):
+    monkeypatch.setattr(Project, "SERVER_URL", SERVER_URL)
+    deploys = []
+
+    def read_archive(format, archived_project):
+        mode = "r:gz" if format == "tar.gz" else "r:"
+        with tarfile.open(fileobj=io.BytesIO(archived_project), mode=mode) as tar:
+            return sorted(tar.getnames())
+
+    def deploy_streamed(project, archived_project, format, streamed, async=False):
+        deploys.append((format, read_archive(format, archived_project)))
+        return {"task_id": "abcd1234"}
+
+    def deploy(project, archived_project, size, format, async=False):
+        assert int(size) == len(archived_project)
+        deploys.append((format, read_archive(format, archived_project)))
+        return {"task_id": "abcd1234"}
+
+    server = MockServer(Project.SERVER_URL)
+    server.add("deploy", deploy_streamed if streamed else deploy)
+
+    root = tmpdir.join("project").mkdir()
+    root.join("roro.yml").write("project: test-project\n")
+    root.join(".roroignore").write("data/\n*.log\n")
+    root.join("src", "train.py").write("print('hello')\n", ensure=True)
+    root.join("src", "train.log").write("log\n")
+    root.join("data", "big.csv").write("1,2,3\n", ensure=True)
+    root.join(".git", "HEAD").write("ref: refs/heads/master\n", ensure=True)
+    monkeypatch.chdir(root)
+
+    p = Project("test-project")
+    p.deploy(async=True)
+    format = "tar.gz" if streamed else "tar"
+    assert deploys == [(format, [".roroignore", "roro.yml", "src/train.py"])]
+
+@pytest.mark.parametrize("format", ["tar", "tar.gz", "tar.zst"])
+def test_archive_is_deterministic(monkeypatch, tmpdir, format):
+    if format == "tar.zst":
+        pytest.importorskip("zstandard")
+    # larger files are not read ahead, make sure both paths are covered
+    monkeypatch.setattr(config, "COPY_BUFFER_SIZE", 16)
+
+    def make_tree(root):
+        root.join("roro.yml").write("project: test-project\n", ensure=True)
+        for i in range(40):
+            root.join("src", "module{}.py".format(i)).write("x = {}\n".format(i), ensure=True)
+        return root
+
+    def archive(root):
+        f = io.BytesIO()
+        packer.write_archive(str(root), f, format, concurrency=4)
+        return f.getvalue()
+
+    a = make_tree(tmpdir.join("a"))
+    data = archive(a)
+    b = make_tree(tmpdir.join("b"))
+    b.join("roro.yml").setmtime(0)
+    assert archive(b) == data
+
+    if format == "tar.zst":
+        import zstandard
+        data = zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    with tarfile.open(fileobj=io.BytesIO(data), mode="r:*") as tar:
+        names = tar.getnames()
+        assert names[0] == "roro.yml"
+        assert len(names) == 41
+        assert tar.extractfile("roro.yml").read() == b"project: test-project\n"
+        assert tar.getmember("src/module7.py").mtime == 0
+
+def start_task_server(server_url, statuses):
+    """Starts a server running a task that goes through the given statuses.
+    """
+    server = MockServer(server_url)
+    responses = iter(statuses)
+
+    def poll_task(task_id):
+        status = next(responses)
+        if status == "SUCCESS":
+            return {"status": status, "result": "done"}
+        return {"status": status}
+
+    server.add("poll_task", poll_task)
+    return server
+
+@responses.activate
+def test_task_wait(monkeypatch):
+    start_task_server(SERVER_URL, ["PENDING"] * 2 + ["STARTED"] * 4 + ["SUCCESS"])
+    delays = []
+    monkeypatch.setattr("time.sleep", delays.append)
+
+    statuses = []
+    task = Task("abcd1234", SERVER_URL)
+    result = task.wait(callback=lambda r: statuses.append(r["status"]),
+                       poll_interval=1, max_poll_interval=4)
+    assert result == "done"
+    assert statuses == ["PENDING", "STARTED", "SUCCESS"]
+
+    # the delays grow exponentially, with jitter, up to the maximum
+    assert len(delays) == 6
+    for delay, interval in zip(delays, [1, 2, 4, 4, 4, 4]):
+        assert interval / 2.0 <= delay <= interval
+
+@responses.activate
+def test_task_wait_timeout(monkeypatch):
+    start_task_server(SERVER_URL, [])
+    monkeypatch.setattr("time.sleep", lambda seconds: None)
+    now = [1000.0]
+    monkeypatch.setattr("time.time", lambda: now[0])
+
+    # every poll takes 2 seconds
+    task = Task("abcd1234", SERVER_URL)
+    def poll():
+        now[0] += 2
+        return {"status": "PENDING"}
+    task.poll = poll
+    with pytest.raises(TaskTimeoutError):
+        task.wait(timeout=10)
+    assert now[0] == 1010.0
+
+@responses.activate
+def test_task_wait_long_poll(monkeypatch):
+    server = start_task_server(SERVER_URL, ["PENDING"])
+    calls = []
+
+    def wait_task(task_id, status, timeout):
+        calls.append(status)
+        if status == "PENDING":
+            return {"status": "STARTED"}
+        return {"status": "SUCCESS", "result": "done"}
+
+    server.add("wait_task", wait_task)
+    monkeypatch.setattr("time.sleep", lambda seconds: pytest.fail("should not sleep"))
+
+    statuses = []
+    task = Task("abcd1234", SERVER_URL)
+    assert task.wait(callback=lambda r: statuses.append(r["status"])) == "done"
+    assert calls == ["PENDING", "STARTED"]
+    assert statuses == ["PENDING", "STARTED", "SUCCESS"]
+
+def start_tasks_server(server_url, rounds, batched=True):
+    """Starts a server with tasks "t0", "t1", ..., where task ti finishes
+    in the rounds[i]-th poll of it. Task "fail" fails on the first poll.
+    """
+    server = MockServer(server_url)
+    polls = {}
+    calls = []
+
+    def get_status(task_id):
+        if task_id == "fail":
+            return {"status": "FAILURE", "error": "task failed"}
+        polls[task_id] = polls.get(task_id, 0) + 1
+        if polls[task_id] >= rounds[int(task_id[1:])]:
+            return {"status": "SUCCESS", "result": task_id.upper()}
+        return {"status": "STARTED"}
+
+    def poll_tasks(task_ids):
+        calls.append(task_ids)
+        return {task_id: get_status(task_id) for task_id in task_ids}
+
+    def poll_task(task_id):
+        calls.append(task_id)
+        return get_status(task_id)
+
+    server.add("poll_task", poll_task)
+    if batched:
+        server.add("poll_tasks", poll_tasks)
+    return calls
+
+@responses.activate
+def test_as_completed(monkeypatch):
+    monkeypatch.setattr("time.sleep", lambda seconds: None)
+    calls = start_tasks_server(SERVER_URL, [3, 1, 2])
+
+    tasks = [Task("t{}".format(i), SERVER_URL) for i in range(3)]
+    assert [t.task_id for t in as_completed(tasks)] == ["t1", "t2", "t0"]
+    # one request per round, with only the pending tasks
+    assert calls == [["t0", "t1", "t2"], ["t0", "t2"], ["t0"]]
+    assert [t.result() for t in tasks] == ["T0", "T1", "T2"]
+
+@responses.activate
+def test_poll_tasks_missing(monkeypatch):
+    monkeypatch.setattr("time.sleep", lambda seconds: None)
+    server = MockServer(SERVER_URL)
+    calls = []
+
+    def poll_tasks(task_ids):
+        calls.append(task_ids)
+        # t1 is left out of the first response
+        if len(calls) == 1:
+            return {"t0": {"status": "SUCCESS", "result": "T0"}}
+        return {task_id: {"status": "SUCCESS", "result": task_id.upper()} for task_id in task_ids}
+
+    server.add("poll_task", lambda task_id: None)
+    server.add("poll_tasks", poll_tasks)
+
+    tasks = [Task("t0", SERVER_URL), Task("t1", SERVER_URL)]
+    assert wait_all(tasks) == ["T0", "T1"]
+    assert calls == [["t0", "t1"], ["t1"]]
+
+@responses.activate
+def test_wait_all(monkeypatch):
+    monkeypatch.setattr("time.sleep", lambda seconds: None)
+    calls = start_tasks_server(SERVER_URL, [2, 1], batched=False)
+
+    tasks = [Task("t0", SERVER_URL), Task("t1", SERVER_URL)]
+    assert wait_all(tasks) == ["T0", "T1"]
+    assert sorted(calls) == ["t0", "t0", "t1"]
+
+    tasks = [Task("t0", SERVER_URL), Task("fail", SERVER_URL)]
+    with pytest.raises(Exception) as e:
+        wait_all(tasks)
+    assert str(e.value) == "task failed"
+    assert tasks[0].done()
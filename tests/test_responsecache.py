@@ -0,0 +1,132 @@
+import time
+import pytest
+import responses
+from roro import config
+from roro.client import RoroClient
+from roro.responsecache import ResponseCache, get_response_cache
+from .mock_server import MockServer
+
+SERVER_URL = "https://example.com"
+
+def test_lru():
+    cache = ResponseCache(max_size=2, ttls={"get_config": 60})
+    calls = []
+
+    def get_config(project):
+        return cache.call("get_config", {"project": project}, lambda: calls.append(project) or {"project": project})
+
+    get_config("a")
+    get_config("b")
+    get_config("a")
+    get_config("c")  # evicts b
+    get_config("b")
+    assert calls == ["a", "b", "c", "b"]
+    assert cache.stats() == {"hits": 1, "misses": 4, "size": 2}
+
+def test_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("time.time", lambda: now[0])
+    cache = ResponseCache(ttls={"get_config": 60})
+    cache.put("get_config", "k", {"a": 1})
+    assert cache.get("k") == (True, {"a": 1})
+    now[0] += 61
+    assert cache.get("k") == (False, None)
+
+@pytest.fixture
+def server():
+    responses.start()
+    server = MockServer(SERVER_URL)
+    config_vars = {"A": "1"}
+    server.calls = []
+
+    def get_config(project):
+        server.calls.append("get_config")
+        return dict(config_vars)
+
+    def set_config(project, config_vars):
+        server.calls.append("set_config")
+
+    server.add("get_config", get_config)
+    server.add("set_config", set_config)
+    yield server
+    responses.stop()
+    responses.reset()
+
+def test_disabled(server):
+    client = RoroClient(server.server_url)
+    assert client.response_cache is None
+    client.get_config(project="p")
+    client.get_config(project="p")
+    assert server.calls == ["get_config", "get_config"]
+
+@pytest.mark.parametrize("cache", ["memory", "disk"])
+def test_client_cache(server, monkeypatch, cache):
+    monkeypatch.setattr(config, "RESPONSE_CACHE", cache)
+    client = RoroClient(server.server_url)
+    assert client.get_config(project="p") == {"A": "1"}
+    assert client.get_config(project="p") == {"A": "1"}
+    assert server.calls == ["get_config"]
+    assert client.response_cache.stats()["hits"] == 1
+
+    # persisted across clients, only on disk
+    client2 = RoroClient(server.server_url)
+    client2.get_config(project="p")
+    assert server.calls.count("get_config") == (1 if cache == "disk" else 2)
+
+    # invalidated by the mutating calls of the client
+    client.set_config(project="p", config_vars={"B": "2"})
+    client.get_config(project="p")
+    assert server.calls[-2:] == ["set_config", "get_config"]
+
+def test_batch(server, monkeypatch):
+    monkeypatch.setattr(config, "RESPONSE_CACHE", "memory")
+
+    def batch(calls):
+        return [{"result": server.functions[c["method"]](**c["params"])} for c in calls]
+
+    server.add("batch", batch)
+    client = RoroClient(server.server_url)
+    client.get_config(project="p")
+
+    # the cached reads are not sent to the server
+    with client.batch() as b:
+        result = b.get_config(project="p")
+    assert result.result() == {"A": "1"}
+    assert server.calls == ["get_config"]
+
+    # and the mutations drop them
+    with client.batch() as b:
+        b.set_config(project="p", config_vars={"B": "2"})
+    client.get_config(project="p")
+    assert server.calls == ["get_config", "set_config", "get_config"]
+
+def test_identity_only_for_disk(monkeypatch):
+    calls = []
+
+    def get_identity():
+        calls.append(1)
+        return "token"
+
+    assert get_response_cache("https://example.com", get_identity) is None
+    monkeypatch.setattr(config, "RESPONSE_CACHE", "memory")
+    get_response_cache("https://example.com", get_identity)
+    assert calls == []
+    monkeypatch.setattr(config, "RESPONSE_CACHE", "disk")
+    get_response_cache("https://example.com", get_identity)
+    assert calls == [1]
+
+def test_prune(tmpdir):
+    root = str(tmpdir.join("responses"))
+    cache = ResponseCache(max_size=2, ttls={"get_config": 60, "volumes": 60}, root=root)
+    for name in ["a", "b", "c"]:
+        cache.put("get_config", cache._make_key("get_config", {"project": name}), {})
+    cache.put("volumes", cache._make_key("volumes", {"project": "a"}), [])
+
+    # written by an earlier run, long expired
+    expired = tmpdir.join("responses", "volumes", "old.json")
+    expired.write("{}")
+    expired.setmtime(time.time() - 3600)
+
+    ResponseCache(max_size=2, ttls=cache.ttls, root=root).prune()
+    assert len(list(tmpdir.join("responses").visit("*.json"))) == 2
+    assert not expired.exists()
@@ -1,3 +1,4 @@
+import json
 import os.path
 from roro import serializers
 from sklearn.linear_model import LinearRegression
@@ -32,3 +33,38 @@ def test_save_model_keras(tmpdir):
     # and the file should be a h5 file
     f = h5py.File(filepath)
     assert "model_config" in f.attrs
+
+class JSONSerializer(serializers.BaseSerializer):
+    NAME = "json"
+
+    def dump(self, model, filename):
+        with open(filename, "w") as f:
+            json.dump(model, f)
+
+    def load(self, filename, mmap_mode=None):
+        with open(filename) as f:
+            return json.load(f)
+
+    def can_dump(self, model):
+        return isinstance(model, dict)
+
+def test_register_serializer(tmpdir, monkeypatch):
+    monkeypatch.setattr(serializers, "_SERIALIZERS", serializers._SERIALIZERS.copy())
+    serializers.register_serializer("json", JSONSerializer)
+
+    filepath = str(tmpdir.join("model.model"))
+    assert serializers.save_model({"x": 1}, filepath) == "json"
+    assert serializers.load_model(filepath, "json") == {"x": 1}
+
+def test_save_model_compression(tmpdir):
+    model = LinearRegression()
+
+    filepath = str(tmpdir.join("model.model"))
+    assert serializers.save_model(model, filepath, compression="zlib:1") == "joblib"
+    with open(filepath, "rb") as f:
+        assert f.read(1) == b"x"
+    assert isinstance(serializers.load_model(filepath, "joblib"), LinearRegression)
+
+def test_parse_compression():
+    assert serializers.parse_compression("zstd:9") == ("zstd", 9)
+    assert serializers.parse_compression("lz4") == ("lz4", None)